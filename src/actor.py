@@ -0,0 +1,66 @@
+"""Mailboxes that give every room a single worker, so rooms run in parallel but each one runs in order"""
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Deque, Tuple
+
+
+class Mailbox:
+    """
+    Work posted to a room, run one message at a time in the order it was posted.
+    Every room shares the threads of one executor, but a mailbox is only ever drained by one of them at once,
+    so the room's state is only touched by a single thread and needs no locking of its own
+    """
+
+    # Messages run before the mailbox goes to the back of the executor's queue, so a busy room can't starve the rest
+    BATCH_SIZE: int = 32
+
+    def __init__(self, executor: Executor) -> None:
+        self.executor: Executor = executor
+        self.messages: Deque[Tuple[Future, Callable[..., Any], tuple]] = deque()
+        self.lock = threading.Lock()
+        self.scheduled: bool = False
+
+    def ask(self, func: Callable[..., Any], *args: Any) -> Future:
+        """Post a call to the mailbox, the returned future gets its result or the exception it raised"""
+        future: Future = Future()
+        with self.lock:
+            self.messages.append((future, func, args))
+            if self.scheduled:
+                return future
+            self.scheduled = True
+        self.executor.submit(self.drain)
+        return future
+
+    def tell(self, func: Callable[..., Any], *args: Any) -> None:
+        """Post a call to the mailbox without waiting for it, an exception it raises is printed"""
+        self.ask(func, *args).add_done_callback(report_exception)
+
+    def drain(self) -> None:
+        """Run the posted messages until the mailbox is empty or a batch has been run"""
+        for _ in range(self.BATCH_SIZE):
+            with self.lock:
+                if not self.messages:
+                    self.scheduled = False
+                    return
+                future, func, args = self.messages.popleft()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(*args)
+            except Exception as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        # Still scheduled, so nothing else submits the mailbox while it waits for a thread again
+        self.executor.submit(self.drain)
+
+
+def report_exception(future: Future) -> None:
+    """Print the exception a message that nobody waits for raised"""
+    error = future.exception()
+    if error is not None:
+        traceback.print_exception(type(error), error, error.__traceback__)
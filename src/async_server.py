@@ -0,0 +1,129 @@
+"""asyncio server, every connection is served on a single event loop"""  # pylint: disable =redefined-builtin
+import asyncio
+
+from src.cache import MOVE_CACHE
+from src.client import ClientHandler
+from src.heartbeat import Heartbeat
+from src.outbound import FlowControl
+from src.protocol import RECV_SIZE, MessageDecoder, MessageTooLarge, UnknownMessageType
+from src.rooms import Room
+from src.utils import flush_print_default
+
+print = flush_print_default(print)
+
+
+class AsyncConnection(FlowControl):
+    """
+    What rooms send data through for a client served by the event loop.
+    Rooms send from the threads running the engine, so the write is handed over to the loop.
+    The transport buffers what the socket doesn't take, its size is what the watermarks are checked against
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop) -> None:
+        super().__init__()
+        self.writer: asyncio.StreamWriter = writer
+        self.loop: asyncio.AbstractEventLoop = loop
+        writer.transport.set_write_buffer_limits(high=self.HIGH_WATERMARK, low=self.LOW_WATERMARK)
+        self.limit_send_buffer(writer.get_extra_info("socket"))
+
+    def sendall(self, data: bytes) -> None:
+        """Queue data to be written to the client"""
+        self.loop.call_soon_threadsafe(self.write, data)
+
+    def write(self, data: bytes) -> None:
+        """Write data to the transport, on the loop"""
+        if self.writer.is_closing():
+            return
+        self.writer.write(data)
+
+        buffered = self.writer.transport.get_write_buffer_size()
+        if buffered > self.MAX_BUFFERED:
+            self.abort()
+        elif buffered > self.HIGH_WATERMARK and not self.is_congested():
+            self.set_congested()
+            self.loop.create_task(self.wait_drained())
+
+    async def wait_drained(self) -> None:
+        """Mark the connection drained once the transport is under its low watermark, disconnect it if it never is"""
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.MAX_CONGESTED_SECONDS)
+        except asyncio.TimeoutError:
+            self.abort()
+            return
+        except ConnectionError:
+            return
+        self.set_drained()
+
+    def abort(self, reason: str = "isn't reading what it is sent") -> None:
+        """Disconnect a client that can't keep up or has gone quiet, the coroutine reading from it sees the close"""
+        print(f"Disconnecting a client that {reason}")
+        # Also called by the heartbeat's thread, the transport is only touched on the loop
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+
+class AsyncServer:
+    """
+    Server class that handles all connections on one event loop instead of a thread each.
+    Game actions are run by the room's mailbox on the room workers, so the engine never runs on the loop
+    """
+
+    BACKLOG: int = 1024
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.server_rooms: Room = Room.instance()  # type: ignore
+        self.heartbeat: Heartbeat = Heartbeat()
+
+    def run(self) -> None:
+        """Entry to point to start server"""
+        self.server_rooms.start()
+        self.heartbeat.start()
+        try:  # So we can KeyBoard Interrupt
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.heartbeat.stop()
+            self.server_rooms.shutdown()
+        print("Shutting down server")
+        print(f"Move cache: {MOVE_CACHE.get_stats()}")
+
+    async def serve(self) -> None:
+        """Accept connections until the server is stopped"""
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, backlog=self.BACKLOG)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Read and service the data sent by a client until it disconnects"""
+        address = writer.get_extra_info("peername")[0]
+        client = ClientHandler(AsyncConnection(writer, asyncio.get_running_loop()), self.server_rooms)
+        decoder = MessageDecoder()
+        self.heartbeat.watch(client)
+        print(f"{address} has connected")
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    break
+
+                for message in decoder.feed(data):
+                    await self.service_data(client, message)
+        except (ConnectionError, MessageTooLarge, UnknownMessageType, ValueError):
+            pass
+        finally:
+            client.disconnect()
+            writer.close()
+        print(f"{address} has disconnected")
+
+    async def service_data(self, client: ClientHandler, data: dict) -> None:
+        """
+        Service the data on the loop, room actions are only posted to the room's mailbox.
+        Joining waits for the room to take the player, and so does queueing when it pairs the player,
+        so they wait off the loop
+        """
+        if isinstance(data, dict) and data.get("action") in ("join", "queue"):
+            await asyncio.get_running_loop().run_in_executor(None, client.service_message, data)
+        else:
+            client.service_message(data)
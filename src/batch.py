@@ -0,0 +1,235 @@
+"""
+Batched engine that works on many positions at once with NumPy
+
+Meant for offline jobs (game validation, opening statistics, load test fixtures) that have to look at a
+lot of positions. Every position is stored as a row of piece indexes, the same codes packed moves use,
+and the attack maps and pseudo-legal move masks of all of them are worked out together with vectorized
+shifts and masks on uint64 bitboards instead of a Python loop per board.
+
+    batch = BatchEngine.from_engines(engines)
+    targets = batch.pseudo_legal_targets(WHITE)  # (N, 64) bitboard of target squares per start square
+    counts = batch.move_counts(WHITE)
+    engine = batch.to_engine(0)
+"""
+from typing import Dict, Sequence, Type
+
+import numpy as np
+
+from src.bitboard import (
+    BISHOP,
+    BLACK,
+    CASTLES,
+    DIAGONAL,
+    KING,
+    KING_ATTACKS,
+    KNIGHT,
+    KNIGHT_ATTACKS,
+    ORTHOGONAL,
+    PAWN,
+    PAWN_ATTACKS,
+    QUEEN,
+    RAYS,
+    ROOK,
+    ROW_2,
+    ROW_5,
+    WHITE,
+)
+from src.game import GameEngine
+from src.move import PIECE_INDEX, PIECES
+
+# Shift amounts have to be uint64 as well, NumPy won't shift a uint64 array by a signed int
+ONE = np.uint64(1)
+SQUARE_BITS: np.ndarray = ONE << np.arange(64, dtype=np.uint64)
+
+RAY_TABLES: np.ndarray = np.array(RAYS, dtype=np.uint64)
+
+# Attack sets of the non-sliding pieces by color, piece type and square, sliders are left empty
+LEAPER_TABLES: np.ndarray = np.zeros((2, 6, 64), dtype=np.uint64)
+LEAPER_TABLES[:, KNIGHT] = KNIGHT_ATTACKS
+LEAPER_TABLES[:, KING] = KING_ATTACKS
+LEAPER_TABLES[:, PAWN] = PAWN_ATTACKS
+
+PIECE_NAMES: np.ndarray = np.array(PIECES)
+
+
+def slider_attacks(squares: np.ndarray, occupied: np.ndarray, directions: Sequence[int]) -> np.ndarray:
+    """
+    Return the attack sets of sliding pieces standing on squares with the matching occupancy,
+    stopping at (and including) the first blocker on every ray
+    """
+    attacks = np.zeros(len(squares), dtype=np.uint64)
+    for direction in directions:
+        ray = RAY_TABLES[direction][squares]
+        blockers = ray & occupied
+        if direction < 4:
+            # Nearest blocker is the lowest set bit, keep the ray up to and including it.
+            # Without blockers first is 0 and (0 << 1) - 1 wraps round to every square.
+            first = blockers & (~blockers + ONE)
+            attacks |= ray & ((first << ONE) - ONE)
+        else:
+            # Nearest blocker is the highest set bit, smear it downwards and keep the ray from it up
+            smear = blockers
+            for shift in (1, 2, 4, 8, 16, 32):
+                smear = smear | (smear >> np.uint64(shift))
+            attacks |= ray & ~(smear >> ONE)
+    return attacks
+
+
+def count_squares(bitboards: np.ndarray) -> np.ndarray:
+    """Return the number of set squares in every bitboard, summed over the last axis"""
+    # Parallel bit count, each step adds neighbouring groups of bits together
+    counts = bitboards - ((bitboards >> ONE) & np.uint64(0x5555555555555555))
+    counts = (counts & np.uint64(0x3333333333333333)) + ((counts >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    counts = (counts + (counts >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    counts = (counts * np.uint64(0x0101010101010101)) >> np.uint64(56)
+    return counts.sum(axis=-1, dtype=np.int64)
+
+
+class BatchEngine:
+    """
+    N positions stored as NumPy arrays.
+    pieces is (N, 64) piece indexes in square order, turns the color to move (WHITE or BLACK),
+    castle_rights the GameEngine castle rights bits and en_passant the en passant square or -1
+    """
+
+    def __init__(
+        self, pieces: np.ndarray, turns: np.ndarray, castle_rights: np.ndarray, en_passant: np.ndarray
+    ) -> None:
+        self.pieces: np.ndarray = np.ascontiguousarray(pieces, dtype=np.uint8).reshape(-1, 64)
+        self.turns: np.ndarray = np.asarray(turns, dtype=np.uint8)
+        self.castle_rights: np.ndarray = np.asarray(castle_rights, dtype=np.uint8)
+        self.en_passant: np.ndarray = np.asarray(en_passant, dtype=np.int8)
+
+        # The positions never change once the batch is made, so the attacks of each color are only worked out once
+        self.attack_cache: Dict[int, np.ndarray] = {}
+
+        # (N, 12) bitboards in the same order as BitboardEngine.bitboards
+        self.bitboards: np.ndarray = np.empty((len(self.pieces), 12), dtype=np.uint64)
+        for index in range(12):
+            packed = np.packbits(self.pieces == index + 1, axis=1, bitorder="little")
+            self.bitboards[:, index] = packed.view("<u8")[:, 0]
+
+    @classmethod
+    def from_engines(cls, engines: Sequence[GameEngine]) -> "BatchEngine":
+        """Create a batch from the current positions of some engines"""
+        pieces = np.array(
+            [[PIECE_INDEX[piece] for piece in engine.board.ravel().tolist()] for engine in engines], dtype=np.uint8
+        )
+        turns = np.array([WHITE if engine.player_turn == "white" else BLACK for engine in engines])
+        castle_rights = np.array([engine.castle_rights for engine in engines])
+        en_passant = np.array([engine.en_passant for engine in engines])
+        return cls(pieces, turns, castle_rights, en_passant)
+
+    def to_engine(self, index: int, backend: Type[GameEngine] = GameEngine, **kwargs: bool) -> GameEngine:
+        """Create an engine of the backend passed in with a single position of the batch"""
+        engine = backend(**kwargs)
+        engine.board = PIECE_NAMES[self.pieces[index]].reshape(8, 8)
+        engine.player_turn = "white" if self.turns[index] == WHITE else "black"
+        engine.load_position()
+        engine.castle_rights = int(self.castle_rights[index])
+        engine.en_passant = int(self.en_passant[index])
+        engine.zobrist_key = engine.compute_zobrist_key()
+        return engine
+
+    def __len__(self) -> int:
+        return len(self.pieces)
+
+    def occupancy(self, color: int) -> np.ndarray:
+        """Return every square occupied by a color, per position"""
+        return np.bitwise_or.reduce(self.bitboards[:, color * 6 : color * 6 + 6], axis=1)
+
+    def piece_attacks(self, color: int) -> np.ndarray:
+        """Return the (N, 64) squares attacked by the piece of a color on each square, 0 for other squares"""
+        if color in self.attack_cache:
+            return self.attack_cache[color]
+
+        # Only the squares holding a piece of the color are worked out, as flat arrays
+        offset = color * 6 + 1
+        positions, squares = np.nonzero((self.pieces >= offset) & (self.pieces < offset + 6))
+        piece_types = self.pieces[positions, squares] - offset
+
+        found = LEAPER_TABLES[color][piece_types, squares]
+        occupied = (self.occupancy(WHITE) | self.occupancy(BLACK))[positions]
+        for sliders, directions in (((BISHOP, QUEEN), DIAGONAL), ((ROOK, QUEEN), ORTHOGONAL)):
+            is_slider = np.isin(piece_types, sliders)
+            found[is_slider] |= slider_attacks(squares[is_slider], occupied[is_slider], directions)
+
+        attacks = np.zeros(self.pieces.shape, dtype=np.uint64)
+        attacks[positions, squares] = found
+        self.attack_cache[color] = attacks
+        return attacks
+
+    def attack_maps(self, color: int) -> np.ndarray:
+        """Return every square attacked by a color, per position"""
+        return np.bitwise_or.reduce(self.piece_attacks(color), axis=1)
+
+    def in_check(self) -> np.ndarray:
+        """Return whether the player to move is in check, per position"""
+        white_in_check = self.bitboards[:, KING] & self.attack_maps(BLACK) != 0
+        black_in_check = self.bitboards[:, 6 + KING] & self.attack_maps(WHITE) != 0
+        return np.where(self.turns == WHITE, white_in_check, black_in_check)
+
+    def castle_targets(self, color: int) -> np.ndarray:
+        """Return the squares the king of a color can castle to, per position"""
+        occupied = self.occupancy(WHITE) | self.occupancy(BLACK)
+        attacked = self.attack_maps(color ^ 1)
+        king = self.bitboards[:, color * 6 + KING]
+        rooks = self.bitboards[:, color * 6 + ROOK]
+
+        targets = np.zeros(len(self), dtype=np.uint64)
+        for right, king_start, king_end, rook_start, _, empty, safe_squares in CASTLES:
+            if (king_start > 7) != (color == WHITE):
+                continue
+            safe = np.uint64(sum(1 << square for square in (king_start,) + safe_squares))
+            allowed = (
+                (self.castle_rights & right != 0)
+                & (king >> np.uint64(king_start) & ONE == ONE)
+                & (rooks >> np.uint64(rook_start) & ONE == ONE)
+                & (occupied & np.uint64(empty) == 0)
+                & (attacked & safe == 0)
+            )
+            targets |= np.where(allowed, SQUARE_BITS[king_end], np.uint64(0))
+        return targets
+
+    def pseudo_legal_targets(self, color: int) -> np.ndarray:
+        """
+        Return the (N, 64) target squares of the piece of a color on each square.
+        These are the moves BitboardEngine lists for that color before checking they are legal,
+        en passant only for the player to move, plus castling, which is only added when it is allowed
+        """
+        own = self.occupancy(color)
+        enemy = self.occupancy(color ^ 1)
+        empty = ~(own | enemy)
+        pawns = self.bitboards[:, color * 6 + PAWN]
+
+        targets = self.piece_attacks(color) & ~own[:, None]
+
+        # Pawns only move diagonally to capture, en passant included
+        en_passant = np.where(
+            (self.en_passant >= 0) & (self.turns == color),
+            ONE << np.maximum(self.en_passant, 0).astype(np.uint64),
+            np.uint64(0),
+        )
+        is_pawn = self.pieces == color * 6 + PAWN + 1
+        np.copyto(targets, targets & (enemy | en_passant)[:, None], where=is_pawn)
+
+        # Pushes, the start square of every push is one or two rows behind the target
+        if color == WHITE:
+            single = (pawns >> np.uint64(8)) & empty
+            double = ((single & np.uint64(ROW_5)) >> np.uint64(8)) & empty
+            targets |= single[:, None] & (SQUARE_BITS >> np.uint64(8))
+            targets |= double[:, None] & (SQUARE_BITS >> np.uint64(16))
+        else:
+            single = (pawns << np.uint64(8)) & empty
+            double = ((single & np.uint64(ROW_2)) << np.uint64(8)) & empty
+            targets |= single[:, None] & (SQUARE_BITS << np.uint64(8))
+            targets |= double[:, None] & (SQUARE_BITS << np.uint64(16))
+
+        # Castling is listed under the king's square
+        king_squares = np.argmax(self.pieces == color * 6 + KING + 1, axis=1)
+        targets[np.arange(len(self)), king_squares] |= self.castle_targets(color)
+        return targets
+
+    def move_counts(self, color: int) -> np.ndarray:
+        """Return the number of pseudo-legal moves of a color, per position"""
+        return count_squares(self.pseudo_legal_targets(color))
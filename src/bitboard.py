@@ -0,0 +1,504 @@
+"""Bitboard backend for the server side game engine"""
+from typing import Dict, Iterator, List, Tuple, Type
+import numpy as np
+
+from src.game import BLACK_KING_SIDE, BLACK_QUEEN_SIDE, WHITE_KING_SIDE, WHITE_QUEEN_SIDE, GameEngine
+from src.move import CAPTURE, CASTLE, EN_PASSANT, PIECE_INDEX, PIECES, Move, castle_rook_squares, encode_move
+
+# Bitboards are indexed color * 6 + piece type, which is one less than the piece index used in packed moves
+BITBOARD_INDEX: dict = {piece: index for index, piece in enumerate(PIECES[1:])}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+WHITE, BLACK = 0, 1
+
+ROW_5: int = 0xFF << 40  # White pawns land here after a single push from their starting row
+ROW_2: int = 0xFF << 16  # Black pawns land here after a single push from their starting row
+FULL: int = (1 << 64) - 1
+COL_0: int = 0x0101010101010101
+COL_7: int = COL_0 << 7
+
+# Ray directions as (row, col) steps. The first four increase the square index,
+# so the nearest blocker along them is the lowest set bit, the last four the highest.
+RAY_DIRECTIONS: Tuple[Tuple[int, int], ...] = ((0, 1), (1, 0), (1, 1), (1, -1), (0, -1), (-1, 0), (-1, -1), (-1, 1))
+ORTHOGONAL: Tuple[int, ...] = (0, 1, 4, 5)
+DIAGONAL: Tuple[int, ...] = (2, 3, 6, 7)
+
+
+def iterate_squares(bitboard: int) -> Iterator[int]:
+    """Yield the index of every set square in a bitboard"""
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+def _bit(row: int, col: int) -> int:
+    """Return the bitboard with the single square set"""
+    return 1 << (row * 8 + col)
+
+
+def _leaper_table(offsets: List[Tuple[int, int]]) -> List[int]:
+    """Precompute the attack set of a non-sliding piece for every square"""
+    table: List[int] = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        attacks = 0
+        for add_row, add_col in offsets:
+            new_row, new_col = row + add_row, col + add_col
+            if 0 <= new_row <= 7 and 0 <= new_col <= 7:
+                attacks |= _bit(new_row, new_col)
+        table.append(attacks)
+    return table
+
+
+def _ray_table() -> List[List[int]]:
+    """Precompute the empty board ray from every square in every direction"""
+    table: List[List[int]] = []
+    for add_row, add_col in RAY_DIRECTIONS:
+        rays: List[int] = []
+        for square in range(64):
+            row, col = divmod(square, 8)
+            ray = 0
+            row, col = row + add_row, col + add_col
+            while 0 <= row <= 7 and 0 <= col <= 7:
+                ray |= _bit(row, col)
+                row, col = row + add_row, col + add_col
+            rays.append(ray)
+        table.append(rays)
+    return table
+
+
+def _line_tables() -> Tuple[List[List[int]], List[List[int]]]:
+    """
+    Precompute for every pair of squares on a common line the squares strictly between them
+    and the whole line through both (BETWEEN, LINE). Pairs not on a line are left empty.
+    """
+    between: List[List[int]] = [[0] * 64 for _ in range(64)]
+    line: List[List[int]] = [[0] * 64 for _ in range(64)]
+    for direction, rays in enumerate(RAYS):
+        opposite = (direction + 4) % 8
+        for start in range(64):
+            for end in iterate_squares(rays[start]):
+                between[start][end] = rays[start] & ~rays[end] & ~(1 << end)
+                line[start][end] = rays[start] | RAYS[opposite][start] | (1 << start)
+    return between, line
+
+
+# fmt: off
+KNIGHT_ATTACKS: List[int] = _leaper_table([(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (1, -2), (-1, 2), (1, 2)])
+KING_ATTACKS: List[int] = _leaper_table([(1, 1), (-1, 1), (1, -1), (-1, -1), (1, 0), (0, 1), (-1, 0), (0, -1)])
+PAWN_ATTACKS: Tuple[List[int], List[int]] = (_leaper_table([(-1, -1), (-1, 1)]), _leaper_table([(1, -1), (1, 1)]))
+RAYS: List[List[int]] = _ray_table()
+BETWEEN, LINE = _line_tables()
+
+# (right, king start, king end, rook start, rook end, squares that must be empty, squares that must be safe)
+CASTLES: Tuple[Tuple[int, int, int, int, int, int, Tuple[int, ...]], ...] = (
+    (WHITE_QUEEN_SIDE, 60, 58, 56, 59, _bit(7, 1) | _bit(7, 2) | _bit(7, 3), (59, 58)),
+    (WHITE_KING_SIDE, 60, 62, 63, 61, _bit(7, 5) | _bit(7, 6), (61, 62)),
+    (BLACK_QUEEN_SIDE, 4, 2, 0, 3, _bit(0, 1) | _bit(0, 2) | _bit(0, 3), (2, 3)),
+    (BLACK_KING_SIDE, 4, 6, 7, 5, _bit(0, 5) | _bit(0, 6), (5, 6)),
+)
+# fmt: on
+# The king's square and the squares that must be safe of each castle in CASTLES, as one bitboard
+CASTLE_SAFE: Tuple[int, ...] = tuple(
+    sum(1 << square for square in (king_start,) + safe_squares) for _, king_start, _, _, _, _, safe_squares in CASTLES
+)
+
+
+def slider_attacks(square: int, occupied: int, directions: Tuple[int, ...]) -> int:
+    """Attack set of a sliding piece, stopping at (and including) the first blocker on every ray"""
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][square]
+        blockers = ray & occupied
+        if blockers:
+            if direction < 4:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+def _slider_masks(directions: Tuple[int, ...]) -> List[int]:
+    """Precompute for every square the squares whose blockers change a slider's attacks, its rays without the edge"""
+    masks: List[int] = []
+    for square in range(64):
+        mask = 0
+        for direction in directions:
+            ray = RAYS[direction][square]
+            if ray:
+                mask |= ray ^ (1 << ray.bit_length() - 1 if direction < 4 else ray & -ray)
+        masks.append(mask)
+    return masks
+
+
+DIAGONAL_MASKS: List[int] = _slider_masks(DIAGONAL)
+ORTHOGONAL_MASKS: List[int] = _slider_masks(ORTHOGONAL)
+
+# Slider attacks by square and the blockers in its mask, filled in as positions reach them rather than at import.
+# At most 5,248 diagonal and 102,400 orthogonal entries in all, a game only ever reaches a small part of them
+DIAGONAL_ATTACKS: List[Dict[int, int]] = [{} for _ in range(64)]
+ORTHOGONAL_ATTACKS: List[Dict[int, int]] = [{} for _ in range(64)]
+
+
+def diagonal_attacks(square: int, occupied: int) -> int:
+    """Attack set of a bishop, looked up by the blockers that matter to it"""
+    blockers = occupied & DIAGONAL_MASKS[square]
+    attacks = DIAGONAL_ATTACKS[square].get(blockers)
+    if attacks is None:
+        attacks = DIAGONAL_ATTACKS[square][blockers] = slider_attacks(square, blockers, DIAGONAL)
+    return attacks
+
+
+def orthogonal_attacks(square: int, occupied: int) -> int:
+    """Attack set of a rook, looked up by the blockers that matter to it"""
+    blockers = occupied & ORTHOGONAL_MASKS[square]
+    attacks = ORTHOGONAL_ATTACKS[square].get(blockers)
+    if attacks is None:
+        attacks = ORTHOGONAL_ATTACKS[square][blockers] = slider_attacks(square, blockers, ORTHOGONAL)
+    return attacks
+
+
+class BitboardEngine(GameEngine):
+    """
+    GameEngine that generates moves from bitboards.
+    The numpy board and the castle rights, en passant and king squares are still kept
+    up to date by GameEngine, the bitboards are updated alongside them in make_move/undo_move
+    and are only used for move generation.
+    """
+
+    def load_position(self) -> None:
+        """Build the bitboards from the board array"""
+        self.bitboards: List[int] = [0] * 12
+        for (row, col), chess_square in np.ndenumerate(self.board):
+            if chess_square != "--":
+                self.bitboards[BITBOARD_INDEX[chess_square]] |= _bit(row, col)
+        super().load_position()
+
+    def make_move(self, move: int, player_invoked: bool = False) -> None:
+        """Make a move on the board and the bitboards"""
+        super().make_move(move, player_invoked)
+        self.toggle_move(self.move_log[-1])
+
+    def undo_move(self, player_invoked: bool = False) -> None:
+        """Undo the latest move on the board and the bitboards"""
+        self.toggle_move(self.move_log[-1])
+        super().undo_move(player_invoked)
+
+    def toggle_move(self, move: Move) -> None:
+        """
+        Apply a move_log entry to the bitboards.
+        Every update is an xor so applying the same entry again takes it back.
+        """
+        bitboards = self.bitboards
+        start, end = move.start, move.end
+
+        bitboards[BITBOARD_INDEX[move.piece_moved]] ^= (1 << start) | (1 << end)
+        if move.movetype == CASTLE:
+            rook_start, rook_end = castle_rook_squares(end)
+            bitboards[BITBOARD_INDEX[move.piece_moved] - KING + ROOK] ^= (1 << rook_start) | (1 << rook_end)
+        elif move.movetype == EN_PASSANT:
+            bitboards[BITBOARD_INDEX[move.piece_captured]] ^= 1 << (start & ~7 | end & 7)
+        elif move.piece_captured != "--":
+            bitboards[BITBOARD_INDEX[move.piece_captured]] ^= 1 << end
+
+    def occupancy(self, color: int) -> int:
+        """Return every square occupied by a color"""
+        bitboards = self.bitboards
+        offset = color * 6
+        return (
+            bitboards[offset]
+            | bitboards[offset + 1]
+            | bitboards[offset + 2]
+            | bitboards[offset + 3]
+            | bitboards[offset + 4]
+            | bitboards[offset + 5]
+        )
+
+    def attackers(self, square: int, color: int, occupied: int, removed: int = 0) -> int:
+        """
+        Return the pieces of a color that attack a square.
+        Pieces on the removed squares are ignored, e.g. because they were just captured.
+        """
+        bitboards = self.bitboards
+        offset = color * 6
+        keep = ~removed
+        diagonal = (bitboards[offset + BISHOP] | bitboards[offset + QUEEN]) & keep
+        orthogonal = (bitboards[offset + ROOK] | bitboards[offset + QUEEN]) & keep
+        attackers = (
+            (PAWN_ATTACKS[color ^ 1][square] & bitboards[offset + PAWN])
+            | (KNIGHT_ATTACKS[square] & bitboards[offset + KNIGHT])
+            | (KING_ATTACKS[square] & bitboards[offset + KING])
+        ) & keep
+        if diagonal:
+            attackers |= diagonal_attacks(square, occupied) & diagonal
+        if orthogonal:
+            attackers |= orthogonal_attacks(square, occupied) & orthogonal
+        return attackers
+
+    def attackers_of(self, square: int, by_color: str = "") -> List[int]:
+        """Return the squares of the pieces attacking a square, see GameEngine.attackers_of"""
+        occupied = self.occupancy(WHITE) | self.occupancy(BLACK)
+        if by_color:
+            colors: Tuple[int, ...] = (WHITE if by_color == "w" else BLACK,)
+        elif occupied >> square & 1:
+            colors = (BLACK if self.occupancy(WHITE) >> square & 1 else WHITE,)
+        else:
+            colors = (WHITE, BLACK)
+        attackers = 0
+        for color in colors:
+            attackers |= self.attackers(square, color, occupied)
+        return list(iterate_squares(attackers))
+
+    def is_square_attacked(self, square: int, by_color: str) -> bool:
+        """Return whether any piece of by_color attacks a square"""
+        occupied = self.occupancy(WHITE) | self.occupancy(BLACK)
+        return bool(self.attackers(square, WHITE if by_color == "w" else BLACK, occupied))
+
+    def king_square(self, color: int) -> int:
+        """Return the square of a color's king"""
+        return self.bitboards[color * 6 + KING].bit_length() - 1
+
+    def generate_pseudo_moves(self, color: int) -> List[int]:
+        """Generate the packed pseudo-legal moves of a color, excluding castling"""
+        moves = self.generate_piece_moves(color)
+        moves.extend(self.generate_king_moves(color))
+        moves.extend(self.generate_en_passant(color, legal=False))
+        return moves
+
+    def generate_piece_moves(self, color: int, evasions: int = FULL, pinned: int = 0) -> List[int]:
+        """
+        Generate the packed moves of a color's pawns and pieces other than the king, excluding en passant.
+        They only land on the evasions squares, and pinned pieces only move along the line through their king
+        """
+        bitboards = self.bitboards
+        offset = color * 6
+        own = self.occupancy(color)
+        enemy = self.occupancy(color ^ 1)
+        occupied = own | enemy
+        empty = ~occupied & FULL
+        line = LINE[self.king_square(color)]
+        piece_at = self.board.item
+        moves: List[int] = []
+        append = moves.append
+
+        # Moves are packed and squares are iterated inline rather than through encode_move and iterate_squares,
+        # this is the hot path
+        capture = CAPTURE << 12
+
+        # Pawns
+        pawns = bitboards[offset + PAWN]
+        if color == WHITE:
+            single = (pawns >> 8) & empty
+            double = ((single & ROW_5) >> 8) & empty
+            step = -8
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROW_2) << 8) & empty
+            step = 8
+        for ends, distance in ((single & evasions, step), (double & evasions, 2 * step)):
+            while ends:
+                bit = ends & -ends
+                ends ^= bit
+                end = bit.bit_length() - 1
+                start = end - distance
+                if pinned >> start & 1 and not line[start] >> end & 1:
+                    continue
+                append(start | end << 6)
+        pawn_attacks = PAWN_ATTACKS[color]
+        starts = pawns
+        while starts:
+            bit = starts & -starts
+            starts ^= bit
+            start = bit.bit_length() - 1
+            targets = pawn_attacks[start] & enemy & evasions
+            if pinned >> start & 1:
+                targets &= line[start]
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                end = bit.bit_length() - 1
+                append(start | end << 6 | capture | PIECE_INDEX[piece_at(end)] << 14)
+
+        # Pieces
+        allowed = ~own & evasions
+        for piece in (KNIGHT, BISHOP, ROOK, QUEEN):
+            starts = bitboards[offset + piece]
+            while starts:
+                bit = starts & -starts
+                starts ^= bit
+                start = bit.bit_length() - 1
+                if piece == KNIGHT:
+                    targets = KNIGHT_ATTACKS[start]
+                elif piece == BISHOP:
+                    targets = diagonal_attacks(start, occupied)
+                elif piece == ROOK:
+                    targets = orthogonal_attacks(start, occupied)
+                else:
+                    targets = diagonal_attacks(start, occupied) | orthogonal_attacks(start, occupied)
+                targets &= allowed
+                if pinned >> start & 1:
+                    targets &= line[start]
+                while targets:
+                    bit = targets & -targets
+                    targets ^= bit
+                    end = bit.bit_length() - 1
+                    if bit & enemy:
+                        append(start | end << 6 | capture | PIECE_INDEX[piece_at(end)] << 14)
+                    else:
+                        append(start | end << 6)
+
+        return moves
+
+    def generate_king_moves(self, color: int, attacked: int = 0) -> List[int]:
+        """Generate the packed moves of a color's king, excluding castling, to squares not in attacked"""
+        kings = self.bitboards[color * 6 + KING]
+        if not kings:
+            return []
+        king = kings.bit_length() - 1
+        own = self.occupancy(color)
+        enemy = self.occupancy(color ^ 1)
+        moves: List[int] = []
+        for end in iterate_squares(KING_ATTACKS[king] & ~own & ~attacked):
+            if enemy >> end & 1:
+                moves.append(king | end << 6 | CAPTURE << 12 | PIECE_INDEX[self.board.item(end)] << 14)
+            else:
+                moves.append(king | end << 6)
+        return moves
+
+    def generate_en_passant(self, color: int, legal: bool) -> List[int]:
+        """
+        Generate the packed en passant captures of a color, only the side to move has them.
+        Legal ones don't leave the king attacked, which pins alone don't show when both pawns leave the king's row
+        """
+        if self.en_passant == -1 or color != (WHITE if self.player_turn == "white" else BLACK):
+            return []
+        occupied = self.occupancy(WHITE) | self.occupancy(BLACK)
+        captured = ((color ^ 1) * 6 + PAWN + 1) << 14
+        moves: List[int] = []
+        for start in iterate_squares(PAWN_ATTACKS[color ^ 1][self.en_passant] & self.bitboards[color * 6 + PAWN]):
+            move = start | self.en_passant << 6 | EN_PASSANT << 12 | captured
+            if not legal or self.is_legal(move, color, occupied):
+                moves.append(move)
+        return moves
+
+    def is_legal(self, move: int, color: int, occupied: int) -> bool:
+        """Check the king of the moving color is not attacked once the move is made"""
+        start, end = move & 63, move >> 6 & 63
+        start_bit, end_bit = 1 << start, 1 << end
+        removed = end_bit
+        if move >> 12 & 3 == EN_PASSANT:
+            removed = 1 << (start & ~7 | end & 7)
+        occupied = (occupied ^ start_bit ^ removed) | end_bit
+
+        king = self.king_square(color)
+        if king == start:
+            king = end
+        return not self.attackers(king, color ^ 1, occupied, removed)
+
+    def castle_moves(self, color: int, occupied: int, attacked: int) -> List[int]:
+        """Return the castle moves a color is allowed to make, attacked is every square the opponent attacks"""
+        moves: List[int] = []
+        for (right, king_start, king_end, rook_start, _, empty, _), safe in zip(CASTLES, CASTLE_SAFE):
+            if not self.castle_rights & right or (king_start > 7) != (color == WHITE):
+                continue
+            if not self.bitboards[color * 6 + ROOK] >> rook_start & 1 or occupied & empty or attacked & safe:
+                continue
+            moves.append(encode_move(king_start, king_end, CASTLE))
+        return moves
+
+    def can_king_move(self, color: int, occupied: int) -> bool:
+        """Return whether a color's king has a square to move to or a castle with nothing in the way, safe or not"""
+        kings = self.bitboards[color * 6 + KING]
+        if not kings:
+            return False
+        if KING_ATTACKS[kings.bit_length() - 1] & ~self.occupancy(color):
+            return True
+        return any(
+            self.castle_rights & right and (king_start > 7) == (color == WHITE) and not occupied & empty
+            for right, king_start, _, _, _, empty, _ in CASTLES
+        )
+
+    def attacked_squares(self, color: int, occupied: int) -> int:
+        """Return every square the pieces of a color attack"""
+        bitboards = self.bitboards
+        offset = color * 6
+        pawns = bitboards[offset + PAWN]
+        if color == WHITE:
+            attacked = (pawns >> 9 & ~COL_7) | (pawns >> 7 & ~COL_0)
+        else:
+            attacked = (pawns << 7 & ~COL_7 & FULL) | (pawns << 9 & ~COL_0 & FULL)
+        for square in iterate_squares(bitboards[offset + KNIGHT]):
+            attacked |= KNIGHT_ATTACKS[square]
+        for square in iterate_squares(bitboards[offset + BISHOP] | bitboards[offset + QUEEN]):
+            attacked |= diagonal_attacks(square, occupied)
+        for square in iterate_squares(bitboards[offset + ROOK] | bitboards[offset + QUEEN]):
+            attacked |= orthogonal_attacks(square, occupied)
+        for square in iterate_squares(bitboards[offset + KING]):
+            attacked |= KING_ATTACKS[square]
+        return attacked
+
+    def generate_all_moves(self) -> None:
+        """Generate the pseudo-legal moves for both colors"""
+        self.white_moves = self.generate_pseudo_moves(WHITE)
+        self.black_moves = self.generate_pseudo_moves(BLACK)
+
+    def get_pinned(self, color: int, king: int, occupied: int) -> int:
+        """Return the pieces of a color pinned to its king"""
+        bitboards = self.bitboards
+        offset = (color ^ 1) * 6
+        snipers = (orthogonal_attacks(king, 0) & (bitboards[offset + ROOK] | bitboards[offset + QUEEN])) | (
+            diagonal_attacks(king, 0) & (bitboards[offset + BISHOP] | bitboards[offset + QUEEN])
+        )
+        own = self.occupancy(color)
+        pinned = 0
+        for sniper in iterate_squares(snipers):
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned |= blockers
+        return pinned
+
+    def generate_legal_moves(self) -> None:
+        """
+        Legal moves for the player to move and pseudo-legal moves for the opponent,
+        plus castling for both, matching what GameEngine produces.
+        The opponent's list is left empty with side_to_move_only.
+        Pins and checks are worked out once and the moves are only generated to the squares they allow
+        """
+        turn = WHITE if self.player_turn == "white" else BLACK
+        occupied = self.occupancy(WHITE) | self.occupancy(BLACK)
+        king = self.king_square(turn)
+        checkers = self.attackers(king, turn ^ 1, occupied)
+        pinned = self.get_pinned(turn, king, occupied)
+
+        # Squares a non-king move has to land on, FULL when not in check and nothing in double check
+        evasions = FULL
+        if checkers:
+            evasions = 0
+            if not checkers & (checkers - 1):
+                evasions = checkers | BETWEEN[king][checkers.bit_length() - 1]
+
+        move_lists: list = [[], []]
+        for color in (WHITE, BLACK):
+            if self.side_to_move_only and color != turn:
+                continue
+            # The opponent's attacks are only worked out when they can stop the king moving.
+            # Take the king off the board so it can't hide behind itself on a checking ray
+            attacked = FULL
+            if self.can_king_move(color, occupied):
+                attacked = self.attacked_squares(color ^ 1, occupied ^ self.bitboards[color * 6 + KING])
+            if color == turn:
+                moves = self.generate_piece_moves(color, evasions, pinned)
+                moves.extend(self.generate_king_moves(color, attacked))
+                moves.extend(self.generate_en_passant(color, legal=True))
+            else:
+                moves = self.generate_pseudo_moves(color)
+            moves.extend(self.castle_moves(color, occupied, attacked))
+            move_lists[color] = moves
+
+        self.white_moves, self.black_moves = move_lists
+
+
+# Move generator backends a game can be played on, by the name rooms, the engine pool and perft know them by
+ENGINE_BACKENDS: Dict[str, Type[GameEngine]] = {"array": GameEngine, "bitboard": BitboardEngine}
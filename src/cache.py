@@ -0,0 +1,70 @@
+"""Process wide cache of the moves worked out for a position"""
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class MoveCache:
+    """
+    Least recently used cache with a bounded size and hit/miss counters.
+    Shared by every room, so it is locked for the threads serving the players
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size: int = max_size
+        self.hits: int = 0
+        self.misses: int = 0
+        self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for a key, None if it isn't cached"""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Cache a value, dropping the least recently used entries once the cache is full"""
+        with self.lock:
+            if self.max_size <= 0:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def resize(self, max_size: int) -> None:
+        """Change how many entries the cache holds, 0 turns it off"""
+        with self.lock:
+            self.max_size = max_size
+            while len(self.entries) > max(max_size, 0):
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Empty the cache and reset the counters"""
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> dict:
+        """Return the size and hit/miss counters of the cache"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Position key -> (white moves, black moves, check status, gamestate), for every room in the process
+MOVE_CACHE_SIZE: int = 50_000
+MOVE_CACHE = MoveCache(MOVE_CACHE_SIZE)
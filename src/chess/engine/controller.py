@@ -1,11 +1,10 @@
 """Controller class for Player MVC"""  # pylint: disable=no-member,unbalanced-tuple-unpacking
 import os
-from typing import Callable
-import json
+from typing import Callable, Tuple
 import pygame
 from src.chess.engine.event import Event, EventManager, Highlight, QuitEvent, TickEvent
 from src.chess.engine.game import GameEngine
-from src.utils import invert_move
+from src.move import move_end, move_start, move_to_str
 
 
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
@@ -53,33 +52,35 @@ class Controller:
                     self.event_manager.post(Highlight((col, row)))
 
                     if len(self.player_clicks) == 2:
-                        move = self.convert_click_to_str()
+                        start, end = self.convert_click_to_squares()
 
-                        result = [valid_move for valid_move in self.model.moves if move in valid_move]
+                        result = [
+                            valid_move
+                            for valid_move in self.model.moves
+                            if move_start(valid_move) == start and move_end(valid_move) == end
+                        ]
                         if result:
-                            move = result[0]
-                            if self.model.color == "black":
-                                move = invert_move(move)
-                            self.make_move(move)
+                            self.make_move(move_to_str(result[0]))
                         self.reset_click()
 
     def make_move(self, move: str) -> None:
         """Make a move"""
-        message = json.dumps(
-            {"action": "game", "sub_action": "make_move", "payload": {"color": self.model.get_color(), "move": move}}
-        )
+        message = {
+            "action": "game",
+            "sub_action": "make_move",
+            "payload": {"color": self.model.get_color(), "move": move},
+        }
         self.send_to_server(message)
 
     def leave_room(self) -> None:
         """Make a move"""
-        message = json.dumps({"action": "leave_room", "sub_action": "leave"})
+        message = {"action": "leave_room", "sub_action": "leave"}
         self.send_to_server(message)
 
-    def convert_click_to_str(self) -> str:
-        """Convert player click tuple to xx:xx format"""
+    def convert_click_to_squares(self) -> Tuple[int, int]:
+        """Convert player click tuples to the start and end board squares"""
         (start_col, start_row), (end_col, end_row) = self.player_clicks
-        move = f"{start_col}{start_row}:{end_col}{end_row}"
-        return move
+        return self.model.to_board_square(start_col, start_row), self.model.to_board_square(end_col, end_row)
 
     def reset_click(self) -> None:
         """Reset the click variables"""
@@ -16,12 +16,20 @@ class ThreadQuitEvent(Event):
 class UpdateEvent(Event):
     """Used to update client side board"""
 
-    def __init__(self, board: list, moves: list, log: list, captured: dict, gamestate: dict):
+    def __init__(self, board: list, moves: list, log: list, captured: dict, gamestate: dict, sequence: int = 0):
         self.board: list = board
         self.moves: list = moves
         self.log: list = log
         self.captured: dict = captured
         self.gamestate = gamestate
+        self.sequence: int = sequence
+
+
+class DeltaEvent(Event):
+    """Used to apply the changes made by a single move to the client side board"""
+
+    def __init__(self, payload: dict):
+        self.payload: dict = payload
 
 
 class ViewUpdate(Event):
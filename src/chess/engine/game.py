@@ -1,7 +1,8 @@
 """Model class for MVC"""
+from typing import Tuple
 import numpy as np
-from src.chess.engine.event import EventManager, QuitEvent, TickEvent, UpdateEvent, Event
-from src.utils import invert_move
+from src.chess.engine.event import DeltaEvent, EventManager, QuitEvent, TickEvent, UpdateEvent, Event
+from src.move import parse_move
 
 
 class GameEngine:
@@ -13,11 +14,12 @@ class GameEngine:
         ev_manager.register_listener(self)
         self.running: bool = False
         self.gamestate: dict = {"gamestate": "Running", "winner": "None"}
-        self.moves: list = []
+        self.moves: list = []  # Packed moves in server board squares, see src/move.py
         self.move_log: list = []
         self.usernames: dict = {}
         self.color: str = "None"
         self.captured_pieces: dict = {}
+        self.sequence: int = -1  # Sequence number of the last update from the server
 
         """Default board constructor"""
         self.board: list = [
@@ -38,6 +40,10 @@ class GameEngine:
 
         if isinstance(event, UpdateEvent):
             self.update(event.board, event.moves, event.log, event.captured, event.gamestate)
+            self.sequence = event.sequence
+
+        if isinstance(event, DeltaEvent):
+            self.apply_delta(event.payload)
 
         if isinstance(event, TickEvent):
             pass
@@ -68,11 +74,45 @@ class GameEngine:
         self.move_log = move_log
         self.captured_pieces = captured_pieces
         self.gamestate = gamestate
+        self.moves = [parse_move(move) for move in moves]
         if self.color == "black":
             self.board = np.rot90(self.board, 2)  # type: ignore
-            self.moves = list(map(invert_move, moves))
-        else:
-            self.moves = moves
+
+    def get_sequence(self) -> int:
+        """Return the sequence number of the last update applied"""
+        return self.sequence
+
+    def apply_delta(self, payload: dict) -> None:
+        """Apply the squares, log entry and captured piece changed by the latest move"""
+        for square, piece in payload["changed"]:
+            col, row = self.to_screen_cords(square)
+            self.board[row][col] = piece
+
+        if payload["log"] is not None:
+            self.move_log.append(payload["log"])
+
+        captured = payload["captured"]
+        if captured is not None:
+            captured_by_color = self.captured_pieces.setdefault("white" if captured[0] == "w" else "black", [])
+            captured_by_color.append(captured)
+            captured_by_color.sort(key=lambda piece: "PNBRQ".index(piece[1]))
+
+        self.gamestate = payload["gamestate"]
+        self.moves = [parse_move(move) for move in payload["moves"]]
+        self.sequence = payload["sequence"]
+
+    def to_board_square(self, col: int, row: int) -> int:
+        """Convert a square on the screen to a server board square, black sees the board flipped"""
+        square = row * 8 + col
+        if self.color == "black":
+            return 63 - square
+        return square
+
+    def to_screen_cords(self, square: int) -> Tuple[int, int]:
+        """Convert a server board square to the (col, row) it is drawn at"""
+        if self.color == "black":
+            square = 63 - square
+        return square % 8, square // 8
 
     def run(self) -> None:
         """Starts the game engine loop"""
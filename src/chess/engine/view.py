@@ -13,6 +13,7 @@ from src.chess.engine.event import (
     UpdateEvent,
 )
 from src.chess.engine.game import GameEngine
+from src.move import move_end, move_start
 from src.utils import flush_print_default, invert_move
 
 
@@ -253,17 +254,15 @@ class View:
     def highlight_square(self) -> None:
         """Highlight the square that a user clicks on, also show possible moves if its their piece"""
         highlight: pygame.Surface = self.create_highlight("blue")
-        cords: str = "".join(str(point) for point in self.current_click)
+        square: int = self.gamemodel.to_board_square(*self.current_click)
 
         self.screen.blit(
             highlight, (self.current_click[0] * View.SIZE, View.TOP_PANEL + self.current_click[1] * View.SIZE)
         )
         for move in self.gamemodel.moves:
-            if cords == move.split(":")[0]:
-                self.screen.blit(
-                    highlight,
-                    (int(move.split(":")[1][0]) * View.SIZE, View.TOP_PANEL + int(move.split(":")[1][1]) * View.SIZE),
-                )
+            if move_start(move) == square:
+                col, row = self.gamemodel.to_screen_cords(move_end(move))
+                self.screen.blit(highlight, (col * View.SIZE, View.TOP_PANEL + row * View.SIZE))
 
     def play_sounds(self) -> None:
         """Play the sound based on the last move"""
@@ -1,50 +1,79 @@
-"""Threaded client module"""
-import json
+"""Client handler module"""
 import select
 import socket
 import threading
+import time
+from typing import Optional
 
-from src.rooms import Room, RoomFull, RoomNameAlreadyTaken, RoomNotFound, Rooms
+from src.matchmaking import Matchmaker
+from src.outbound import OutboundLoop, SocketConnection
+from src.protocol import (
+    JSON,
+    PONG,
+    PROTOCOLS,
+    RECV_SIZE,
+    MessageDecoder,
+    MessageTooLarge,
+    UnknownMessageType,
+    encode_message,
+)
+from src.rooms import (
+    InvalidRoomQuery,
+    Room,
+    RoomFull,
+    RoomNameAlreadyTaken,
+    RoomNotFound,
+    Rooms,
+    TooManyRooms,
+    TooManyRoomsForCreator,
+)
+from src.utils import Connection
 
+# Posted to a room for each player the matchmaker put in it, the game starts once both are
+WAITING: dict = {"action": "game", "sub_action": "waiting"}
 
-class ThreadedClient(threading.Thread):
-    """Threadclient class for each client that connects"""
 
-    def __init__(self, client: socket.socket, room: Room) -> None:
-        threading.Thread.__init__(self)
-        self.event: threading.Event = threading.Event()
-        self.client: socket.socket = client
+class ClientHandler:  # pylint: disable=too-few-public-methods
+    """
+    Services the actions sent by a client, shared by the threaded and the asyncio server.
+    Game and leave actions are posted to the room's mailbox, only joining waits for the room
+    """
+
+    def __init__(self, client: Connection, room: Room) -> None:
+        self.client: Connection = client
         self.server_room: Room = room
-        self.game_room: Rooms
+        self.game_room: Rooms = None  # type: ignore
         self.username: str = "None"
-
-    def run(self) -> None:
-        """Main function for threaded client"""
-        print(f"{self.client.getsockname()[0]} has connected")
-        while not self.event.is_set():
-            readable, _, _ = select.select([self.client], [], [], 2)
-            for obj in readable:
-                if obj is self.client:
-                    data = self.client.recv(4096)
-                    if not data:
-                        self.set_event()
-                        break
-
-                message = json.loads(data)
-                self.service_data(message)
-
-        print(f"{self.client.getsockname()[0]} has disconnected")
+        self.protocol: str = JSON  # Game updates are sent as JSON unless the client asks for binary
+        self.spectating: Optional[Rooms] = None
+        self.last_seen: float = time.monotonic()  # When the client last sent anything, the heartbeat checks it
+        self.closed: bool = False
+        # Held to close the client, and by the matchmaker to seat it, so a client is never seated once it has closed
+        self.close_lock = threading.Lock()
 
     def service_data(self, data: dict) -> None:
         """Parse the user data and service it accordingly"""
         response: dict = {"success": None, "payload": {}}
+        self.last_seen = time.monotonic()
+
+        if data["action"] == "ping":
+            self.client.sendall(encode_message(PONG))
+            return
+
+        if data["action"] == "pong":
+            return
 
         if data["action"] == "username":
             username = data["payload"]
             self.username = username
 
+            # Older clients don't send a protocol and keep getting JSON
+            if data.get("protocol") in PROTOCOLS:
+                self.protocol = data["protocol"]
+
             response["success"] = True
             response["payload"] = "Username set"
+            response["protocol"] = self.protocol
 
         elif data["action"] == "create":
             payload = data["payload"]
@@ -55,11 +84,17 @@ class ThreadedClient(threading.Thread):
             except RoomNameAlreadyTaken:
                 response["success"] = False
                 response["payload"] = "Room name is already taken"
+            except TooManyRooms:
+                response["success"] = False
+                response["payload"] = "The server has too many rooms, try again later"
+            except TooManyRoomsForCreator:
+                response["success"] = False
+                response["payload"] = "You have created too many rooms"
 
         elif data["action"] == "join":
             payload = data["payload"]
             try:
-                self.game_room = self.server_room.join(payload, self.client, self.username)
+                self.game_room = self.server_room.join(payload, self.client, self.username, self.protocol)
                 response["success"] = True
                 response["payload"] = f"Joined {payload}"
             except RoomNotFound:
@@ -69,13 +104,70 @@ class ThreadedClient(threading.Thread):
                 response["success"] = False
                 response["payload"] = "Room is full"
 
+        elif data["action"] == "spectate":
+            payload = data["payload"]
+            if self.game_room is not None or self.spectating is not None:
+                response["success"] = False
+                response["payload"] = "You are already in a room"
+            else:
+                try:
+                    self.spectating = self.server_room.get_game_room(payload)
+                except RoomNotFound:
+                    response["success"] = False
+                    response["payload"] = "Room not found"
+                else:
+                    # Answered before the room is told, so the reply reaches the spectator ahead of the game
+                    response["success"] = True
+                    response["payload"] = f"Spectating {payload}"
+                    self.client.sendall(encode_message(response))
+                    self.spectating.mailbox.tell(self.spectating.spectate, self.client, self.protocol)
+                    return
+
+        elif data["action"] == "queue":
+            payload = data.get("payload") or {}
+            rating = payload.get("rating", Matchmaker.DEFAULT_RATING)
+            time_control = payload.get("time_control", Matchmaker.DEFAULT_TIME_CONTROL)
+            if self.game_room is not None or self.spectating is not None or self.server_room.matchmaker.is_queued(self):
+                response["success"] = False
+                response["payload"] = "You are already in a room or queue"
+            elif not isinstance(rating, int) or not isinstance(time_control, str):
+                response["success"] = False
+                response["payload"] = "Invalid rating or time control"
+            elif self.server_room.directory.is_full():
+                response["success"] = False
+                response["payload"] = "The server has too many rooms, try again later"
+            else:
+                response["success"] = True
+                response["payload"] = "Waiting for an opponent"
+                self.client.sendall(encode_message(response))
+                self.find_opponent(rating, time_control)
+                return
+
         elif data["action"] == "get_rooms":
-            response["success"] = True
-            response["payload"] = self.server_room.get_all_rooms()
+            query = data.get("payload")
+            if not isinstance(query, dict):
+                # Older clients expect a list of rooms, they are sent the first page as one
+                rooms = self.server_room.get_rooms({})["rooms"]
+                response["success"] = True
+                response["payload"] = [(room["name"], room["creator"], room["players"]) for room in rooms]
+            else:
+                try:
+                    response["payload"] = self.server_room.get_rooms(query)
+                    response["success"] = True
+                except InvalidRoomQuery:
+                    response["success"] = False
+                    response["payload"] = "Invalid room query"
 
         elif data["action"] == "leave_room":
-            if self.game_room is not None:
-                self.game_room.leave(self.client)
+            if self.server_room.matchmaker.cancel(self):
+                response["success"] = True
+                response["payload"] = "You left the queue"
+            elif self.spectating is not None:
+                self.stop_spectating()
+                response["success"] = True
+                response["payload"] = "You stopped spectating"
+            elif self.game_room is not None:
+                self.game_room.mailbox.tell(self.game_room.leave, self.client)
                 self.game_room = None  # type: ignore
                 response["success"] = True
                 response["payload"] = "You left the room"
@@ -84,10 +176,112 @@ class ThreadedClient(threading.Thread):
                 response["payload"] = "You aren't in a room"
 
         elif data["action"] == "game":
-            self.game_room.service_data(data)
+            if self.game_room is not None:
+                self.game_room.mailbox.tell(self.game_room.service_data, data, self.client)
             return
 
-        self.client.send((json.dumps(response)).encode())
+        self.client.sendall(encode_message(response))
+
+    def find_opponent(self, rating: int, time_control: str) -> None:
+        """Play the closest rated opponent waiting in a room of their own, or wait in the queue for one"""
+        while True:
+            opponent = self.server_room.matchmaker.enqueue(self, rating, time_control)
+            if opponent is None:
+                return
+
+            # The player who waited longest plays white
+            room_name = self.server_room.create_match_room(opponent.username, self.username)
+            if opponent.matched(room_name):
+                self.matched(room_name)
+                return
+
+            # The opponent disconnected as they were paired, the room goes and the client looks for another
+            self.server_room.del_room(room_name)
+
+    def service_message(self, data: dict) -> None:
+        """Service a message from the client, one missing what its action needs is answered with an error"""
+        try:
+            self.service_data(data)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            self.client.sendall(encode_message({"success": False, "payload": "Malformed message"}))
+
+    def matched(self, room_name: str) -> bool:
+        """
+        Join the room the matchmaker made for this client and its opponent, and be ready to play in it.
+        Returns False if the client has disconnected and can't
+        """
+        with self.close_lock:
+            if self.closed:
+                return False
+            self.service_data({"action": "join", "payload": room_name})
+            self.service_data(WAITING)
+            return True
+
+    def stop_spectating(self) -> None:
+        """Stop being sent the game of the room being spectated, if any"""
+        if self.spectating is not None:
+            self.spectating.mailbox.tell(self.spectating.stop_spectating, self.client)
+            self.spectating = None
+
+    def disconnect(self) -> None:
+        """Leave the queue, the room or stop spectating once the client has disconnected, freeing their place"""
+        with self.close_lock:
+            self.closed = True
+        self.server_room.matchmaker.cancel(self)
+        self.stop_spectating()
+        if self.game_room is not None:
+            self.game_room.mailbox.tell(self.game_room.leave, self.client)
+            self.game_room = None  # type: ignore
+
+
+class ThreadedClient(ClientHandler, threading.Thread):
+    """
+    Threadclient class for each client that connects.
+    The thread only reads, what is sent to the client is written without blocking and the rest by the outbound loop
+    """
+
+    def __init__(self, client: socket.socket, room: Room, outbound: OutboundLoop) -> None:
+        threading.Thread.__init__(self)
+        self.connection: SocketConnection = SocketConnection(client, outbound)
+        ClientHandler.__init__(self, self.connection, room)
+        self.socket: socket.socket = client
+        self.event: threading.Event = threading.Event()
+        self.decoder: MessageDecoder = MessageDecoder()
+
+    def run(self) -> None:
+        """Main function for threaded client"""
+        print(f"{self.socket.getsockname()[0]} has connected")
+        try:
+            self.serve()
+        finally:
+            self.disconnect()
+            print(f"{self.socket.getsockname()[0]} has disconnected")
+            self.socket.close()
+
+    def serve(self) -> None:
+        """Read and service the data sent by the client until it disconnects or the thread is stopped"""
+        while not self.event.is_set():
+            readable, _, _ = select.select([self.socket], [], [], 2)
+            for obj in readable:
+                if obj is self.socket:
+                    try:
+                        data = self.socket.recv(RECV_SIZE)
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        data = b""
+                    if not data:
+                        self.set_event()
+                        break
+
+                    try:
+                        messages = self.decoder.feed(data)
+                    except (MessageTooLarge, UnknownMessageType, ValueError):
+                        # Frames that can't be decoded, the rest of the stream can't be trusted either
+                        self.set_event()
+                        break
+                    for message in messages:
+                        self.service_message(message)
 
     def set_event(self) -> None:
         """Stop the thread"""
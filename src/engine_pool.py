@@ -0,0 +1,103 @@
+"""Worker processes the rooms hand move generation to, so engine work isn't held to one core by the GIL"""
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Deque, List, Tuple, Type
+
+from src.cache import MOVE_CACHE
+from src.game import GameEngine
+
+
+def default_pool_size() -> int:
+    """Return the number of cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def generate_moves(engine_class: Type[GameEngine], fen: str, side_to_move_only: bool) -> Tuple[tuple, float]:
+    """Return what get_generated returns for a position, and the seconds the worker spent on it"""
+    started = time.perf_counter()
+    engine = engine_class.from_fen(fen, side_to_move_only=side_to_move_only)
+    generated = MOVE_CACHE.get(engine.get_cache_key())
+    if generated is None:
+        engine.generate_position()
+        generated = engine.get_generated()
+    return generated, time.perf_counter() - started
+
+
+def warm_up(engine_classes: List[Type[GameEngine]]) -> None:
+    """Import and build everything move generation needs, so the first real task isn't slowed down by it"""
+    for engine_class in engine_classes:
+        engine_class(side_to_move_only=True).generate_position()
+    MOVE_CACHE.clear()
+
+
+class EnginePool:
+    """
+    Worker processes that generate the moves of the rooms' positions.
+    Each room always goes to the same process, so its transpositions stay in that process's move cache,
+    and the room's thread only waits for the result
+    """
+
+    # Latest task latencies kept for the percentiles
+    LATENCY_SAMPLES: int = 1000
+
+    def __init__(self, processes: int = 0) -> None:
+        self.processes: int = processes or default_pool_size()
+        # Spawned rather than forked, the server forks from a process already running threads
+        context = multiprocessing.get_context("spawn")
+        self.executors: List[ProcessPoolExecutor] = [
+            ProcessPoolExecutor(1, mp_context=context) for _ in range(self.processes)
+        ]
+        self.lock = threading.Lock()
+        self.tasks: int = 0
+        self.latencies: Deque[float] = deque(maxlen=self.LATENCY_SAMPLES)
+        self.compute_times: Deque[float] = deque(maxlen=self.LATENCY_SAMPLES)
+        self.warm_up_time: float = 0.0
+
+    def warm_up(self, engine_classes: List[Type[GameEngine]]) -> float:
+        """Start every worker process and wait until it can generate moves, returns the seconds it took"""
+        started = time.perf_counter()
+        wait([executor.submit(warm_up, engine_classes) for executor in self.executors])
+        self.warm_up_time = time.perf_counter() - started
+        return self.warm_up_time
+
+    def generate(self, room_name: str, engine: GameEngine) -> tuple:
+        """Generate the moves of an engine's position on the room's worker process, waiting for the result"""
+        executor = self.executors[zlib.crc32(room_name.encode()) % self.processes]
+        started = time.perf_counter()
+        generated, compute_time = executor.submit(
+            generate_moves, engine.__class__, engine.to_fen(), engine.side_to_move_only
+        ).result()
+
+        with self.lock:
+            self.tasks += 1
+            self.latencies.append(time.perf_counter() - started)
+            self.compute_times.append(compute_time)
+        return generated
+
+    def get_stats(self) -> dict:
+        """Return the size of the pool and the latency of its latest tasks in milliseconds"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            compute_times = list(self.compute_times)
+            tasks = self.tasks
+
+        stats: dict = {"processes": self.processes, "warm_up_ms": round(self.warm_up_time * 1000, 1), "tasks": tasks}
+        if latencies:
+            stats["mean_ms"] = round(sum(latencies) / len(latencies) * 1000, 3)
+            stats["p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 3)
+            stats["p95_ms"] = round(latencies[int(len(latencies) * 0.95)] * 1000, 3)
+            stats["max_ms"] = round(latencies[-1] * 1000, 3)
+            stats["compute_mean_ms"] = round(sum(compute_times) / len(compute_times) * 1000, 3)
+        return stats
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -1,16 +1,54 @@
 """Game object"""
-from typing import Tuple, List
+from typing import Callable, List, Optional, Tuple
 import numpy as np
 
+from src.cache import MOVE_CACHE
+from src.move import (
+    CAPTURE,
+    CASTLE,
+    EN_PASSANT,
+    NORMAL,
+    PIECE_INDEX,
+    SQUARE_NAMES,
+    Move,
+    castle_rook_squares,
+    encode_move,
+    move_to_str,
+)
+from src.zobrist import BLACK_TO_MOVE_KEY, CASTLE_RIGHTS_KEYS, EN_PASSANT_KEYS, PIECE_KEYS
+
+# Castle rights bits, named after the side of the board the king moves to
+WHITE_QUEEN_SIDE, WHITE_KING_SIDE, BLACK_QUEEN_SIDE, BLACK_KING_SIDE = 1, 2, 4, 8
+
+# Castle rights lost when a move starts or ends on a square, i.e. the king or a rook moves or a rook is captured
+CASTLE_RIGHTS_LOST: List[int] = [0] * 64
+CASTLE_RIGHTS_LOST[60] = WHITE_QUEEN_SIDE | WHITE_KING_SIDE
+CASTLE_RIGHTS_LOST[56] = WHITE_QUEEN_SIDE
+CASTLE_RIGHTS_LOST[63] = WHITE_KING_SIDE
+CASTLE_RIGHTS_LOST[4] = BLACK_QUEEN_SIDE | BLACK_KING_SIDE
+CASTLE_RIGHTS_LOST[0] = BLACK_QUEEN_SIDE
+CASTLE_RIGHTS_LOST[7] = BLACK_KING_SIDE
+
+# FEN piece letters and castling letters, in the order they are written
+FEN_PIECES: dict = {"P": "wP", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK"}
+FEN_PIECES.update({letter.lower(): f"b{piece[1]}" for letter, piece in FEN_PIECES.items()})
+FEN_LETTERS: dict = {piece: letter for letter, piece in FEN_PIECES.items()}
+FEN_CASTLE_RIGHTS: dict = {"K": WHITE_KING_SIDE, "Q": WHITE_QUEEN_SIDE, "k": BLACK_KING_SIDE, "q": BLACK_QUEEN_SIDE}
+
 
 class GameEngine:
     """Holds the game state."""
 
     SORT_ORDER = {"P": 0, "N": 1, "B": 2, "R": 3, "Q": 4}
 
-    def __init__(self) -> None:
-        """Create new gamestate"""
+    def __init__(self, side_to_move_only: bool = False) -> None:
+        """
+        Create new gamestate.
+        With side_to_move_only the idle player's move list is left empty, only the player to move can act
+        and checks are found with is_square_attacked rather than from the opponent's moves
+        """
 
+        self.side_to_move_only: bool = side_to_move_only
         self.player_turn = "white"
         self.move_log: list = []
         self.move_log_fen: list = []
@@ -25,6 +63,15 @@ class GameEngine:
 
         self.gamestate: dict = {"gamestate": "Running", "winner": "None"}
 
+        # Position state kept up to date by make_move and restored by undo_move
+        self.castle_rights: int = 0
+        self.en_passant: int = -1  # Square a pawn can capture en passant on, -1 if there isn't one
+        self.king_squares: dict = {"w": 60, "b": 4}
+        self.halfmove_clock: int = 0  # Plies since the last capture or pawn move
+        self.fullmove_number: int = 1
+        self.zobrist_key: int = 0
+        self.state_history: list = []
+
         """Default board constructor"""
         self.board: np.ndarray = np.array(
             [
@@ -39,142 +86,114 @@ class GameEngine:
             ]
         )
 
-        self.generate_all_moves()
+        self.load_position()
 
-    def make_move(self, move: str, player_invoked: bool = False) -> None:
+    def make_move(self, move: int, player_invoked: bool = False) -> None:
         """
         Make a move
-        Move param is a string in the format of "start:end" e.g 10:30
+        Move param is a packed move, see src/move.py
         """
 
         # Parsing
-        movetype = move[-1]
-        if movetype in ("N", "T"):
-            start_cords, end_cords, movetype = move.split(":")
-            start_col, start_row = [int(x) for x in start_cords]
-            end_col, end_row = [int(x) for x in end_cords]
-
-            # Generate move data
-            piece_moved = self.board[start_row][start_col]
-            piece_captured = self.board[end_row][end_col]
-
-            if player_invoked and piece_captured != "--":
-                if piece_captured[0] == "w":
-                    self.white_captured.append(piece_captured)
-                else:
-                    self.black_captured.append(piece_captured)
+        start, end, movetype = move & 63, move >> 6 & 63, move >> 12 & 3
+        start_row, start_col = divmod(start, 8)
+        end_row, end_col = divmod(end, 8)
+
+        # Generate move data
+        piece_moved = self.board[start_row, start_col]
+        piece_captured = self.board[end_row, end_col]
+        key = self.zobrist_key ^ BLACK_TO_MOVE_KEY
+        key ^= PIECE_KEYS[PIECE_INDEX[piece_moved]][start] ^ PIECE_KEYS[PIECE_INDEX[piece_moved]][end]
+
+        if movetype == CASTLE:
+            rook_start, rook_end = castle_rook_squares(end)
+            rook = self.board[rook_start // 8, rook_start % 8]
+            self.board[rook_end // 8, rook_end % 8] = rook
+            self.board[rook_start // 8, rook_start % 8] = "--"
+            key ^= PIECE_KEYS[PIECE_INDEX[rook]][rook_start] ^ PIECE_KEYS[PIECE_INDEX[rook]][rook_end]
+
+        elif movetype == EN_PASSANT:
+            # The captured pawn is next to the pawn that takes it
+            piece_captured = self.board[start_row, end_col]
+            self.board[start_row, end_col] = "--"
+            key ^= PIECE_KEYS[PIECE_INDEX[piece_captured]][start_row * 8 + end_col]
 
-            # Add to move log
-            move_data = f"{start_cords}:{end_cords}:{piece_moved}:{piece_captured}:{movetype}"
-            self.move_log.append(move_data)
+        else:
+            key ^= PIECE_KEYS[PIECE_INDEX[piece_captured]][end]
 
-            # Make the move
-            self.board[end_row][end_col] = self.board[start_row][start_col]
-            self.board[start_row][start_col] = "--"
+        if player_invoked and piece_captured != "--":
+            if piece_captured[0] == "w":
+                self.white_captured.append(piece_captured)
+            else:
+                self.black_captured.append(piece_captured)
+
+        # Add to move log
+        self.move_log.append(Move(start, end, movetype, piece_moved, piece_captured))
+
+        # Update the position state
+        self.state_history.append((self.castle_rights, self.en_passant, self.halfmove_clock, self.zobrist_key))
+        key ^= CASTLE_RIGHTS_KEYS[self.castle_rights]
+        self.castle_rights &= ~(CASTLE_RIGHTS_LOST[start] | CASTLE_RIGHTS_LOST[end])
+        key ^= CASTLE_RIGHTS_KEYS[self.castle_rights]
+        if self.en_passant != -1:
+            key ^= EN_PASSANT_KEYS[self.en_passant]
+        self.en_passant = -1
+        if piece_moved[1] == "P" or piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if piece_moved[0] == "b":
+            self.fullmove_number += 1
+        if piece_moved[1] == "K":
+            self.king_squares[piece_moved[0]] = end
+        elif piece_moved[1] == "P" and abs(start - end) == 16:
+            self.en_passant = (start + end) // 2
+            key ^= EN_PASSANT_KEYS[self.en_passant]
+        self.zobrist_key = key
+
+        # Make the move
+        self.board[end_row, end_col] = piece_moved
+        self.board[start_row, start_col] = "--"
 
         # Switch turns
-
-        elif movetype == "C":
-            king_start, king_end, rook_start, rook_end, movetype = move.split(":")
-
-            king_start_col, king_start_row = [int(x) for x in king_start]
-            king_end_col, king_end_row = [int(x) for x in king_end]
-            rook_start_col, rook_start_row = [int(x) for x in rook_start]
-            rook_end_col, rook_end_row = [int(x) for x in rook_end]
-
-            self.board[king_end_row][king_end_col] = self.board[king_start_row][king_start_col]
-            self.board[king_start_row][king_start_col] = "--"
-
-            self.board[rook_end_row][rook_end_col] = self.board[rook_start_row][rook_start_col]
-            self.board[rook_start_row][rook_start_col] = "--"
-
-            move_data = f"{king_start}:{king_end}:{rook_start}:{rook_end}:{movetype}"
-            self.move_log.append(move_data)
-
-        elif movetype == "E":
-
-            start_cords, end_cords, _ = move.split(":")
-            start_col, start_row = [int(x) for x in start_cords]
-            end_col, end_row = [int(x) for x in end_cords]
-
-            passant_row = 0
-            if end_row == 2:
-                passant_row = 3
-            if end_row == 5:
-                passant_row = 4
-
-            piece_moved = self.board[start_row][start_col]
-            piece_captured = self.board[passant_row][end_col]
-
-            self.board[end_row][end_col] = self.board[start_row][start_col]
-            self.board[start_row][start_col] = "--"
-            self.board[passant_row][[end_col]] = "--"
-
-            if player_invoked and piece_captured != "--":
-                if piece_captured[0] == "w":
-                    self.white_captured.append(piece_captured)
-                else:
-                    self.black_captured.append(piece_captured)
-
-            move_data = f"{start_cords}:{end_cords}:{passant_row}:{piece_moved}:{piece_captured}:{movetype}"
-            self.move_log.append(move_data)
-
         self.switch_turns()
 
     def undo_move(self, player_invoked: bool = False) -> None:
         """
         Undo a move
-        Moves is the move_log are in the same format as in make_move
+        Moves is the move_log are Move records created in make_move
         """
 
         # Get latest move and parse it
-        move = self.move_log[-1]
-
-        movetype = move[-1]
-        if movetype in ("N", "T"):
-            start_cords, end_cords, piece_moved, piece_captured, movetype = move.split(":")
-            start_col, start_row = [int(x) for x in start_cords]
-            end_col, end_row = [int(x) for x in end_cords]
-
-            # Undo the move
-            self.board[start_row][start_col] = piece_moved
-            self.board[end_row][end_col] = piece_captured
-
-            if player_invoked and piece_captured != "--":
-                if piece_captured[0] == "w":
-                    self.white_captured.remove(piece_captured)
-                else:
-                    self.black_captured.remove(piece_captured)
-
-        elif movetype == "C":
-            king_start, king_end, rook_start, rook_end, movetype = move.split(":")
-
-            king_start_col, king_start_row = [int(x) for x in king_start]
-            king_end_col, king_end_row = [int(x) for x in king_end]
-            rook_start_col, rook_start_row = [int(x) for x in rook_start]
-            rook_end_col, rook_end_row = [int(x) for x in rook_end]
-
-            self.board[king_start_row][king_start_col] = self.board[king_end_row][king_end_col]
-            self.board[king_end_row][king_end_col] = "--"
-
-            self.board[rook_start_row][rook_start_col] = self.board[rook_end_row][rook_end_col]
-            self.board[rook_end_row][rook_end_col] = "--"
-
-        elif movetype == "E":
-            start_cords, end_cords, passant_row, piece_moved, piece_captured, movetype = move.split(":")
-            start_col, start_row = [int(x) for x in start_cords]
-            end_col, end_row = [int(x) for x in end_cords]
-
-            self.board[start_row][start_col] = piece_moved
-            self.board[end_row][end_col] = "--"
-
-            self.board[int(passant_row)][end_col] = piece_captured
+        move: Move = self.move_log[-1]
+        start_row, start_col = divmod(move.start, 8)
+        end_row, end_col = divmod(move.end, 8)
+
+        # Undo the move
+        self.board[start_row, start_col] = move.piece_moved
+        self.board[end_row, end_col] = move.piece_captured
+
+        if move.movetype == CASTLE:
+            rook_start, rook_end = castle_rook_squares(move.end)
+            self.board[rook_start // 8, rook_start % 8] = self.board[rook_end // 8, rook_end % 8]
+            self.board[rook_end // 8, rook_end % 8] = "--"
+
+        elif move.movetype == EN_PASSANT:
+            self.board[end_row, end_col] = "--"
+            self.board[start_row, end_col] = move.piece_captured
+
+        if player_invoked and move.piece_captured != "--":
+            if move.piece_captured[0] == "w":
+                self.white_captured.remove(move.piece_captured)
+            else:
+                self.black_captured.remove(move.piece_captured)
 
-            if player_invoked and piece_captured != "--":
-                if piece_captured[0] == "w":
-                    self.white_captured.remove(piece_captured)
-                else:
-                    self.black_captured.remove(piece_captured)
+        # Restore the position state
+        self.castle_rights, self.en_passant, self.halfmove_clock, self.zobrist_key = self.state_history.pop()
+        if move.piece_moved[1] == "K":
+            self.king_squares[move.piece_moved[0]] = move.start
+        if move.piece_moved[0] == "b":
+            self.fullmove_number -= 1
 
         # Remove move from move log
         self.move_log.pop()
@@ -193,7 +212,7 @@ class GameEngine:
         """Return the board"""
         return self.board
 
-    def get_white_moves(self) -> List[str]:
+    def get_white_moves(self) -> List[int]:
         """Return list of white moves"""
         return self.white_moves
 
@@ -204,15 +223,25 @@ class GameEngine:
         pieces: dict = {"white": self.white_captured, "black": self.black_captured}
         return pieces
 
-    def get_move_log(self) -> List[str]:
+    def get_move_log(self) -> List[Move]:
         """Return the move log"""
         return self.move_log
 
+    def get_changed_squares(self) -> List[Tuple[int, str]]:
+        """Return the squares the latest move changed, with the piece now on each"""
+        move: Move = self.move_log[-1]
+        squares = [move.start, move.end]
+        if move.movetype == CASTLE:
+            squares.extend(castle_rook_squares(move.end))
+        elif move.movetype == EN_PASSANT:
+            squares.append(move.start & ~7 | move.end & 7)
+        return [(square, self.board.item(square)) for square in squares]
+
     def get_fen_move_log(self) -> List[str]:
         """Return the fen move log"""
         return self.move_log_fen
 
-    def get_black_moves(self) -> List[str]:
+    def get_black_moves(self) -> List[int]:
         """Return list of black moves"""
         return self.black_moves
 
@@ -224,10 +253,13 @@ class GameEngine:
         """Return the current gamestate"""
         return self.gamestate
 
+    def get_king_square(self, king_piece: str) -> int:
+        """Return the square of the king piece passed in"""
+        return self.king_squares[king_piece[0]]
+
     def get_king_location(self, king_piece: str) -> str:
         """Return the kings location for the piece passed in"""
-        row, col = np.where(self.board == king_piece)
-        return f"{col[0]}{row[0]}"
+        return SQUARE_NAMES[self.get_king_square(king_piece)]
 
     def is_king_under_attack(self, color: str) -> bool:
         """Check if a king is under attack"""
@@ -237,18 +269,29 @@ class GameEngine:
         else:
             king_piece = "bK"
 
-        king_location = self.get_king_location(king_piece)
-        enemy_moves: list = []
+        enemy_color = "b" if king_piece == "wK" else "w"
+        return self.is_square_attacked(self.get_king_square(king_piece), enemy_color)
 
-        if king_piece == "wK":
-            enemy_moves = self.get_black_moves()
-        else:
-            enemy_moves = self.get_white_moves()
+    def attackers_of(self, square: int, by_color: str = "") -> List[int]:
+        """
+        Return the squares of the pieces attacking a square.
+        Only pieces of by_color are counted if it is given, otherwise the enemies of the piece on the square,
+        or both colors if the square is empty
+        """
+        if not by_color:
+            piece_color = self.board.item(square)[0]
+            if piece_color == "-":
+                return self.attackers_of(square, "w") + self.attackers_of(square, "b")
+            by_color = "b" if piece_color == "w" else "w"
 
-        for move in enemy_moves:
-            if king_location in move:
-                return True
-        return False
+        row, col = divmod(square, 8)
+        return [
+            attacker_row * 8 + attacker_col for attacker_row, attacker_col in self.get_attackers(row, col, by_color)
+        ]
+
+    def is_square_attacked(self, square: int, by_color: str) -> bool:
+        """Return whether any piece of by_color attacks a square"""
+        return bool(self.attackers_of(square, by_color))
 
     def is_in_bounds(self, new_x: int, new_y: int) -> bool:
         """Check if a set of cords is in-bounds"""
@@ -257,29 +300,22 @@ class GameEngine:
             return True
         return False
 
-    def convert_to_fen(self, move: str) -> str:
+    def convert_to_fen(self, move: Move) -> str:
         """Function responsible for converting a move to fen"""
-        move_type = move[-1]
         fen_string: str = ""
-        if move_type in ("N", "T"):
-            start, stop, piece, cap, _ = move.split(":")
-
-            results = self.convert_index_to_fen(start, stop)
-            start, stop = results
-            piece_notation = piece[1]
-            capture_notation = "x" if cap != "--" else ""
+        if move.movetype in (NORMAL, CAPTURE):
+            start, stop = self.convert_index_to_fen(SQUARE_NAMES[move.start], SQUARE_NAMES[move.end])
+            piece_notation = move.piece_moved[1]
+            capture_notation = "x" if move.piece_captured != "--" else ""
 
             fen_string = f"{piece_notation}{start}{capture_notation}{stop}"
 
-        elif move_type == "C":
-            rook_col: str
-            _, _, rook_start, _, _ = move.split(":")
-            rook_col, _ = rook_start  # type: ignore
-            if rook_col == "0":
+        elif move.movetype == CASTLE:
+            if move.end % 8 == 2:
                 fen_string = "0-0-0"
             else:
                 fen_string = "0-0"
-        elif move_type == "E":
+        elif move.movetype == EN_PASSANT:
             fen_string = "e.p"
 
         return fen_string
@@ -298,17 +334,193 @@ class GameEngine:
 
         return results
 
-    def get_moves(self) -> None:
-        """Call the functions that will generate all legal moves"""
-        # self.check_for_pawn_promotion()
+    @classmethod
+    def from_fen(cls, fen: str, **kwargs: bool) -> "GameEngine":
+        """
+        Create an engine with the position from a FEN string.
+        The move counters can be left off, keyword arguments are passed on to the engine
+        """
+        fields = fen.split()
+        if len(fields) == 4:
+            fields += ["0", "1"]
+        if len(fields) != 6:
+            raise InvalidFen(f"Expected 6 fields, got {len(fields)}")
+        placement, turn, castling, en_passant, halfmove_clock, fullmove_number = fields
+
+        board: list = []
+        for rank in placement.split("/"):
+            row: list = []
+            for letter in rank:
+                if letter.isdigit():
+                    row.extend(["--"] * int(letter))
+                elif letter in FEN_PIECES:
+                    row.append(FEN_PIECES[letter])
+                else:
+                    raise InvalidFen(f"Unknown piece {letter}")
+            if len(row) != 8:
+                raise InvalidFen(f"Rank {rank} isn't 8 squares")
+            board.append(row)
+        if len(board) != 8:
+            raise InvalidFen(f"Expected 8 ranks, got {len(board)}")
+        if sum(row.count("wK") for row in board) != 1 or sum(row.count("bK") for row in board) != 1:
+            raise InvalidFen("Each side needs exactly one king")
+
+        if turn not in ("w", "b"):
+            raise InvalidFen(f"Unknown side to move {turn}")
+        if castling != "-" and any(letter not in FEN_CASTLE_RIGHTS for letter in castling):
+            raise InvalidFen(f"Unknown castling rights {castling}")
+        if en_passant != "-":
+            # The square a pawn of the side that just moved passed over, with that pawn just past it
+            if (
+                len(en_passant) != 2
+                or en_passant[0] not in "abcdefgh"
+                or en_passant[1] != ("6" if turn == "w" else "3")
+            ):
+                raise InvalidFen(f"Invalid en passant square {en_passant}")
+            col = "abcdefgh".index(en_passant[0])
+            pawn_row, pawn = (3, "bP") if turn == "w" else (4, "wP")
+            if board[pawn_row][col] != pawn or board[8 - int(en_passant[1])][col] != "--":
+                raise InvalidFen(f"No pawn can be taken en passant on {en_passant}")
+        if not halfmove_clock.isdigit() or not fullmove_number.isdigit():
+            raise InvalidFen("Move counters must be numbers")
+
+        engine = cls(**kwargs)
+        engine.board = np.array(board)
+        engine.player_turn = "white" if turn == "w" else "black"
+        engine.load_position()
+
+        # load_position gives the rights of every king and rook still on their starting squares,
+        # the FEN can take rights away but can't give a right whose king or rook has left them
+        castle_rights = 0
+        for letter in castling.replace("-", ""):
+            castle_rights |= FEN_CASTLE_RIGHTS[letter]
+        if castle_rights & ~engine.castle_rights:
+            raise InvalidFen(f"Castling rights {castling} need the king and rook on their starting squares")
+        engine.castle_rights &= castle_rights
+        if en_passant != "-":
+            engine.en_passant = (8 - int(en_passant[1])) * 8 + "abcdefgh".index(en_passant[0])
+        engine.halfmove_clock = int(halfmove_clock)
+        engine.fullmove_number = int(fullmove_number)
+        engine.zobrist_key = engine.compute_zobrist_key()
+        return engine
+
+    def to_fen(self) -> str:
+        """Return the current position as a FEN string"""
+        ranks: list = []
+        for row in self.board.tolist():
+            rank = ""
+            empty = 0
+            for chess_square in row:
+                if chess_square == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += FEN_LETTERS[chess_square]
+            ranks.append(rank + (str(empty) if empty else ""))
+
+        castling = "".join(letter for letter, right in FEN_CASTLE_RIGHTS.items() if self.castle_rights & right)
+        en_passant = "-"
+        if self.en_passant != -1:
+            en_passant = f"{'abcdefgh'[self.en_passant % 8]}{8 - self.en_passant // 8}"
+
+        turn = "w" if self.player_turn == "white" else "b"
+        return f"{'/'.join(ranks)} {turn} {castling or '-'} {en_passant} {self.halfmove_clock} {self.fullmove_number}"
+
+    def load_position(self) -> None:
+        """
+        Prepare the move generator for the current board.
+        Castling is allowed for every king and rook still on their starting squares
+        """
+        for color in ("w", "b"):
+            row, col = np.where(self.board == f"{color}K")
+            self.king_squares[color] = int(row[0]) * 8 + int(col[0])
+
+        self.castle_rights = 0
+        for right, king_square, rook_square in (
+            (WHITE_QUEEN_SIDE, 60, 56),
+            (WHITE_KING_SIDE, 60, 63),
+            (BLACK_QUEEN_SIDE, 4, 0),
+            (BLACK_KING_SIDE, 4, 7),
+        ):
+            color = "w" if king_square == 60 else "b"
+            if self.board.item(king_square) == f"{color}K" and self.board.item(rook_square) == f"{color}R":
+                self.castle_rights |= right
+
+        self.en_passant = -1
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.state_history = []
+        self.zobrist_key = self.compute_zobrist_key()
         self.generate_all_moves()
-        self.filter_invalid_moves()
 
-        self.check_castle_rights_for_white()
-        self.check_castle_rights_for_black()
+    def compute_zobrist_key(self) -> int:
+        """Work out the Zobrist key of the current position from scratch, make_move keeps it up to date after that"""
+        key = 0
+        for square, chess_square in enumerate(self.board.ravel().tolist()):
+            key ^= PIECE_KEYS[PIECE_INDEX[chess_square]][square]
+        if self.player_turn == "black":
+            key ^= BLACK_TO_MOVE_KEY
+        key ^= CASTLE_RIGHTS_KEYS[self.castle_rights]
+        if self.en_passant != -1:
+            key ^= EN_PASSANT_KEYS[self.en_passant]
+        return key
+
+    def get_moves(self, generator: Optional[Callable[["GameEngine"], tuple]] = None) -> None:
+        """
+        Call the functions that will generate all legal moves.
+        Positions already seen by any room in the process are served from MOVE_CACHE,
+        the rest are generated here, or by the generator passed in when the work is done somewhere else
+        """
+        # self.check_for_pawn_promotion()
+        cache_key = self.get_cache_key()
+        generated = MOVE_CACHE.get(cache_key)
+        if generated is None and generator is not None:
+            generated = generator(self)
+            MOVE_CACHE.put(cache_key, generated)
+
+        if generated is None:
+            self.generate_position()
+        else:
+            self.load_generated(generated)
 
         self.generate_fen_nation_move_log()
+        if self.check_status:
+            self.mark_check_in_move_log()
+
+    def get_cache_key(self) -> tuple:
+        """Return the key the moves of the current position are cached under"""
+        return (self.zobrist_key, self.__class__, self.side_to_move_only)
+
+    def generate_position(self) -> None:
+        """Generate the legal moves, check status and gamestate of the current position and cache them"""
+        self.generate_legal_moves()
         self.check_gamestate()
+        MOVE_CACHE.put(self.get_cache_key(), self.get_generated())
+
+    def get_generated(self) -> tuple:
+        """
+        Return the white moves, black moves, check status and gamestate generated for the current position.
+        Copies, the engine changes its move lists and check status in place
+        """
+        return (tuple(self.white_moves), tuple(self.black_moves), dict(self.check_status), dict(self.gamestate))
+
+    def load_generated(self, generated: tuple) -> None:
+        """Use moves, check status and gamestate generated for the current position by get_generated"""
+        white_moves, black_moves, check_status, gamestate = generated
+        self.white_moves, self.black_moves = list(white_moves), list(black_moves)
+        self.check_status, self.gamestate = dict(check_status), dict(gamestate)
+
+    def generate_legal_moves(self) -> None:
+        """Fill the move lists with the legal moves for the current position"""
+        self.generate_all_moves()
+        self.filter_invalid_moves()
+
+        if not self.side_to_move_only or self.player_turn == "white":
+            self.check_castle_rights_for_white()
+        if not self.side_to_move_only or self.player_turn == "black":
+            self.check_castle_rights_for_black()
 
     def generate_all_moves(self) -> None:
         """Function that calls get moves"""
@@ -322,6 +534,8 @@ class GameEngine:
         # Loop board and get moves for each pieace
         for index, chess_square in np.ndenumerate(self.board):  # type: ignore
             if chess_square != "--":
+                if self.side_to_move_only and chess_square[0] != self.player_turn[0]:
+                    continue
 
                 array: list = []
                 piece_color, piece_type = chess_square  # type: ignore
@@ -352,7 +566,7 @@ class GameEngine:
 
                 # Check if the square is empty
                 if self.board[new_row][new_col] == "--":
-                    array.append(f"{col}{row}:{new_col}{new_row}:N")
+                    array.append(encode_move(row * 8 + col, new_row * 8 + new_col))
                     if not is_continious:  # If piece type doesn't continuously move e.g Knight, Pawn, King etc..
                         break
                     new_row += add_x
@@ -362,7 +576,11 @@ class GameEngine:
                     if self.board[new_row][new_col][0] == piece_color:
                         break
                     # Collides with enemy piece
-                    array.append(f"{col}{row}:{new_col}{new_row}:T")
+                    array.append(
+                        encode_move(
+                            row * 8 + col, new_row * 8 + new_col, CAPTURE, PIECE_INDEX[self.board[new_row][new_col]]
+                        )
+                    )
                     break
 
     def get_pawn_moves(self, index: Tuple[int, int], array: list, chess_square: str) -> None:
@@ -384,13 +602,13 @@ class GameEngine:
 
             # One square move
             if self.board[row + direction][col] == "--":  # If empty
-                array.append(f"{col}{row}:{col}{row + direction}:N")
+                array.append(encode_move(row * 8 + col, (row + direction) * 8 + col))
 
                 # Two square move
                 if (
                     not self.has_pawn_moved(row, piece_color) and self.board[row + (direction * 2)][col] == "--"
                 ):  # If its empty and pawn hasn't moved
-                    array.append(f"{col}{row}:{col}{row+(direction*2)}:N")
+                    array.append(encode_move(row * 8 + col, (row + direction * 2) * 8 + col))
 
             # Captures
             for add_y in movements:
@@ -398,7 +616,8 @@ class GameEngine:
                 if 0 <= new_y <= 7:  # In-bounds
                     if self.board[row + direction][new_y][0] != "-":  # Not empty square
                         if self.board[row + direction][new_y][0] != piece_color:  # Collides with enemy
-                            array.append(f"{col}{row}:{new_y}{row+direction}:T")
+                            captured = PIECE_INDEX[self.board[row + direction][new_y]]
+                            array.append(encode_move(row * 8 + col, (row + direction) * 8 + new_y, CAPTURE, captured))
 
     def has_pawn_moved(self, current_row: int, piece_color: str) -> bool:
         """Given a row and color return whether a pawn has moved"""
@@ -410,170 +629,238 @@ class GameEngine:
         return True
 
     def filter_invalid_moves(self) -> None:
-        """Remove illegal moves"""
-        black_invalid = []  # This will hold in valid moves
-        white_invalid = []
-
-        if self.player_turn == "white":
-            for white_move in self.white_moves:
-                self.make_move(white_move)
-                self.generate_all_moves()
-                for opponent_move in self.black_moves:
-                    white_king_location = self.get_king_location("wK")
-                    if white_king_location in opponent_move:
-                        white_invalid.append(white_move)
-                        break
-                self.undo_move()
-                self.generate_all_moves()
+        """
+        Remove illegal moves for the player to move.
+        The pins and checks on the king are worked out once, then each move is tested against them
+        """
+        piece_color = "w" if self.player_turn == "white" else "b"
+        enemy_color = "b" if piece_color == "w" else "w"
+        moves = self.white_moves if piece_color == "w" else self.black_moves
+
+        king_square = self.get_king_square(f"{piece_color}K")
+        king_row, king_col = divmod(king_square, 8)
+        pins = self.get_pins(king_row, king_col, piece_color)
+        checkers = self.attackers_of(king_square, enemy_color)
+
+        # Squares a non-king move has to land on to deal with a single check
+        block_squares: set = set()
+        if len(checkers) == 1:
+            checker = divmod(checkers[0], 8)
+            block_squares = self.get_squares_between((king_row, king_col), checker)
+            block_squares.add(checker)
+
+        legal_moves: list = []
+        for move in moves:
+            start_row, start_col = divmod(move & 63, 8)
+            end_row, end_col = divmod(move >> 6 & 63, 8)
+
+            if (start_row, start_col) == (king_row, king_col):
+                # The king can't step onto an attacked square, including squares behind it on a checking ray
+                if not self.get_attackers(end_row, end_col, enemy_color, ignore=(king_row, king_col)):
+                    legal_moves.append(move)
+            elif move >> 12 & 3 == EN_PASSANT:
+                # En passant removes two pieces from the capturing row, so just try it
+                if self.is_en_passant_legal(move, king_square, enemy_color):
+                    legal_moves.append(move)
+            elif len(checkers) > 1:
+                continue
+            elif checkers and (end_row, end_col) not in block_squares:
+                continue
+            elif (start_row, start_col) in pins and (end_row, end_col) not in pins[(start_row, start_col)]:
+                continue
+            else:
+                legal_moves.append(move)
+
+        if piece_color == "w":
+            self.white_moves = legal_moves
         else:
-            for black_move in self.black_moves:
-                self.make_move(black_move)
-                self.generate_all_moves()
-                for opponent_move in self.white_moves:
-                    black_king_location = self.get_king_location("bK")
-                    if black_king_location in opponent_move:
-                        black_invalid.append(black_move)
-                        break
-                self.undo_move()
-                self.generate_all_moves()
+            self.black_moves = legal_moves
 
-        self.black_moves = list(set(self.black_moves) - set(black_invalid))
-        self.white_moves = list(set(self.white_moves) - set(white_invalid))
+    def get_attackers(
+        self, row: int, col: int, enemy_color: str, ignore: Tuple[int, int] = (-1, -1)
+    ) -> List[Tuple[int, int]]:
+        """
+        Return the (row, col) of every enemy piece attacking a square.
+        The ignore square is treated as empty, e.g. the king that is moving away
+        """
+        attackers: List[Tuple[int, int]] = []
+        board = self.board
+
+        # Pawns attack diagonally towards the other side of the board
+        pawn_row = row + 1 if enemy_color == "w" else row - 1
+        for pawn_col in (col - 1, col + 1):
+            if self.is_in_bounds(pawn_row, pawn_col) and board[pawn_row][pawn_col] == f"{enemy_color}P":
+                attackers.append((pawn_row, pawn_col))
+
+        for piece_type in ("N", "K"):
+            movements, _ = self.get_piece_moves_dict(piece_type)
+            for add_x, add_y in movements:
+                new_row, new_col = row + add_x, col + add_y
+                if self.is_in_bounds(new_row, new_col) and board[new_row][new_col] == f"{enemy_color}{piece_type}":
+                    attackers.append((new_row, new_col))
+
+        for piece_type in ("R", "B"):
+            movements, _ = self.get_piece_moves_dict(piece_type)
+            for add_x, add_y in movements:
+                new_row, new_col = row + add_x, col + add_y
+                while self.is_in_bounds(new_row, new_col):
+                    chess_square = board[new_row][new_col]
+                    if chess_square == "--" or (new_row, new_col) == ignore:
+                        new_row += add_x
+                        new_col += add_y
+                        continue
+                    if chess_square[0] == enemy_color and chess_square[1] in (piece_type, "Q"):
+                        attackers.append((new_row, new_col))
+                    break
+
+        return attackers
+
+    def get_pins(self, king_row: int, king_col: int, piece_color: str) -> dict:
+        """
+        Return the pieces pinned to the king.
+        Maps the (row, col) of each pinned piece to the set of squares it can still move to
+        """
+        pins: dict = {}
+        for piece_type in ("R", "B"):
+            movements, _ = self.get_piece_moves_dict(piece_type)
+            for add_x, add_y in movements:
+                pinned: Tuple[int, int] = (-1, -1)
+                line: set = set()
+                new_row, new_col = king_row + add_x, king_col + add_y
+                while self.is_in_bounds(new_row, new_col):
+                    chess_square = self.board[new_row][new_col]
+                    line.add((new_row, new_col))
+                    if chess_square != "--":
+                        if chess_square[0] == piece_color:
+                            if pinned != (-1, -1):
+                                break
+                            pinned = (new_row, new_col)
+                        else:
+                            if pinned != (-1, -1) and chess_square[1] in (piece_type, "Q"):
+                                pins[pinned] = line
+                            break
+                    new_row += add_x
+                    new_col += add_y
+        return pins
+
+    def get_squares_between(self, start: Tuple[int, int], end: Tuple[int, int]) -> set:
+        """Return the squares strictly between two squares on the same line, or nothing if they aren't"""
+        # pylint: disable=no-self-use
+        (start_row, start_col), (end_row, end_col) = start, end
+        delta_row, delta_col = end_row - start_row, end_col - start_col
+        if delta_row and delta_col and abs(delta_row) != abs(delta_col):
+            return set()
+
+        step_row = (delta_row > 0) - (delta_row < 0)
+        step_col = (delta_col > 0) - (delta_col < 0)
+        squares: set = set()
+        row, col = start_row + step_row, start_col + step_col
+        while (row, col) != (end_row, end_col):
+            squares.add((row, col))
+            row, col = row + step_row, col + step_col
+        return squares
+
+    def is_en_passant_legal(self, move: int, king_square: int, enemy_color: str) -> bool:
+        """Make the en passant capture on the board and check it doesn't leave the king attacked"""
+        self.make_move(move)
+        in_check = self.is_square_attacked(king_square, enemy_color)
+        self.undo_move()
+        return not in_check
 
     def check_castle_rights_for_white(self) -> None:
         """Check if white can castle"""
 
-        white_king_location = self.get_king_location("wK")
-        king_side_rook_location: str = "07"
-        queen_right_rook_location: str = "77"
-        king_side: bool = True
-        queen_side: bool = True
-        col: str
-        row: str
-
-        # ----------------- Check king is not in check and hasnt moved -----------------
-        if any(white_king_location in moves for moves in self.black_moves) or any(
-            white_king_location in moves for moves in self.move_log
-        ):
+        # The rook has to be there as well, the rights are only lost when it moves or is captured on its square
+        queen_side: bool = bool(self.castle_rights & WHITE_QUEEN_SIDE) and self.board.item(56) == "wR"
+        king_side: bool = bool(self.castle_rights & WHITE_KING_SIDE) and self.board.item(63) == "wR"
+
+        # ----------------------- Check king is not in check ---------------------------
+        if not (queen_side or king_side) or self.is_square_attacked(60, "b"):
             return
 
-        # ---------------- Check the rook hasn't moved or been captured ----------------
-        if any(king_side_rook_location in moves for moves in self.move_log):
-            king_side = False
+        # ------------ Check the castle squares are EMPTY and NOT in check -------------
+        # Queen-side
+        free_square = [59, 58, 57]
+        for square in free_square:
+            if self.board[square // 8, square % 8] != "--":
+                queen_side = False
+                break
 
-        if any(queen_right_rook_location in moves for moves in self.move_log):
+        check_squares = (59, 58)
+        if queen_side and any(self.is_square_attacked(square, "b") for square in check_squares):
             queen_side = False
 
-        # ------------ Check the castle squares are EMPTY and NOT in check -------------
         # King-side
-        free_square = ["37", "27", "17"]
-        for row, col in free_square:  # type: ignore
-            if self.board[int(col)][int(row)] != "--":
+        free_square = [61, 62]
+        for square in free_square:
+            if self.board[square // 8, square % 8] != "--":
                 king_side = False
                 break
 
-        check_squares = ["37", "27"]
-        if any(square in move for move in self.black_moves for square in check_squares):
+        check_squares = (61, 62)
+        if king_side and any(self.is_square_attacked(square, "b") for square in check_squares):
             king_side = False
-
-        # Queen-side
-        free_square = ["57", "67"]
-        for row, col in free_square:  # type: ignore
-            if self.board[int(col)][int(row)] != "--":
-                queen_side = False
-                break
-
-        check_squares = ["57", "67"]
-        if any(square in move for move in self.black_moves for square in check_squares):
-            queen_side = False
         # ------------------------------------------------------------------------------
 
-        if king_side:
-            self.white_moves.append("47:27:07:37:C")
         if queen_side:
-            self.white_moves.append("47:67:77:57:C")
+            self.white_moves.append(encode_move(60, 58, CASTLE))
+        if king_side:
+            self.white_moves.append(encode_move(60, 62, CASTLE))
 
     def check_castle_rights_for_black(self) -> None:
         """Check if black can castle"""
 
-        black_king_location = self.get_king_location("bK")
-        king_side_rook_location: str = "00"
-        queen_right_rook_location: str = "70"
-        king_side: bool = True
-        queen_side: bool = True
-        col: str
-        row: str
-
-        # ----------------- Check king is not in check and hasnt moved -----------------
-        if any(black_king_location in moves for moves in self.white_moves) or any(
-            black_king_location in moves for moves in self.move_log
-        ):
+        queen_side: bool = bool(self.castle_rights & BLACK_QUEEN_SIDE) and self.board.item(0) == "bR"
+        king_side: bool = bool(self.castle_rights & BLACK_KING_SIDE) and self.board.item(7) == "bR"
+
+        # ----------------------- Check king is not in check ---------------------------
+        if not (queen_side or king_side) or self.is_square_attacked(4, "w"):
             return
 
-        # ---------------- Check the rook hasn't moved or been captured ----------------
-        if any(king_side_rook_location in moves for moves in self.move_log):
-            king_side = False
+        # ------------ Check the castle squares are EMPTY and NOT in check -------------
+        # Queen-side
+        free_square = [1, 2, 3]
+        for square in free_square:
+            if self.board[square // 8, square % 8] != "--":
+                queen_side = False
+                break
 
-        if any(queen_right_rook_location in moves for moves in self.move_log):
+        check_squares = (2, 3)
+        if queen_side and any(self.is_square_attacked(square, "w") for square in check_squares):
             queen_side = False
 
-        # ------------ Check the castle squares are EMPTY and NOT in check -------------
         # King-side
-        free_square = ["10", "20", "30"]
-        for row, col in free_square:  # type: ignore
-            if self.board[int(col)][int(row)] != "--":
+        free_square = [5, 6]
+        for square in free_square:
+            if self.board[square // 8, square % 8] != "--":
                 king_side = False
                 break
 
-        check_squares = ["20", "30"]
-        if any(square in move for move in self.white_moves for square in check_squares):
+        check_squares = (5, 6)
+        if king_side and any(self.is_square_attacked(square, "w") for square in check_squares):
             king_side = False
-
-        # Queen-side
-        free_square = ["50", "60"]
-        for row, col in free_square:  # type: ignore
-            if self.board[int(col)][int(row)] != "--":
-                queen_side = False
-                break
-
-        check_squares = ["50", "60"]
-        if any(square in move for move in self.white_moves for square in check_squares):
-            queen_side = False
         # ------------------------------------------------------------------------------
 
-        if king_side:
-            self.black_moves.append("40:20:00:30:C")
         if queen_side:
-            self.black_moves.append("40:60:70:50:C")
+            self.black_moves.append(encode_move(4, 2, CASTLE))
+        if king_side:
+            self.black_moves.append(encode_move(4, 6, CASTLE))
 
-    def check_en_passant(self):
+    def check_en_passant(self) -> None:
         """Function to check for en_passant"""
-        if not self.move_log:
+        if self.en_passant == -1:
             return
-        latest_move =  self.move_log[-1]
-        latest_move_type = latest_move[-1]
 
-        if latest_move_type != "N":
-            return
+        # Only the player to move can capture the pawn that just moved two squares
+        piece_color = "w" if self.player_turn == "white" else "b"
+        enemy_color = "b" if piece_color == "w" else "w"
+        move_array = self.white_moves if piece_color == "w" else self.black_moves
+        captured = PIECE_INDEX[f"{enemy_color}P"]
 
-        start_cords, end_cords, piece_moved, *_ = latest_move.split(":")
-        color, piece = piece_moved
-
-        if piece != "P":
-            return
-
-        enemy_move_array = self.white_moves if color == "b" else self.black_moves
-        direction = -1 if color == "w" else 1
-        start_col, start_row = [int(x) for x in start_cords]
-        end_col, end_row = [int(x) for x in end_cords]
-
-        if start_col == end_col and abs(start_row-end_row) == 2:
-            if self.is_in_bounds(end_row, (end_col-1)):
-                if self.board[end_row][end_col-1][1] == "P":
-                    enemy_move_array.append(f"{end_col-1}{end_row}:{start_col}{start_row + direction}:E")
-            if self.is_in_bounds(end_row, (end_col+1)):
-                if self.board[end_row][end_col+1][1] == "P":
-                    enemy_move_array.append(f"{end_col+1}{end_row}:{start_col}{start_row + direction}:E")
+        pawn_row, pawn_col = divmod(self.en_passant + (8 if piece_color == "w" else -8), 8)
+        for col in (pawn_col - 1, pawn_col + 1):
+            if self.is_in_bounds(pawn_row, col) and self.board[pawn_row][col] == f"{piece_color}P":
+                move_array.append(encode_move(pawn_row * 8 + col, self.en_passant, EN_PASSANT, captured))
 
     def generate_fen_nation_move_log(self) -> None:
         """Convert move_log into long algebraic notation"""
@@ -592,13 +879,11 @@ class GameEngine:
             If so -
                 Update self.check_status with the king that is being attacked
                 Update self.check_status with the pieces attcked in the king
-                Update the latest move in self.move_log_fen with "+"
 
         (2) Check if a player is in checkmate
             If so -
                 Update self.check_status with the king that is being attacked
                 Update self.check_status with the pieces attcked in the king
-                Update the latest move in self.move_log_fen with "#"
 
                 Update self.gamestate to "Checkmate"
 
@@ -607,51 +892,42 @@ class GameEngine:
                 Update self.gamestate to "Stalemate"
         """
         # ----------------(1) Check if a player is in check----------------"""
-        if self.player_turn == "white":
-            white_king_location = self.get_king_location("wK")
-            results = [moves for moves in self.black_moves if white_king_location in moves]
-            if results:
-                self.check_status["king_location"] = white_king_location
-                self.check_status["attacking_pieces"] = results
-
-                latest_move = self.move_log_fen[-1]
-                if not self.white_moves:
-                    self.move_log_fen[-1] = latest_move + "#"
-                else:
-                    self.move_log_fen[-1] = latest_move + "+"
+        king_piece = "wK" if self.player_turn == "white" else "bK"
+        king_square = self.get_king_square(king_piece)
+        captured = PIECE_INDEX[king_piece]
+        results = [
+            move_to_str(encode_move(attacker, king_square, CAPTURE, captured))
+            for attacker in self.attackers_of(king_square)
+        ]
+        if results:
+            self.check_status["king_location"] = SQUARE_NAMES[king_square]
+            self.check_status["attacking_pieces"] = results
+        else:
+            self.check_status = {}
 
-            else:
-                self.check_status = {}
+        # ----------(2) Check if the gamestate is checkmate or stalemate-----------
 
-        if self.player_turn == "black":
-            black_king_location = self.get_king_location("bK")
-            results = [moves for moves in self.white_moves if black_king_location in moves]
-            if results:
-                self.check_status["king_location"] = black_king_location
-                self.check_status["attacking_pieces"] = results
-
-                latest_move = self.move_log_fen[-1]
-                if not self.black_moves:
-                    self.move_log_fen[-1] = latest_move + "#"
+        for color, enemy, moves in (("Black", "White", self.black_moves), ("White", "Black", self.white_moves)):
+            # The idle player has no move list to check when only the side to move is generated
+            if self.side_to_move_only and color.lower() != self.player_turn:
+                continue
+            if not moves:
+                if self.is_king_under_attack(color):
+                    self.gamestate["gamestate"] = "Checkmate"
+                    self.gamestate["winner"] = enemy
                 else:
-                    self.move_log_fen[-1] = latest_move + "+"
-            else:
-                self.check_status = {}
-
-        # ----------(2) Check if the gamestate is checkmate or stalemate-----------
+                    self.gamestate["gamestate"] = "Stalemate"
+                    self.gamestate["winner"] = "None"
+                break
 
-        if self.is_king_under_attack("Black") and not len(self.get_black_moves()):
-            self.gamestate["gamestate"] = "Checkmate"
-            self.gamestate["winner"] = "White"
-        elif not self.is_king_under_attack("Black") and not len(self.get_black_moves()):
-            self.gamestate["gamestate"] = "Stalemate"
-            self.gamestate["winner"] = "None"
-        elif self.is_king_under_attack("White") and not len(self.get_white_moves()):
-            self.gamestate["gamestate"] = "Checkmate"
-            self.gamestate["winner"] = "Black"
-        elif not self.is_king_under_attack("White") and not len(self.get_white_moves()):
-            self.gamestate["gamestate"] = "Stalemate"
-            self.gamestate["winner"] = "None"
+    def mark_check_in_move_log(self) -> None:
+        """Add + to the latest move in the FEN move log if it gave check, # if it was checkmate"""
+        moves = self.white_moves if self.player_turn == "white" else self.black_moves
+        latest_move = self.move_log_fen[-1]
+        if not moves:
+            self.move_log_fen[-1] = latest_move + "#"
+        else:
+            self.move_log_fen[-1] = latest_move + "+"
 
     def piece_movemovents(self) -> dict:
         """Piece movements helper function"""
@@ -675,3 +951,7 @@ class GameEngine:
         movements: List[Tuple[int, int]] = piece_move_info["movements"]
         continuous: bool = piece_move_info["continous"]
         return movements, continuous
+
+
+class InvalidFen(Exception):
+    """If a FEN string can't be read"""
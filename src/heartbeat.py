@@ -0,0 +1,61 @@
+"""Heartbeats, quiet clients are pinged and the ones that stop answering are disconnected"""
+import threading
+import time
+from typing import Set
+
+from src.client import ClientHandler
+from src.protocol import PING, encode_message
+
+PING_MESSAGE: bytes = encode_message(PING)
+
+
+class Heartbeat(threading.Thread):
+    """
+    Pings every client that has sent nothing for a ping interval, and disconnects the ones that have sent nothing,
+    not even a pong, for the idle timeout. Dead and half-open connections the kernel never reports are closed,
+    so their thread ends and they leave their room, freeing its slot.
+    Clients are forgotten once they have disconnected
+    """
+
+    PING_INTERVAL: float = 15.0
+    IDLE_TIMEOUT: float = 60.0
+
+    def __init__(self) -> None:
+        super().__init__(name="heartbeat", daemon=True)
+        self.lock = threading.Lock()
+        self.clients: Set[ClientHandler] = set()
+        self.stopped: threading.Event = threading.Event()
+
+    def watch(self, client: ClientHandler) -> None:
+        """Start pinging a client"""
+        with self.lock:
+            self.clients.add(client)
+
+    def run(self) -> None:
+        """Check the clients every ping interval until stopped"""
+        while not self.stopped.wait(self.PING_INTERVAL):
+            self.beat()
+
+    def beat(self) -> None:
+        """Ping the quiet clients and disconnect the idle ones"""
+        now = time.monotonic()
+        with self.lock:
+            self.clients = {client for client in self.clients if not client.closed}
+            clients = list(self.clients)
+
+        for client in clients:
+            idle = now - client.last_seen
+            if idle > self.IDLE_TIMEOUT:
+                with self.lock:
+                    self.clients.discard(client)
+                client.client.abort("has stopped answering pings")
+            elif idle >= self.PING_INTERVAL:
+                client.client.sendall(PING_MESSAGE)
+
+    def get_watched(self) -> int:
+        """Return the number of clients being pinged"""
+        return len(self.clients)
+
+    def stop(self) -> None:
+        """Stop pinging"""
+        self.stopped.set()
@@ -0,0 +1,155 @@
+"""Move journal, the games being played are written to disk so a restarted server can resume them"""
+import json
+import os
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Set
+
+
+class Journal(threading.Thread):
+    """
+    An append-only log of the games played in the rooms, kept in numbered segments of a directory.
+    Rooms add a record when their game starts, for every move made or undone and when they close.
+    The records are written by the journal's thread and synced to disk together every flush interval,
+    so a room never waits on the disk and a crash loses at most the moves of the last interval.
+    A segment is rolled over once it reaches the segment size, and deleted once every room with records in it has closed
+    """
+
+    FLUSH_INTERVAL: float = 0.05
+    SEGMENT_SIZE: int = 4 * 1024 * 1024
+    SUFFIX: str = ".journal"
+
+    def __init__(self, directory: str) -> None:
+        super().__init__(name="journal", daemon=True)
+        os.makedirs(directory, exist_ok=True)
+        self.directory: str = directory
+        self.lock = threading.Lock()
+        self.pending: List[dict] = []
+        self.stopped: threading.Event = threading.Event()
+        self.records: int = 0
+        self.syncs: int = 0
+
+        # Segments written before this journal was opened, kept from then on like the others once they are recovered
+        self.old_segments: List[int] = self.list_segments()
+        self.segment: int = max(self.old_segments, default=0)
+        self.segments: Dict[int, Set[str]] = {}  # The rooms with records in each segment that haven't closed
+        self.file: BinaryIO = self.open_segment(self.segment + 1)
+
+    def append(self, record: dict) -> None:
+        """Add a record to be written with the next batch"""
+        with self.lock:
+            self.pending.append(record)
+
+    def run(self) -> None:
+        """Write and sync the records every flush interval until stopped"""
+        while not self.stopped.wait(self.FLUSH_INTERVAL):
+            self.flush()
+        self.flush()
+
+    def flush(self) -> None:
+        """Write the records added since the last flush, sync them to disk and delete the segments no longer needed"""
+        with self.lock:
+            records, self.pending = self.pending, []
+        if not records:
+            return
+
+        rooms = self.segments[self.segment]
+        for record in records:
+            self.file.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            if record["record"] == "close":
+                for segment_rooms in self.segments.values():
+                    segment_rooms.discard(record["room"])
+            else:
+                rooms.add(record["room"])
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records += len(records)
+        self.syncs += 1
+
+        if self.file.tell() >= self.SEGMENT_SIZE:
+            self.file.close()
+            self.file = self.open_segment(self.segment + 1)
+        self.delete_segments()
+
+    def delete_segments(self) -> None:
+        """Delete the segments every room with records in has closed, apart from the one being written"""
+        for segment in [segment for segment, rooms in self.segments.items() if not rooms and segment != self.segment]:
+            del self.segments[segment]
+            os.remove(self.get_path(segment))
+
+    def recover(self) -> Dict[str, List[dict]]:
+        """
+        Return the records of every game in the old segments that hadn't closed, by room, in the order written.
+        The old segments are kept until the games in them close, like the segments written from now on
+        """
+        games: Dict[str, List[dict]] = {}
+        segments: Dict[int, Set[str]] = {}
+        for segment in self.old_segments:
+            rooms = segments[segment] = set()
+            for record in self.read_segment(segment):
+                rooms.add(record["room"])
+                if record["record"] == "start":
+                    games[record["room"]] = [record]
+                elif record["record"] == "close":
+                    games.pop(record["room"], None)
+                elif record["room"] in games:
+                    games[record["room"]].append(record)
+
+        for segment, rooms in segments.items():
+            self.segments[segment] = rooms & games.keys()
+        self.old_segments = []
+        self.delete_segments()
+        return games
+
+    def stop(self) -> None:
+        """Write what is left and close the journal"""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        else:
+            self.flush()
+        self.file.close()
+
+    def get_stats(self) -> dict:
+        """Return the number of records written, the syncs they took and the segments kept"""
+        return {"records": self.records, "syncs": self.syncs, "segments": len(self.segments) + len(self.old_segments)}
+
+    def get_path(self, segment: int) -> str:
+        """Return the path of a segment"""
+        return os.path.join(self.directory, f"{segment:08d}{self.SUFFIX}")
+
+    def list_segments(self) -> List[int]:
+        """Return the numbers of the segments in the directory, oldest first"""
+        return sorted(
+            int(name[: -len(self.SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(self.SUFFIX) and name[: -len(self.SUFFIX)].isdigit()
+        )
+
+    def open_segment(self, segment: int) -> BinaryIO:
+        """Start writing to a new segment"""
+        self.segment = segment
+        self.segments[segment] = set()
+        file = open(self.get_path(segment), "ab")  # pylint: disable=consider-using-with
+        self.sync_directory()
+        return file
+
+    def read_segment(self, segment: int) -> Iterator[dict]:
+        """Return the records of a segment, up to the last one written in full"""
+        with open(self.get_path(segment), "rb") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # The server stopped while it was writing the record, nothing was written after it
+                    return
+
+    def sync_directory(self) -> None:
+        """Sync the journal's directory, so the segments it has survive a crash"""
+        try:
+            descriptor = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return  # Directories can't be opened on every platform
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
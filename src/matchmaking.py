@@ -0,0 +1,71 @@
+"""Matchmaking queue, players waiting for a game are paired without going through the room listing"""
+import threading
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Matchmaker:
+    """
+    Players waiting for a game, paired by time control and rating.
+    The players waiting for each time control are kept sorted by rating, so a new player is paired with
+    the closest rated one in O(log n), if they are within the rating band, or waits in their place otherwise.
+    Players who have disconnected without leaving the queue yet are dropped rather than paired
+    """
+
+    DEFAULT_RATING: int = 1200
+    RATING_BAND: int = 200
+    DEFAULT_TIME_CONTROL: str = "none"
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.queues: Dict[str, List[Tuple[int, int]]] = {}  # The rating and ticket of each waiting player
+        self.players: Dict[int, Any] = {}
+        self.tickets: Dict[Any, Tuple[str, int, int]] = {}  # The time control, rating and ticket of a player
+        self.issued: int = 0
+
+    def enqueue(self, player: Any, rating: int, time_control: str) -> Optional[Any]:
+        """Pair a player with a waiting opponent and return them, or queue the player and return None"""
+        with self.lock:
+            queue = self.queues.setdefault(time_control, [])
+
+            while True:
+                # The closest ratings are either side of where the player would be inserted
+                index = bisect_left(queue, (rating, -1))
+                closest = min(
+                    (candidate for candidate in (index - 1, index) if 0 <= candidate < len(queue)),
+                    key=lambda candidate: abs(queue[candidate][0] - rating),
+                    default=None,
+                )
+                if closest is None or abs(queue[closest][0] - rating) > self.RATING_BAND:
+                    break
+                _, ticket = queue.pop(closest)
+                opponent = self.players.pop(ticket)
+                del self.tickets[opponent]
+                if not opponent.closed:
+                    return opponent
+
+            self.issued += 1
+            insort(queue, (rating, self.issued))
+            self.players[self.issued] = player
+            self.tickets[player] = (time_control, rating, self.issued)
+            return None
+
+    def cancel(self, player: Any) -> bool:
+        """Take a player out of the queue, False if they weren't waiting"""
+        with self.lock:
+            entry = self.tickets.pop(player, None)
+            if entry is None:
+                return False
+            time_control, rating, ticket = entry
+            queue = self.queues[time_control]
+            del queue[bisect_left(queue, (rating, ticket))]
+            del self.players[ticket]
+            return True
+
+    def is_queued(self, player: Any) -> bool:
+        """Return whether a player is waiting for an opponent"""
+        return player in self.tickets
+
+    def get_waiting(self) -> int:
+        """Return the number of players waiting"""
+        return len(self.players)
@@ -0,0 +1,103 @@
+"""Packed move encoding shared by the server engine and the client"""  # pylint: disable=too-few-public-methods
+from typing import List, Tuple, Union
+
+# Squares are numbered row * 8 + col, the same order as the flattened board array,
+# so square 0 is "00" (a8) and square 63 is "77" (h1).
+#
+# A move is a single int:
+#   bits 0-5    start square
+#   bits 6-11   end square
+#   bits 12-13  movetype
+#   bits 14-17  captured piece
+#   bits 18-21  promotion piece (reserved, the engine has no promotion yet)
+#
+# Moves only become "start:end:movetype" strings when they are sent to or received from a player.
+
+NORMAL, CAPTURE, CASTLE, EN_PASSANT = range(4)
+MOVETYPES: Tuple[str, ...] = ("N", "T", "C", "E")
+MOVETYPE_INDEX: dict = {movetype: index for index, movetype in enumerate(MOVETYPES)}
+
+PIECES: Tuple[str, ...] = ("--", "wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+PIECE_INDEX: dict = {piece: index for index, piece in enumerate(PIECES)}
+
+SQUARE_NAMES: List[str] = [f"{square % 8}{square // 8}" for square in range(64)]
+SQUARE_INDEX: dict = {name: square for square, name in enumerate(SQUARE_NAMES)}
+
+
+def encode_move(start: int, end: int, movetype: int = NORMAL, captured: int = 0, promotion: int = 0) -> int:
+    """Pack a move into an int"""
+    return start | end << 6 | movetype << 12 | captured << 14 | promotion << 18
+
+
+def move_start(move: int) -> int:
+    """Return the start square of a packed move"""
+    return move & 63
+
+
+def move_end(move: int) -> int:
+    """Return the end square of a packed move"""
+    return move >> 6 & 63
+
+
+def move_type(move: int) -> int:
+    """Return the movetype of a packed move"""
+    return move >> 12 & 3
+
+
+def move_captured(move: int) -> int:
+    """Return the piece index captured by a packed move, 0 if nothing is captured"""
+    return move >> 14 & 15
+
+
+def move_key(move: int) -> int:
+    """Return the start square, end square and movetype of a packed move, all a move string sent by a player has"""
+    return move & 0x3FFF
+
+
+def castle_rook_squares(king_end: int) -> Tuple[int, int]:
+    """Return the rook start and end square for a castle that takes the king to king_end"""
+    row_start = king_end & ~7
+    if king_end & 7 == 2:
+        return row_start, row_start + 3
+    return row_start + 7, row_start + 5
+
+
+def move_to_str(move: int) -> str:
+    """Convert a packed move to the string sent to the players"""
+    start, end, movetype = move & 63, move >> 6 & 63, move >> 12 & 3
+    if movetype == CASTLE:
+        rook_start, rook_end = castle_rook_squares(end)
+        return f"{SQUARE_NAMES[start]}:{SQUARE_NAMES[end]}:{SQUARE_NAMES[rook_start]}:{SQUARE_NAMES[rook_end]}:C"
+    return f"{SQUARE_NAMES[start]}:{SQUARE_NAMES[end]}:{MOVETYPES[movetype]}"
+
+
+def str_to_move(move: str) -> int:
+    """
+    Convert a move string sent by a player to a packed move.
+    The captured piece isn't part of the string, the engine reads it off the board
+    """
+    start_cords, end_cords, *_ = move.split(":")
+    return encode_move(SQUARE_INDEX[start_cords], SQUARE_INDEX[end_cords], MOVETYPE_INDEX[move[-1]])
+
+
+def parse_move(move: Union[int, str]) -> int:
+    """Return the packed move for a move sent by the server, moves in binary messages arrive already packed"""
+    if isinstance(move, int):
+        return move
+    return str_to_move(move)
+
+
+class Move:
+    """A move that has been made, as stored in the move log"""
+
+    __slots__ = ("start", "end", "movetype", "piece_moved", "piece_captured")
+
+    def __init__(self, start: int, end: int, movetype: int, piece_moved: str, piece_captured: str) -> None:
+        self.start: int = start
+        self.end: int = end
+        self.movetype: int = movetype
+        self.piece_moved: str = piece_moved
+        self.piece_captured: str = piece_captured
+
+    def __repr__(self) -> str:
+        return f"Move({move_to_str(encode_move(self.start, self.end, self.movetype))}, {self.piece_moved})"
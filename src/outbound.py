@@ -0,0 +1,229 @@
+"""Outbound buffers, so a room never waits on a player's socket and a slow player only holds up themselves"""
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional, Set
+
+
+class FlowControl:
+    """
+    Congestion state of a connection's outbound buffer.
+    Over the high watermark the connection is congested and rooms hold back game updates for it,
+    once it has drained under the low watermark the callbacks waiting for it are run.
+    Connections that buffer more than MAX_BUFFERED, or stay congested too long, are disconnected
+    """
+
+    HIGH_WATERMARK: int = 64 * 1024
+    LOW_WATERMARK: int = 16 * 1024
+    MAX_BUFFERED: int = 1024 * 1024
+    MAX_CONGESTED_SECONDS: float = 30.0
+    # The kernel's send buffer is capped, or it would queue megabytes before the watermarks ever see any of it
+    KERNEL_SEND_BUFFER: int = 64 * 1024
+
+    def __init__(self) -> None:
+        self.flow_lock = threading.Lock()
+        self.congested_since: Optional[float] = None
+        self.drain_callbacks: List[Callable[[], None]] = []
+
+    def is_congested(self) -> bool:
+        """Return whether the connection is over its high watermark and hasn't drained yet"""
+        return self.congested_since is not None
+
+    def when_drained(self, callback: Callable[[], None]) -> None:
+        """Call back once the connection has drained, straight away if it isn't congested"""
+        with self.flow_lock:
+            if self.congested_since is not None:
+                self.drain_callbacks.append(callback)
+                return
+        callback()
+
+    def set_congested(self) -> None:
+        """Mark the connection as congested"""
+        with self.flow_lock:
+            if self.congested_since is None:
+                self.congested_since = time.monotonic()
+
+    def set_drained(self) -> None:
+        """Mark the connection as drained and run the callbacks waiting for it"""
+        with self.flow_lock:
+            self.congested_since = None
+            callbacks, self.drain_callbacks = self.drain_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def limit_send_buffer(self, sock: socket.socket) -> None:
+        """Cap how much the kernel buffers for the connection"""
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.KERNEL_SEND_BUFFER)
+
+    def is_stuck(self) -> bool:
+        """Return whether the connection has been congested for too long"""
+        congested_since = self.congested_since
+        return congested_since is not None and time.monotonic() - congested_since > self.MAX_CONGESTED_SECONDS
+
+
+class SocketConnection(FlowControl):
+    """
+    A client socket written without blocking.
+    Data is sent straight away when the socket takes it, what it doesn't take is buffered
+    and written by the outbound loop as the socket becomes writable
+    """
+
+    # Queued frames are joined into writes of up to this size
+    COALESCE_SIZE: int = 64 * 1024
+
+    def __init__(self, sock: socket.socket, loop: "OutboundLoop") -> None:
+        super().__init__()
+        sock.setblocking(False)
+        self.limit_send_buffer(sock)
+        self.socket: socket.socket = sock
+        self.loop: "OutboundLoop" = loop
+        self.frames: Deque[bytes] = deque()
+        self.size: int = 0
+        self.closed: bool = False
+        self.lock = threading.Lock()
+
+    def sendall(self, data: bytes) -> None:
+        """Send data to the client, buffering what the socket doesn't take"""
+        with self.lock:
+            if self.closed:
+                return
+            if self.frames:
+                self.frames.append(data)
+            else:
+                try:
+                    sent = self.socket.send(data)
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    self.closed = True
+                    return
+                if sent == len(data):
+                    return
+                data = data[sent:]
+                self.frames.append(data)
+                self.loop.watch(self)
+            self.size += len(data)
+            size = self.size
+
+        if size > self.MAX_BUFFERED:
+            self.abort()
+        elif size > self.HIGH_WATERMARK:
+            self.set_congested()
+
+    def flush(self) -> bool:
+        """Write as much of the buffer as the socket takes, returns whether it is empty"""
+        with self.lock:
+            if self.closed:
+                return True
+            while self.frames:
+                # Join the small frames at the front into one write
+                chunk = self.frames.popleft()
+                while self.frames and len(chunk) + len(self.frames[0]) <= self.COALESCE_SIZE:
+                    chunk += self.frames.popleft()
+                try:
+                    sent = self.socket.send(chunk)
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    self.closed = True
+                    self.frames.clear()
+                    break
+                self.size -= sent
+                if sent < len(chunk):
+                    self.frames.appendleft(chunk[sent:])
+                    break
+            empty = not self.frames
+            size = self.size
+
+        if size <= self.LOW_WATERMARK and self.is_congested():
+            self.set_drained()
+        return empty
+
+    def wait_drained(self, timeout: float) -> bool:
+        """Wait until everything buffered has been written, returns whether it was"""
+        deadline = time.monotonic() + timeout
+        while self.frames and not self.closed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self.frames
+
+    def detach(self) -> None:
+        """Stop writing to the socket without closing it, it has been handed to another process"""
+        with self.lock:
+            self.closed = True
+            self.frames.clear()
+            self.size = 0
+
+    def abort(self, reason: str = "isn't reading what it is sent") -> None:
+        """Disconnect a client that can't keep up or has gone quiet, the thread reading from it sees it close"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.frames.clear()
+            self.size = 0
+        print(f"Disconnecting a client that {reason}")
+        try:
+            # Reset rather than wait for the kernel to deliver what it has queued, once the reading thread closes it
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class OutboundLoop(threading.Thread):
+    """Writes what socket connections couldn't send straight away, as their sockets become writable"""
+
+    def __init__(self) -> None:
+        super().__init__(name="outbound", daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self.lock = threading.Lock()
+        self.new_connections: List[SocketConnection] = []
+        self.connections: Set[SocketConnection] = set()
+
+    def watch(self, connection: SocketConnection) -> None:
+        """Have the loop write a connection's buffer"""
+        with self.lock:
+            self.new_connections.append(connection)
+        try:
+            self.wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            pass  # The loop already has a wake up to read
+
+    def run(self) -> None:
+        """Write buffered data until the server stops"""
+        while True:
+            for key, _ in self.selector.select(timeout=1.0):
+                if key.fileobj is self.wakeup_reader:
+                    self.wakeup_reader.recv(4096)
+                elif key.data.flush():
+                    self.unwatch(key.data)
+
+            with self.lock:
+                new_connections, self.new_connections = self.new_connections, []
+            for connection in new_connections:
+                if connection not in self.connections and not connection.closed:
+                    self.selector.register(connection.socket, selectors.EVENT_WRITE, connection)
+                    self.connections.add(connection)
+
+            for connection in list(self.connections):
+                if connection.closed:
+                    self.unwatch(connection)
+                elif connection.is_stuck():
+                    connection.abort()
+                    self.unwatch(connection)
+
+    def unwatch(self, connection: SocketConnection) -> None:
+        """Stop writing a connection, its buffer is empty or it has been closed"""
+        if connection in self.connections:
+            self.connections.discard(connection)
+            try:
+                self.selector.unregister(connection.socket)
+            except (KeyError, ValueError):
+                pass
@@ -0,0 +1,129 @@
+"""
+Perft runner for the server side GameEngine
+
+Counts the leaf nodes of the legal move tree to a given depth, which both checks the
+move generator against known node counts and measures how fast it is.
+
+    python -m src.perft --depth 4
+    python -m src.perft --depth 3 --fen "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+    python -m src.perft --depth 3 --position kiwipete --divide
+    python -m src.perft --suite --backend array
+"""
+import argparse
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from src.bitboard import ENGINE_BACKENDS
+from src.game import GameEngine, InvalidFen
+from src.move import move_to_str
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Standard perft positions with their known node counts for depth 1, 2, ...
+# Only depths that don't reach a pawn promotion are listed, the engine doesn't promote pawns.
+# fmt: off
+REFERENCE_POSITIONS: Dict[str, Tuple[str, List[int]]] = {
+    "start": (START_FEN, [20, 400, 8902, 197281, 4865609]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862]),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+}
+# fmt: on
+
+# Depth the suite runs each reference position to, a few seconds per position on the bitboard backend
+SUITE_DEPTHS: Dict[str, int] = {"start": 4, "kiwipete": 3, "position3": 4}
+
+
+def perft(engine: GameEngine, depth: int, timings: Dict[str, float]) -> int:
+    """Count the leaf nodes depth plies below the current position"""
+    start = time.perf_counter()
+    engine.generate_legal_moves()
+    moves = list(engine.white_moves if engine.player_turn == "white" else engine.black_moves)
+    timings["generate"] += time.perf_counter() - start
+
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        start = time.perf_counter()
+        engine.make_move(move)
+        timings["make"] += time.perf_counter() - start
+
+        nodes += perft(engine, depth - 1, timings)
+
+        start = time.perf_counter()
+        engine.undo_move()
+        timings["undo"] += time.perf_counter() - start
+    return nodes
+
+
+def divide(engine: GameEngine, depth: int, timings: Dict[str, float]) -> Dict[str, int]:
+    """Return the perft count below each root move, for finding where two generators disagree"""
+    engine.generate_legal_moves()
+    moves = list(engine.white_moves if engine.player_turn == "white" else engine.black_moves)
+
+    results: Dict[str, int] = {}
+    for move in moves:
+        engine.make_move(move)
+        results[move_to_str(move)] = perft(engine, depth - 1, timings) if depth > 1 else 1
+        engine.undo_move()
+    return results
+
+
+def run(backend: str, fen: str, depth: int, show_divide: bool = False) -> int:
+    """Run and report a single perft"""
+    engine = ENGINE_BACKENDS[backend].from_fen(fen, side_to_move_only=True)
+    timings: Dict[str, float] = {"generate": 0.0, "make": 0.0, "undo": 0.0}
+
+    start = time.perf_counter()
+    if show_divide:
+        results = divide(engine, depth, timings)
+        for move, count in sorted(results.items()):
+            print(f"{move}: {count}")
+        nodes = sum(results.values())
+    else:
+        nodes = perft(engine, depth, timings)
+    elapsed = time.perf_counter() - start
+
+    print(f"depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nodes / max(elapsed, 1e-9):,.0f} nodes/sec)")
+    print("  " + ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in timings.items()))
+    return nodes
+
+
+def run_suite(backend: str, max_depth: int = 0) -> bool:
+    """Run every reference position and compare against the known node counts"""
+    passed = True
+    for name, (fen, expected) in REFERENCE_POSITIONS.items():
+        depth = min(max_depth or SUITE_DEPTHS[name], len(expected))
+        print(f"{name}: {fen}")
+        nodes = run(backend, fen, depth)
+        if nodes != expected[depth - 1]:
+            print(f"  FAILED, expected {expected[depth - 1]}")
+            passed = False
+    return passed
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Perft node counts and timing for the chess engine")
+    parser.add_argument("--depth", type=int, help="plies to search, 3 by default")
+    parser.add_argument("--fen", default=START_FEN, help="position to search from")
+    parser.add_argument("--position", choices=sorted(REFERENCE_POSITIONS), help="use a reference position")
+    parser.add_argument("--backend", choices=sorted(ENGINE_BACKENDS), default="bitboard")
+    parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+    parser.add_argument("--suite", action="store_true", help="check every reference position")
+    args = parser.parse_args()
+
+    if args.suite:
+        sys.exit(0 if run_suite(args.backend, args.depth or 0) else 1)
+
+    fen = REFERENCE_POSITIONS[args.position][0] if args.position else args.fen
+    try:
+        run(args.backend, fen, args.depth or 3, args.divide)
+    except InvalidFen as error:
+        parser.error(str(error))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,12 @@ import sys
 import threading
 import time
 from typing import Union
-import json
 
 from src.chess.engine.controller import Controller
-from src.chess.engine.event import EventManager, ThreadQuitEvent, UpdateEvent, ViewUpdate
+from src.chess.engine.event import DeltaEvent, EventManager, ThreadQuitEvent, UpdateEvent, ViewUpdate
 from src.chess.engine.game import GameEngine
 from src.chess.engine.view import View
+from src.protocol import BINARY, PING, SocketReader, encode_message
 from src.utils import ctrlc_handler, flush_print_default, socket_recv_errors
 
 print = flush_print_default(print)
@@ -21,11 +21,17 @@ print = flush_print_default(print)
 class Player:
     """Player class"""
 
+    # Seconds between the pings that keep the server from disconnecting a player sitting in the menu
+    KEEPALIVE_INTERVAL: float = 10.0
+
     def __init__(self, host: str, port: int) -> None:
         # Connect to socket
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.send_lock: threading.Lock = threading.Lock()
+        self.reader: SocketReader = SocketReader(self.socket, self.send)
         self.connect(host, port)
         self.exit: bool = False
+        threading.Thread(target=self.keepalive, daemon=True).start()
 
         # Pygame related
         self.event: threading.Event
@@ -40,11 +46,12 @@ class Player:
             self.socket.connect((host, port))
 
             user_input = input("Please enter your username: ")
-            message = json.dumps({"action": "username", "payload": user_input})
+            # Game updates come back binary, the reader decodes them to the same messages as JSON
+            message = {"action": "username", "payload": user_input, "protocol": BINARY}
             self.send(message)
 
-            data = self.socket.recv(1024)
-            if not data:
+            response = self.reader.read()
+            if response is None:
                 sys.exit(0)
 
         except ConnectionRefusedError:
@@ -61,9 +68,20 @@ class Player:
         self.controller = Controller(self.event_manager, self.gamemodel, self.send)
         self.graphics = View(self.event_manager, self.gamemodel)
 
-    def send(self, message: str) -> None:
+    def send(self, message: dict) -> None:
         """Send message to socket"""
-        self.socket.sendall((message).encode())
+        # Sent from the menu, the game and the keepalive thread
+        with self.send_lock:
+            self.socket.sendall(encode_message(message))
+
+    def keepalive(self) -> None:
+        """Ping the server until the player exits, so it knows the player is still there"""
+        while not self.exit:
+            self.sleep(self.KEEPALIVE_INTERVAL)
+            try:
+                self.send(PING)
+            except OSError:
+                break
 
     def sleep(self, sec: Union[int, float]) -> None:
         """Zzz"""
@@ -72,23 +90,25 @@ class Player:
     def recieve(self) -> None:
         """Socket listener function"""
         while not self.event.is_set():
-            try:
-                readable, _, _ = select.select([self.socket], [], [], 2)
-            except OSError:
-                pass
-            for obj in readable:
-                if obj is self.socket:
-
-                    data = self.socket.recv(4096)
-                    if not data:
-                        self.exit = True
-                        self.event_manager.post(ThreadQuitEvent())
-                        self.event.set()
-                        print("Server shutdown")
-                        break
+            # Messages that arrived together with the start_game message are already waiting
+            if not self.reader.has_message():
+                try:
+                    readable, _, _ = select.select([self.socket], [], [], 2)
+                except OSError:
+                    continue
+                if self.socket not in readable:
+                    continue
+
+            messages = self.reader.read_available()
+            if messages is None:
+                self.exit = True
+                self.event_manager.post(ThreadQuitEvent())
+                self.event.set()
+                print("Server shutdown")
+                break
 
-                    message = json.loads(data)
-                    self.service_data(message)
+            for message in messages:
+                self.service_data(message)
 
     def service_data(self, data: dict) -> None:
         """Service the data sent from the server"""
@@ -100,9 +120,21 @@ class Player:
             gamestate = data["payload"]["gamestate"]
             captured = data["payload"]["captured"]
             check_status = data["payload"]["check_status"]
-            self.event_manager.post(UpdateEvent(board, move, log, captured, gamestate))
+            sequence = data["payload"]["sequence"]
+            self.event_manager.post(UpdateEvent(board, move, log, captured, gamestate, sequence))
             self.event_manager.post(ViewUpdate(check_status))
 
+        elif "delta" in data.values():
+            # A delta only applies on top of the update before it, anything else needs a full snapshot.
+            # Deltas already covered by a snapshot that was asked for are dropped
+            if data["payload"]["sequence"] <= self.gamemodel.get_sequence():
+                return
+            if data["payload"]["sequence"] != self.gamemodel.get_sequence() + 1:
+                self.send({"action": "game", "sub_action": "resync", "payload": {"color": self.gamemodel.get_color()}})
+                return
+            self.event_manager.post(DeltaEvent(data["payload"]))
+            self.event_manager.post(ViewUpdate(data["payload"]["check_status"]))
+
         elif "message" in data.values():
             if data["payload"] == "You win!":
                 self.event_manager.post(ThreadQuitEvent())
@@ -115,22 +147,21 @@ class Player:
 
     def create_room(self, room_name: str) -> None:
         """Create a room with user input as name"""
-        message = json.dumps({"action": "create", "payload": room_name})
+        message = {"action": "create", "payload": room_name}
         self.send(message)
 
-        data = self.socket.recv(1024)
-        if not data:
+        response = self.reader.read()
+        if response is None:
             print("Server no longer online, the client will now exit")
             self.exit = True
             return
 
-        response = json.loads(data)
         response_message = response["payload"]
         print(response_message)
 
     def join_room(self, room_name: str) -> None:
         """Join a room"""
-        message = json.dumps({"action": "join", "payload": room_name})
+        message = {"action": "join", "payload": room_name}
         self.send(message)
 
         # Response is handeled in main menu.
@@ -138,53 +169,87 @@ class Player:
 
     def leave_room(self) -> None:
         """Leave the room"""
-        message = json.dumps({"action": "leave_room"})
+        message = {"action": "leave_room"}
         self.send(message)
 
-        data = self.socket.recv(1024)
-        if not data:
+        response = self.reader.read()
+        if response is None:
             print("Server no longer online, the client will now exit")
             self.exit = True
             return
 
-        response = json.loads(data)
         response_message = response["payload"]
         print(response_message)
 
     def get_rooms(self) -> None:
-        """Get a list of all room"""
-        message = json.dumps({"action": "get_rooms"})
-        self.send(message)
+        """List the rooms, a page at a time"""
+        query: dict = {}
+        while True:
+            message = {"action": "get_rooms", "payload": query}
+            self.send(message)
 
-        data = self.socket.recv(1024)
-        if not data:
-            print("Server no longer online, the client will now exit")
-            self.exit = True
-            return
+            response = self.reader.read()
+            if response is None:
+                print("Server no longer online, the client will now exit")
+                self.exit = True
+                return
 
-        response = json.loads(data)
-        response_message = response["payload"]
+            page = response["payload"]
 
-        if not response_message:
-            print("No rooms have been created yet")
-            return
+            if not page["rooms"] and "cursor" not in query:
+                print("No rooms have been created yet")
+                return
 
-        for room_name, creator, players in response_message:
-            print(
-                f"""
-Room name: {room_name}
-Creator: {creator}
+            for room in page["rooms"]:
+                players = room["players"]
+                print(
+                    f"""
+Room name: {room['name']} ({room['status'].replace('_', ' ')})
+Creator: {room['creator']}
 White - {players['white']} | vs | {players['black']} - Black
 """
-            )
+                )
+
+            if page["next"] is None:
+                return
+            if input("Press enter to see more rooms, or Q to go back: ").upper() == "Q":
+                return
+            query = {"cursor": page["next"]}
 
     def waiting_for_opponent(self) -> None:
         """Tell the server you are waiting in the room for an opponent"""
-        message = json.dumps({"action": "game", "sub_action": "waiting"})
+        message = {"action": "game", "sub_action": "waiting"}
         self.send(message)
 
         # No reponse from server
 
+    def queue(self) -> None:
+        """Ask the server to pair you with an opponent, it puts you both in a room"""
+        message = {"action": "queue"}
+        self.send(message)
+
+        # Response is handeled in main menu.
+
+    def wait_for_game(self) -> None:
+        """Wait in the room for the server to start the game"""
+        while True:
+            if not self.reader.has_message():
+                readable, _, _ = select.select([self.socket], [], [], 1)
+                if self.socket not in readable:
+                    continue
+
+            response = self.reader.read()
+            if response is None:
+                print("Server has shutdown")
+                self.exit = True
+                break
+
+            if response.get("action") == "start_game":
+                color = response["payload"]["color"]
+                usernames = response["payload"]["username"]
+                self.start_game(color, usernames)
+                break
+
     def start_game(self, color: str, usernames: dict) -> None:
         """Start the game"""
 
@@ -205,7 +270,7 @@ White - {players['white']} | vs | {players['black']} - Black
             self.event.set()
         print("Game has concluded.")
 
-    def start(self) -> None:
+    def start(self) -> None:  # pylint: disable=too-many-branches
         """Start the server"""
         print("Connected to server")
         while not self.exit:
@@ -214,6 +279,7 @@ White - {players['white']} | vs | {players['black']} - Black
 | A: Create Room |
 | B: List Rooms  |
 | C: Join Room   |
+| D: Quick Match |
 | Q: Logout      |
 ------------------
 Please enter your choice: """
@@ -232,13 +298,12 @@ Please enter your choice: """
                 self.join_room(choice)
 
                 # Wait for response
-                data = self.socket.recv(1024)
-                if not data:
+                response = self.reader.read()
+                if response is None:
                     print("Server no longer online, the client will now exit")
                     self.exit = True
                     break
 
-                response = json.loads(data)
                 # Do something
                 if response["success"] is False:
                     print(response["payload"])
@@ -250,25 +315,25 @@ Please enter your choice: """
 
                         print("Waiting for an opponent...\nHit Ctrl-C to leave room")
                         self.waiting_for_opponent()
-                        waiting_in_lobby: bool = True
-
-                        while True:
-                            readable, _, _ = select.select([self.socket], [], [], 1)
-                            if self.socket in readable and waiting_in_lobby:
-
-                                data = self.socket.recv(1024)
-                                if not data:
-                                    print("Server has shutdown")
-                                    self.exit = True
-                                    break
-
-                                response = json.loads(data)
-                                if response["action"] == "start_game":
-                                    waiting_in_lobby = False
-                                    color = response["payload"]["color"]
-                                    usernames = response["payload"]["username"]
-                                    self.start_game(color, usernames)
-                                    break
+                        self.wait_for_game()
+
+                    except KeyboardInterrupt:
+                        self.leave_room()
+                        continue
+
+            elif choice.upper() == "D":
+                self.queue()
+                response = self.reader.read()
+                if response is None:
+                    print("Server no longer online, the client will now exit")
+                    self.exit = True
+                    break
+
+                print(response["payload"])
+                if response["success"] is True:
+                    try:
+                        print("Hit Ctrl-C to leave the queue")
+                        self.wait_for_game()
 
                     except KeyboardInterrupt:
                         self.leave_room()
@@ -0,0 +1,333 @@
+"""
+Message framing shared by the server, the rooms and the player
+
+Every message is sent as a 4 byte big-endian length followed by the message,
+so messages the kernel merges into one segment, or splits over several, are read back whole.
+
+A message is UTF-8 JSON, unless the player asked for the binary protocol in the username handshake.
+Those players are sent game updates and deltas as struct packed binary messages instead,
+which start with their message type rather than the "{" every JSON message starts with.
+Both decode to the same dict, so the rest of the player doesn't know which one was used
+"""
+import json
+import socket
+import struct
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from src.move import PIECE_INDEX, PIECES, SQUARE_INDEX, SQUARE_NAMES, move_to_str, str_to_move
+
+HEADER = struct.Struct("!I")
+MAX_MESSAGE_SIZE: int = 1 << 20
+RECV_SIZE: int = 65536
+
+JSON, BINARY = "json", "binary"
+PROTOCOLS: Tuple[str, ...] = (JSON, BINARY)
+
+# Heartbeat messages, either side answers a ping with a pong
+PING: dict = {"action": "ping"}
+PONG: dict = {"action": "pong"}
+
+# Binary message types, anything but ord("{")
+BINARY_UPDATE, BINARY_DELTA = 1, 2
+
+# type, sequence, gamestate, winner, board of piece indexes, white and black captured count
+UPDATE_HEADER = struct.Struct("!BIBB64sBB")
+# type, sequence, gamestate, winner, move, captured piece index, changed square count
+DELTA_HEADER = struct.Struct("!BIBBHBB")
+# king square (NO_CHECK when not in check), attacking piece count
+CHECK_HEADER = struct.Struct("!BB")
+COUNT = struct.Struct("!H")
+
+GAMESTATES: Tuple[str, ...] = ("Running", "Checkmate", "Stalemate")
+WINNERS: Tuple[str, ...] = ("None", "White", "Black")
+NO_CHECK: int = 255
+# Moves are sent as start, end and movetype, the low 14 bits of a packed move
+WIRE_MOVE_MASK: int = (1 << 14) - 1
+
+
+def encode_message(message: dict) -> bytes:
+    """Return the framed bytes of a message"""
+    payload = json.dumps(message).encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+class SharedMessage:  # pylint: disable=too-few-public-methods
+    """
+    A message sent to many clients that differ in only a few payload keys.
+    The shared payload is serialised once, each client's keys are serialised and spliced onto the end of it
+    """
+
+    def __init__(self, action: str, payload: dict) -> None:
+        # Everything but the closing braces of the payload and the message, so more keys can follow
+        self.head: bytes = json.dumps({"action": action, "payload": payload}).encode()[:-2]
+        self.separator: bytes = b", " if payload else b""
+
+    def encode(self, extra: dict) -> bytes:
+        """Return the framed bytes of the message with extra keys added to its payload"""
+        if not extra:
+            size = len(self.head) + 2
+            return b"".join((HEADER.pack(size), self.head, b"}}"))
+        tail = json.dumps(extra).encode()[1:]  # Drops the opening brace, keeps the closing one
+        size = len(self.head) + len(self.separator) + len(tail) + 1
+        return b"".join((HEADER.pack(size), self.head, self.separator, tail, b"}"))
+
+
+class BinaryMessage:  # pylint: disable=too-few-public-methods
+    """
+    Binary counterpart of SharedMessage.
+    The shared payload is packed once, each client's moves are packed onto the end of it
+    """
+
+    def __init__(self, action: str, payload: dict) -> None:
+        self.head: bytes = BINARY_ENCODERS[action](payload)
+
+    def encode(self, moves: List[int]) -> bytes:
+        """Return the framed bytes of the message with a client's packed moves on the end"""
+        tail = struct.pack(f"!H{len(moves)}H", len(moves), *[move & WIRE_MOVE_MASK for move in moves])
+        return b"".join((HEADER.pack(len(self.head) + len(tail)), self.head, tail))
+
+
+def encode_gamestate(gamestate: dict) -> Tuple[int, int]:
+    """Return the gamestate and winner indexes of a gamestate"""
+    return GAMESTATES.index(gamestate["gamestate"]), WINNERS.index(gamestate["winner"])
+
+
+def encode_strings(strings: List[str]) -> bytes:
+    """Pack a list of short ASCII strings, each prefixed by its length"""
+    parts = [COUNT.pack(len(strings))]
+    for string in strings:
+        data = string.encode()
+        parts.append(bytes((len(data),)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def encode_check_status(check_status: dict) -> bytes:
+    """Pack the king in check and the moves of the pieces attacking it"""
+    if not check_status:
+        return CHECK_HEADER.pack(NO_CHECK, 0)
+    attacking = [str_to_move(move) & WIRE_MOVE_MASK for move in check_status["attacking_pieces"]]
+    king_square = SQUARE_INDEX[check_status["king_location"]]
+    return CHECK_HEADER.pack(king_square, len(attacking)) + struct.pack(f"!{len(attacking)}H", *attacking)
+
+
+def encode_binary_update(payload: dict) -> bytes:
+    """Pack the shared part of a full gamestate update"""
+    board = bytes(PIECE_INDEX[piece] for row in payload["board"] for piece in row)
+    white_captured, black_captured = payload["captured"]["white"], payload["captured"]["black"]
+    header = UPDATE_HEADER.pack(
+        BINARY_UPDATE,
+        payload["sequence"],
+        *encode_gamestate(payload["gamestate"]),
+        board,
+        len(white_captured),
+        len(black_captured),
+    )
+    captured = bytes(PIECE_INDEX[piece] for piece in white_captured + black_captured)
+    return b"".join(
+        (header, captured, encode_strings(payload["move_log"]), encode_check_status(payload["check_status"]))
+    )
+
+
+def encode_binary_delta(payload: dict) -> bytes:
+    """Pack the shared part of a delta update"""
+    changed = payload["changed"]
+    header = DELTA_HEADER.pack(
+        BINARY_DELTA,
+        payload["sequence"],
+        *encode_gamestate(payload["gamestate"]),
+        str_to_move(payload["move"]),
+        PIECE_INDEX[payload["captured"]] if payload["captured"] is not None else 0,
+        len(changed),
+    )
+    squares = bytes(value for square, piece in changed for value in (square, PIECE_INDEX[piece]))
+    log = [payload["log"]] if payload["log"] is not None else []
+    return b"".join((header, squares, encode_strings(log), encode_check_status(payload["check_status"])))
+
+
+BINARY_ENCODERS: Dict[str, Callable[[dict], bytes]] = {"update": encode_binary_update, "delta": encode_binary_delta}
+
+
+class BinaryReader:
+    """Reads the fields of a binary message in order"""
+
+    def __init__(self, data: Union[bytes, bytearray]) -> None:
+        self.data: Union[bytes, bytearray] = data
+        self.offset: int = 0
+
+    def unpack(self, layout: struct.Struct) -> tuple:
+        """Return the values of the next struct"""
+        values = layout.unpack_from(self.data, self.offset)
+        self.offset += layout.size
+        return values
+
+    def read_bytes(self, size: int) -> bytes:
+        """Return the next size bytes"""
+        data = bytes(self.data[self.offset : self.offset + size])
+        self.offset += size
+        return data
+
+    def read_strings(self) -> List[str]:
+        """Return a list of strings packed by encode_strings"""
+        (count,) = self.unpack(COUNT)
+        strings = []
+        for _ in range(count):
+            size = self.data[self.offset]
+            self.offset += 1
+            strings.append(self.read_bytes(size).decode())
+        return strings
+
+    def read_moves(self) -> List[int]:
+        """Return a count prefixed list of packed moves"""
+        (count,) = self.unpack(COUNT)
+        return list(self.unpack(struct.Struct(f"!{count}H")))
+
+    def read_check_status(self) -> dict:
+        """Return a check status packed by encode_check_status"""
+        king_square, count = self.unpack(CHECK_HEADER)
+        if king_square == NO_CHECK:
+            return {}
+        attacking = self.unpack(struct.Struct(f"!{count}H"))
+        return {
+            "king_location": SQUARE_NAMES[king_square],
+            "attacking_pieces": [move_to_str(move) for move in attacking],
+        }
+
+
+def decode_binary_update(reader: BinaryReader) -> dict:
+    """Return the payload of a binary gamestate update"""
+    _, sequence, gamestate, winner, board, white_count, black_count = reader.unpack(UPDATE_HEADER)
+    pieces = [PIECES[piece] for piece in board]
+    captured = [PIECES[piece] for piece in reader.read_bytes(white_count + black_count)]
+    return {
+        "sequence": sequence,
+        "board": [pieces[row : row + 8] for row in range(0, 64, 8)],
+        "captured": {"white": captured[:white_count], "black": captured[white_count:]},
+        "move_log": reader.read_strings(),
+        "check_status": reader.read_check_status(),
+        "gamestate": {"gamestate": GAMESTATES[gamestate], "winner": WINNERS[winner]},
+        "moves": reader.read_moves(),
+    }
+
+
+def decode_binary_delta(reader: BinaryReader) -> dict:
+    """Return the payload of a binary delta update"""
+    _, sequence, gamestate, winner, move, captured, changed_count = reader.unpack(DELTA_HEADER)
+    squares = reader.read_bytes(changed_count * 2)
+    log = reader.read_strings()
+    return {
+        "sequence": sequence,
+        "move": move_to_str(move),
+        "changed": [[squares[index], PIECES[squares[index + 1]]] for index in range(0, len(squares), 2)],
+        "log": log[0] if log else None,
+        "captured": PIECES[captured] if captured else None,
+        "check_status": reader.read_check_status(),
+        "gamestate": {"gamestate": GAMESTATES[gamestate], "winner": WINNERS[winner]},
+        "moves": reader.read_moves(),
+    }
+
+
+BINARY_DECODERS: Dict[int, Tuple[str, Callable[[BinaryReader], dict]]] = {
+    BINARY_UPDATE: ("update", decode_binary_update),
+    BINARY_DELTA: ("delta", decode_binary_delta),
+}
+
+
+def decode_message(data: Union[bytes, bytearray]) -> dict:
+    """Return the message in a frame, JSON or binary"""
+    if data[:1] == b"{":
+        return json.loads(data)
+    message_type = data[0] if data else None
+    if message_type not in BINARY_DECODERS:
+        raise UnknownMessageType(f"Unknown binary message type {message_type}")
+    action, decoder = BINARY_DECODERS[message_type]
+    return {"action": action, "payload": decoder(BinaryReader(data))}
+
+
+class MessageDecoder:  # pylint: disable=too-few-public-methods
+    """
+    Streaming decoder, feed it whatever was received and it returns the messages completed by it.
+    The bytes of an incomplete message are kept in a buffer that is reused for the next feed
+    """
+
+    def __init__(self, max_size: int = MAX_MESSAGE_SIZE) -> None:
+        self.max_size: int = max_size
+        self.buffer: bytearray = bytearray()
+
+    def feed(self, data: bytes) -> List[dict]:
+        """Add received bytes and return every message that is now complete"""
+        buffer = self.buffer
+        buffer += data
+
+        messages: List[dict] = []
+        offset = 0
+        while len(buffer) - offset >= HEADER.size:
+            (size,) = HEADER.unpack_from(buffer, offset)
+            if size > self.max_size:
+                raise MessageTooLarge(f"Message of {size} bytes is over the {self.max_size} byte limit")
+            end = offset + HEADER.size + size
+            if len(buffer) < end:
+                break
+            messages.append(decode_message(buffer[offset + HEADER.size : end]))
+            offset = end
+
+        # Drop everything decoded in one go rather than after every message
+        if offset:
+            del buffer[:offset]
+        return messages
+
+
+class SocketReader:
+    """
+    Reads whole messages from a blocking socket.
+    Heartbeats aren't returned, pings are answered through send and pongs are dropped
+    """
+
+    def __init__(self, sock: socket.socket, send: Optional[Callable[[dict], None]] = None) -> None:
+        self.socket: socket.socket = sock
+        self.send: Callable[[dict], None] = send or (lambda message: sock.sendall(encode_message(message)))
+        self.decoder: MessageDecoder = MessageDecoder()
+        self.messages: Deque[dict] = deque()
+
+    def has_message(self) -> bool:
+        """Return whether a message has already been received and not read yet"""
+        return bool(self.messages)
+
+    def receive(self) -> bool:
+        """Receive once and keep the messages it completes, False if the socket was closed"""
+        data = self.socket.recv(RECV_SIZE)
+        if not data:
+            return False
+        for message in self.decoder.feed(data):
+            if message.get("action") == PING["action"]:
+                self.send(PONG)
+            elif message.get("action") != PONG["action"]:
+                self.messages.append(message)
+        return True
+
+    def read(self) -> Optional[dict]:
+        """Return the next message, waiting for it if needed. None if the socket was closed"""
+        while not self.messages:
+            if not self.receive():
+                return None
+        return self.messages.popleft()
+
+    def read_available(self) -> Optional[List[dict]]:
+        """
+        Return the messages already received, or if there are none the messages completed by a single recv.
+        None if the socket was closed
+        """
+        if not self.messages and not self.receive():
+            return None
+        messages = list(self.messages)
+        self.messages.clear()
+        return messages
+
+
+class MessageTooLarge(Exception):
+    """If a message is over the size limit, the connection can't be trusted any more"""
+
+
+class UnknownMessageType(Exception):
+    """If a binary message has a type this side doesn't know"""
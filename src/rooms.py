@@ -1,52 +1,449 @@
 """Server rooms and room module"""
-import socket
-import json
+import heapq
+import sys
+import threading
 import time
-from typing import Dict
+import uuid
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from src.actor import Mailbox
+from src.bitboard import ENGINE_BACKENDS
+from src.engine_pool import EnginePool
 from src.game import GameEngine
-from src.utils import Singleton
+from src.journal import Journal
+from src.matchmaking import Matchmaker
+from src.move import encode_move, move_key, move_to_str, str_to_move
+from src.protocol import BINARY, JSON, PROTOCOLS, BinaryMessage, SharedMessage, encode_message
+from src.spectators import Spectators
+from src.utils import Connection, Singleton, deep_sizeof
+
+# The lifecycle of a room, the statuses the lobby lists rooms under. A room is open until both players have joined,
+# full until its game starts, in progress until checkmate or stalemate, then finished until it expires.
+# Games resumed from the journal are in progress without players until they join again, or expire
+OPEN, FULL, IN_PROGRESS, FINISHED = "open", "full", "in_progress", "finished"
+ROOM_STATUSES: Tuple[str, ...] = (OPEN, FULL, IN_PROGRESS, FINISHED)
+
+
+def shard_for_room(room_name: str, shards: int) -> int:
+    """Return the shard a room is played on, the same in every process"""
+    return zlib.crc32(room_name.encode()) % shards
+
+
+class RoomDirectory:
+    """
+    The name, creator and players of every room, what the lobby lists and joins look rooms up in.
+    Rooms are indexed by status in the order they were created, and by name, so a page of the lobby
+    costs the size of the page rather than the number of rooms.
+    The number of rooms is capped, for the server and for each creator, and rooms left empty or finished
+    are expired once they have been for their time to live.
+    The sharded server keeps the directory in a manager process every shard calls
+    """
+
+    MAX_ROOMS: int = 10000
+    MAX_ROOMS_PER_CREATOR: int = 5
+    # Seconds a room can be left without players, or be finished, before it expires
+    EMPTY_ROOM_TTL: float = 600.0
+    FINISHED_ROOM_TTL: float = 300.0
+
+    def __init__(self) -> None:
+        self.rooms: Dict[str, Tuple[str, dict]] = {}
+        self.lock = threading.Lock()
+        self.version: int = 0  # Bumped on every change, clients don't list the rooms again while it is the same
+        self.created: int = 0
+        self.numbers: Dict[str, int] = {}  # A room's place in the creation order, what cursors point at
+        self.names: Dict[int, str] = {}
+        self.statuses: Dict[str, str] = {}
+        self.started: Set[str] = set()
+        self.finished: Set[str] = set()
+        self.changed: Dict[str, float] = {}  # When a room's players or status last changed
+        self.creators: Dict[str, int] = {}  # Rooms each creator has
+        self.buckets: Dict[str, List[int]] = {status: [] for status in ROOM_STATUSES}  # Sorted room numbers
+        self.sorted_names: List[str] = []
+
+    def add(self, room_name: str, room_creator: str, capped: bool = True) -> None:
+        """Add a room, unless the name is taken or the room would be over the caps"""
+        with self.lock:
+            if room_name in self.rooms:
+                raise RoomNameAlreadyTaken()
+            if capped and len(self.rooms) >= self.MAX_ROOMS:
+                raise TooManyRooms()
+            if capped and self.creators.get(room_creator, 0) >= self.MAX_ROOMS_PER_CREATOR:
+                raise TooManyRoomsForCreator()
+
+            self.rooms[room_name] = (room_creator, {"white": None, "black": None})
+            self.creators[room_creator] = self.creators.get(room_creator, 0) + 1
+            self.changed[room_name] = time.monotonic()
+            self.created += 1
+            self.numbers[room_name] = self.created
+            self.names[self.created] = room_name
+            self.statuses[room_name] = OPEN
+            self.buckets[OPEN].append(self.created)
+            insort(self.sorted_names, room_name)
+            self.version += 1
+
+    def get(self, room_name: str) -> Optional[Tuple[str, dict]]:
+        """Return the creator and players of a room, None if there is no such room"""
+        return self.rooms.get(room_name)
+
+    def set_players(self, room_name: str, players: dict) -> None:
+        """Update the players listed for a room"""
+        with self.lock:
+            entry = self.rooms.get(room_name)
+            if entry is not None:
+                self.rooms[room_name] = (entry[0], dict(players))
+                self.update_status(room_name)
+                self.version += 1
+
+    def set_started(self, room_name: str) -> None:
+        """List a room's game as in progress"""
+        with self.lock:
+            if room_name in self.rooms:
+                self.started.add(room_name)
+                self.update_status(room_name)
+                self.version += 1
+
+    def set_finished(self, room_name: str, finished: bool) -> None:
+        """List a room's game as finished, or in progress again when the move that ended it is undone"""
+        with self.lock:
+            if room_name in self.rooms:
+                if finished:
+                    self.finished.add(room_name)
+                else:
+                    self.finished.discard(room_name)
+                self.update_status(room_name)
+                self.version += 1
+
+    def update_status(self, room_name: str) -> None:
+        """Move a room to the bucket of its status, the lock is held by the caller"""
+        self.changed[room_name] = time.monotonic()
+        if room_name in self.finished:
+            status = FINISHED
+        elif room_name in self.started:
+            status = IN_PROGRESS
+        elif None in self.rooms[room_name][1].values():
+            status = OPEN
+        else:
+            status = FULL
+
+        previous = self.statuses[room_name]
+        if status != previous:
+            number = self.numbers[room_name]
+            bucket = self.buckets[previous]
+            del bucket[bisect_left(bucket, number)]
+            insort(self.buckets[status], number)
+            self.statuses[room_name] = status
+
+    def remove(self, room_name: str) -> None:
+        """Remove a room"""
+        with self.lock:
+            self.drop(room_name)
+
+    def drop(self, room_name: str) -> None:
+        """Remove a room and its place in the index, the lock is held by the caller"""
+        entry = self.rooms.pop(room_name, None)
+        if entry is None:
+            return
+        room_creator = entry[0]
+        self.creators[room_creator] -= 1
+        if not self.creators[room_creator]:
+            del self.creators[room_creator]
+
+        number = self.numbers.pop(room_name)
+        del self.names[number]
+        bucket = self.buckets[self.statuses.pop(room_name)]
+        del bucket[bisect_left(bucket, number)]
+        del self.sorted_names[bisect_left(self.sorted_names, room_name)]
+        self.started.discard(room_name)
+        self.finished.discard(room_name)
+        del self.changed[room_name]
+        self.version += 1
+
+    def expire(self) -> List[str]:
+        """Remove the rooms left empty, or finished, for longer than their time to live, returns their names"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                self.names[number]
+                for number in heapq.merge(self.buckets[OPEN], self.buckets[IN_PROGRESS])
+                if not any(self.rooms[self.names[number]][1].values())
+                and now - self.changed[self.names[number]] > self.EMPTY_ROOM_TTL
+            ]
+            expired += [
+                self.names[number]
+                for number in self.buckets[FINISHED]
+                if now - self.changed[self.names[number]] > self.FINISHED_ROOM_TTL
+            ]
+            for room_name in expired:
+                self.drop(room_name)
+            return expired
+
+    def missing(self, room_names: List[str]) -> List[str]:
+        """Return the rooms of a list that are no longer in the directory"""
+        return [room_name for room_name in room_names if room_name not in self.rooms]
+
+    def is_full(self) -> bool:
+        """Return whether the server has as many rooms as it is capped at"""
+        return len(self.rooms) >= self.MAX_ROOMS
+
+    def get_version(self) -> int:
+        """Return the version of the directory"""
+        return self.version
+
+    def find_rooms(
+        self, statuses: Iterable[str], prefix: str, cursor: int, limit: int
+    ) -> Tuple[List[dict], Optional[int], int]:
+        """
+        Return a page of the rooms with one of the statuses and a name starting with the prefix,
+        in the order they were created after the room the cursor points at.
+        Also returns the cursor of the next page, None on the last page, and the version the page was read at
+        """
+        with self.lock:
+            if prefix:
+                # The names are sorted, so the ones starting with the prefix are next to each other
+                start = bisect_left(self.sorted_names, prefix)
+                end = bisect_left(self.sorted_names, prefix + chr(sys.maxunicode))
+                matches = (
+                    self.numbers[room_name]
+                    for room_name in self.sorted_names[start:end]
+                    if self.statuses[room_name] in statuses and self.numbers[room_name] > cursor
+                )
+                numbers = heapq.nsmallest(limit + 1, matches)
+            else:
+                # Each bucket is in creation order, merging them from the cursor only reads the page
+                runs = [numbers_after(self.buckets[status], cursor) for status in set(statuses)]
+                numbers = list(islice(heapq.merge(*runs), limit + 1))
+
+            next_cursor = numbers[limit - 1] if len(numbers) > limit else None
+            rooms = []
+            for number in numbers[:limit]:
+                room_name = self.names[number]
+                room_creator, players = self.rooms[room_name]
+                status = self.statuses[room_name]
+                rooms.append({"name": room_name, "creator": room_creator, "players": players, "status": status})
+            return rooms, next_cursor, self.version
+
+
+def numbers_after(bucket: List[int], cursor: int) -> Iterator[int]:
+    """Yield the room numbers of a bucket after the cursor, without copying the bucket"""
+    for index in range(bisect_right(bucket, cursor), len(bucket)):
+        yield bucket[index]
 
 
 @Singleton
 class Room:
     """
     Room class, this object holds an array of rooms objects
-    and acts as a bridge allowing the user to join these rooms
+    and acts as a bridge allowing the user to join these rooms.
+
+    The lock only guards the dict of rooms, everything done to a room is posted to its mailbox
+    and run by the executor the rooms share, so engine work in different rooms runs in parallel.
+
+    Rooms are listed in the directory, the room objects are only made by the shard the room is played on
+    when the first player joins. There is a single shard unless the server is sharded over processes.
+    Every process expires the rooms the directory has, and drops the objects of rooms that are no longer in it
     """
 
+    WORKERS: int = 8
+    # Rooms listed per page of the lobby, and the most a client may ask for
+    PAGE_SIZE: int = 20
+    MAX_PAGE_SIZE: int = 100
+    # Seconds between sweeps for expired rooms
+    EXPIRY_INTERVAL: float = 30.0
+
     def __init__(self) -> None:
         self.game_rooms: Dict[str, "Rooms"] = {}
+        self.lock = threading.Lock()
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(self.WORKERS, thread_name_prefix="room")
+        self.directory: RoomDirectory = RoomDirectory()
+        self.shard: int = 0
+        self.shards: int = 1
+        self.engine_pool: Optional[EnginePool] = None  # Moves are generated on the room's thread without one
+        self.journal: Optional[Journal] = None  # Games are lost when the server stops without one
+        self.matchmaker: Matchmaker = Matchmaker()
+        self.stopped: threading.Event = threading.Event()
+
+    def start(self) -> None:
+        """Start sweeping for expired rooms, the server calls this once it is set up to serve them"""
+        threading.Thread(target=self.expire_periodically, name="room-expiry", daemon=True).start()
+
+    def use_directory(self, directory: RoomDirectory, shard: int, shards: int) -> None:
+        """List rooms in a directory shared with other processes, this one plays the rooms of one shard"""
+        self.directory = directory
+        self.shard = shard
+        self.shards = shards
+
+    def use_engine_pool(self, engine_pool: EnginePool) -> None:
+        """Generate the moves of every room on a pool of worker processes"""
+        self.engine_pool = engine_pool
+
+    def use_journal(self, journal: Journal) -> int:
+        """
+        Resume the games in a journal, then journal the games played from now on. Returns the number resumed.
+        The rooms are listed as they were and their players take back their seats when they join them again.
+        A sharded server only resumes the games of its shard, the others are left in the journal
+        until it is restarted with as many shards as they were played on
+        """
+        started = time.perf_counter()
+        games = journal.recover()
+        resumed = 0
+        for room_name, records in games.items():
+            if self.get_shard(room_name) != self.shard:
+                continue
+            room_creator = records[0]["creator"]
+            self.directory.add(room_name, room_creator, False)
+            game_room = self.game_rooms[room_name] = Rooms(room_name, room_creator, self)
+            game_room.resume(records)
+            resumed += 1
+
+        self.journal = journal
+        journal.start()
+        print(f"Resumed {resumed} of {len(games)} games in the journal in {time.perf_counter() - started:.2f}s")
+        return resumed
+
+    def get_shard(self, room_name: str) -> int:
+        """Return the shard a room is played on"""
+        return shard_for_room(room_name, self.shards)
 
     def create_room(self, room_name: str, room_creator: str) -> None:
         """Creates a room"""
-        if room_name in self.game_rooms:
-            raise RoomNameAlreadyTaken()
-        self.game_rooms[room_name] = Rooms(room_name, room_creator, Room.instance())  # type: ignore
-
-    def join(self, room_name: str, player_address: socket.socket, username: str) -> "Rooms":
-        """Join a room as a player"""
-        if room_name not in self.game_rooms:
+        self.directory.add(room_name, room_creator)
+
+    def create_match_room(self, room_creator: str, opponent: str) -> str:
+        """
+        Create a room for two players the matchmaker paired, returns its name.
+        It isn't held to the caps, players are only queued while the server is under them
+        """
+        while True:
+            room_name = f"{room_creator} vs {opponent} #{uuid.uuid4().hex[:8]}"
+            try:
+                self.directory.add(room_name, room_creator, False)
+                return room_name
+            except RoomNameAlreadyTaken:
+                continue
+
+    def get_game_room(self, room_name: str) -> "Rooms":
+        """Return the room object of a room in the directory, made the first time it is asked for"""
+        entry = self.directory.get(room_name)
+        if entry is None:
             raise RoomNotFound()
 
-        if self.game_rooms[room_name].is_full():
-            raise RoomFull()
+        with self.lock:
+            game_room = self.game_rooms.get(room_name)
+            if game_room is None:
+                game_room = self.game_rooms[room_name] = Rooms(room_name, entry[0], self)
+        return game_room
 
-        self.game_rooms[room_name].join(player_address, username)
-        return self.game_rooms[room_name]
+    def join(self, room_name: str, player_address: Connection, username: str, protocol: str = JSON) -> "Rooms":
+        """Join a room as a player, waits for the room to take them"""
+        game_room = self.get_game_room(room_name)
 
-    def get_all_rooms(self) -> list:
-        """Get a list of all the rooms created"""
-        room_list: list = []
-        if not self.game_rooms:
-            return room_list
+        # Turn away players from full rooms without queueing behind the room's game
+        if game_room.is_full():
+            raise RoomFull()
 
-        for room_name, room_object in self.game_rooms.items():
-            room_list.append((room_name, room_object.get_creator(), room_object.get_players()))
-        return room_list
+        return game_room.mailbox.ask(game_room.join, player_address, username, protocol).result()
+
+    def get_rooms(self, query: dict) -> dict:
+        """
+        Return a page of the rooms, filtered by status and name prefix, with the cursor of the next page.
+        A client that sends the version it last listed the rooms at is told when nothing has changed since
+        """
+        statuses = query.get("status", list(ROOM_STATUSES))
+        if isinstance(statuses, str):
+            statuses = [statuses]
+        prefix = query.get("prefix", "")
+        cursor = query.get("cursor") or 0
+        limit = query.get("limit", self.PAGE_SIZE)
+        if (
+            not isinstance(statuses, list)
+            or not set(statuses) <= set(ROOM_STATUSES)
+            or not isinstance(prefix, str)
+            or not isinstance(cursor, int)
+            or not isinstance(limit, int)
+            or limit < 1
+        ):
+            raise InvalidRoomQuery()
+
+        version = self.directory.get_version()
+        if query.get("version") == version:
+            return {"unchanged": True, "version": version}
+
+        limit = min(limit, self.MAX_PAGE_SIZE)
+        rooms, next_cursor, version = self.directory.find_rooms(statuses, prefix, cursor, limit)
+        return {"rooms": rooms, "next": next_cursor, "version": version}
+
+    def update_players(self, room_name: str, players: dict) -> None:
+        """List the players now in a room"""
+        self.directory.set_players(room_name, players)
+
+    def start_room(self, room_name: str) -> None:
+        """List a room's game as in progress"""
+        self.directory.set_started(room_name)
+
+    def finish_room(self, room_name: str, finished: bool) -> None:
+        """List a room's game as finished, or in progress again"""
+        self.directory.set_finished(room_name, finished)
 
     def del_room(self, room_id: str) -> None:
         """Delete a room"""
-        del self.game_rooms[room_id]
+        with self.lock:
+            self.game_rooms.pop(room_id, None)
+        self.directory.remove(room_id)
+
+    def expire_periodically(self) -> None:
+        """Expire rooms every expiry interval until the rooms are shut down"""
+        while not self.stopped.wait(self.EXPIRY_INTERVAL):
+            try:
+                self.expire_rooms()
+            except (OSError, EOFError):
+                # The sharded server's directory is gone, the server is shutting down
+                break
+
+    def expire_rooms(self) -> List[str]:
+        """
+        Remove the expired rooms from the directory, and close the room objects of every room no longer in it,
+        the ones another process expired or deleted included. Returns the rooms this process expired
+        """
+        expired = self.directory.expire()
+        with self.lock:
+            room_names = list(self.game_rooms)
+        closed = []
+        for room_name in self.directory.missing(room_names):
+            with self.lock:
+                game_room = self.game_rooms.pop(room_name, None)
+            if game_room is not None:
+                game_room.mailbox.tell(game_room.close)
+                closed.append(room_name)
+        if expired or closed:
+            print(f"Expired {len(expired)} rooms, closed {len(closed)} room objects")
+        return expired
+
+    def get_memory_report(self) -> List[dict]:
+        """Return the memory used by each room this process plays, largest first"""
+        with self.lock:
+            game_rooms = list(self.game_rooms.values())
+        futures = [game_room.mailbox.ask(game_room.get_memory_usage) for game_room in game_rooms]
+        report = [future.result() for future in futures]
+        return sorted(report, key=lambda usage: usage["total_bytes"], reverse=True)
+
+    def shutdown(self) -> None:
+        """Stop the room workers, the messages already running are left to finish"""
+        self.stopped.set()
+        report = self.get_memory_report()
+        if report:
+            print(f"Rooms: {len(report)}, {sum(usage['total_bytes'] for usage in report)} bytes, largest: {report[0]}")
+        self.executor.shutdown(wait=False)
+        if self.journal is not None:
+            self.journal.stop()
+            print(f"Journal: {self.journal.get_stats()}")
+        if self.engine_pool is not None:
+            print(f"Engine pool: {self.engine_pool.get_stats()}")
+            self.engine_pool.shutdown()
 
 
 # ---------------------------------------------
@@ -55,57 +452,202 @@ class Room:
 class Rooms:
     """
     The actual room where the clients can player.
-    This rooms holds the GameEngine object and services the data sent by the user
+    This rooms holds the GameEngine object and services the data sent by the user.
+    Only the room's mailbox calls the methods that change it, so one thread at a time runs them.
+    When the server keeps a journal, the room adds a record of every change to its game
     """
 
+    ENGINE_BACKEND: str = "bitboard"
+    # Only generate moves for the player whose turn it is, the idle player is sent an empty move list
+    SIDE_TO_MOVE_ONLY: bool = True
+    # Seconds between telling players their game has started and sending it, their client sets up the board meanwhile
+    START_DELAY: float = 1.0
+
     def __init__(self, room_name: str, room_creator: str, rooms: Room) -> None:
         self.room_name: str = room_name
         self.room_creator: str = room_creator
         self.server_rooms: Room = rooms
+        self.mailbox: Mailbox = Mailbox(rooms.executor)
         self.clients: dict = {"white": None, "black": None}
         self.usernames: dict = {"white": None, "black": None}
+        self.protocols: Dict[str, str] = {"white": JSON, "black": JSON}  # Wire protocol each player asked for
+        self.behind: Set[str] = set()  # Players whose updates are held back until their connection drains
+        self.spectators: Spectators = Spectators(rooms.executor, partial(self.mailbox.tell, self.catch_up_spectator))
         self.game: GameEngine = None  # type: ignore
         self.player_turn: str = "white"
-        self.player_ready = 0
-
-    def join(self, player_address: socket.socket, username: str) -> None:
+        self.ready: Set[str] = set()  # Players waiting for the game to start
+        self.reserved: Dict[str, str] = {}  # Seats of a resumed game kept for the players who had them
+        self.sequence: int = 0  # Bumped every time the game changes, players use it to spot a missed update
+        self.finished: bool = False
+        self.closed: bool = False  # Expired or deleted, the room ignores whatever its players still send
+
+        # Messages serialised for the current sequence, so resends and every recipient reuse the same bytes
+        self.encoded_sequence: int = -1
+        self.shared_messages: Dict[Tuple[str, str], Union[SharedMessage, BinaryMessage]] = {}
+        self.encoded_messages: Dict[Tuple[str, str], bytes] = {}
+
+    def join(self, player_address: Connection, username: str, protocol: str = JSON) -> "Rooms":
         """Join the room"""
+        if self.is_full():
+            raise RoomFull()
 
         # Assign player ID
-        if self.clients.get("white") is None:
-            self.clients["white"] = player_address
-            self.usernames["white"] = username
-        else:
-            self.clients["black"] = player_address
-            self.usernames["black"] = username
-
-    def leave(self, player_address: socket.socket) -> None:
+        color = self.get_seat(username)
+        self.reserved.pop(color, None)
+        self.clients[color] = player_address
+        self.usernames[color] = username
+        self.protocols[color] = protocol
+        self.server_rooms.update_players(self.room_name, self.usernames)
+        return self
+
+    def get_seat(self, username: str) -> str:
+        """Return the seat a player joining takes, the one kept for them or the first nobody has"""
+        for color, reserved in self.reserved.items():
+            if reserved == username and self.clients[color] is None:
+                return color
+        for color, client_address in self.clients.items():
+            if client_address is None and color not in self.reserved:
+                return color
+        raise RoomFull()
+
+    def spectate(self, connection: Connection, protocol: str = JSON) -> None:
+        """Add a spectator, sent a snapshot straight away if the game has started"""
+        snapshot = self.get_spectator_message("update", protocol) if self.is_game_running() else None
+        self.spectators.add(connection, protocol, snapshot)
+
+    def stop_spectating(self, connection: Connection) -> None:
+        """Remove a spectator"""
+        self.spectators.remove(connection)
+
+    def leave(self, player_address: Connection) -> None:
         """Remove a player from a room"""
 
         for color, client_address in dict(self.clients).items():
+            if client_address is None:
+                continue
 
             # Remove player that wants to leave
             if player_address == client_address:
                 self.clients[color] = None
                 self.usernames[color] = None
-                self.player_ready -= 1
+                self.ready.discard(color)
 
             # Remove other player if game in progress
             if player_address != client_address and self.is_game_running():
                 self.clients[color] = None
                 self.usernames[color] = None
-                message = json.dumps({"action": "message", "payload": "You win!"})
-                client_address.send((message).encode())
+                message = {"action": "message", "payload": "You win!"}
+                client_address.sendall(encode_message(message))
                 self.delete_room()
 
+        self.server_rooms.update_players(self.room_name, self.usernames)
+
     def start_game(self) -> None:
         """Start the game with two players join"""
-        self.game = GameEngine()
+        self.game = ENGINE_BACKENDS[Rooms.ENGINE_BACKEND](side_to_move_only=Rooms.SIDE_TO_MOVE_ONLY)
+        self.encoded_sequence = -1
+        self.server_rooms.start_room(self.room_name)
+        self.record(
+            "start",
+            creator=self.room_creator,
+            players=dict(self.usernames),
+            backend=Rooms.ENGINE_BACKEND,
+            side_to_move_only=Rooms.SIDE_TO_MOVE_ONLY,
+        )
 
         # Send them a start payload which will be used to invoke pygame for the player
         for color, address in self.clients.items():
-            message = json.dumps({"action": "start_game", "payload": {"color": color, "username": self.get_players()}})
-            address.send((message).encode())
+            message = {"action": "start_game", "payload": {"color": color, "username": self.get_players()}}
+            address.sendall(encode_message(message))
+
+    def resume(self, records: List[dict]) -> None:
+        """
+        Play a game again from its journal records, the seats are kept for its players until they join again.
+        Every move is made without generating the moves of the positions in between, the notation of each move
+        was journaled with it, so only the position the game is in is generated
+        """
+        start = records[0]
+        self.game = ENGINE_BACKENDS[start["backend"]](side_to_move_only=start["side_to_move_only"])
+        self.reserved = {color: username for color, username in start["players"].items() if username is not None}
+        for record in records[1:]:
+            if record["record"] == "move":
+                self.game.make_move(record["move"], player_invoked=True)
+                self.game.get_fen_move_log().append(record["log"])
+            else:
+                self.game.undo_move(player_invoked=True)
+            self.switch_turns()
+            self.sequence += 1
+
+        self.get_moves_keeping_notation()
+        self.server_rooms.start_room(self.room_name)
+        self.check_finished()
+
+    def resume_player(self, color: str) -> None:
+        """Start the game for a player back in a game the server resumed, and send them where it is"""
+        players = {seat: username or self.reserved.get(seat) for seat, username in self.usernames.items()}
+        message = {"action": "start_game", "payload": {"color": color, "username": players}}
+        self.clients[color].sendall(encode_message(message))
+        self.send_after_start([color])
+
+    def send_after_start(self, colors: List[str]) -> None:
+        """
+        Post the game to the room's mailbox for the players it has started for, after the start delay.
+        A timer waits out the delay, so the room's worker goes on with the other rooms meanwhile
+        """
+        timer = threading.Timer(self.START_DELAY, self.mailbox.tell, (self.send_started_game, colors))
+        timer.daemon = True
+        timer.start()
+
+    def send_started_game(self, colors: List[str]) -> None:
+        """Send the players a game has started for, and the spectators, a snapshot of it, unless it has closed since"""
+        if self.closed or not self.is_game_running():
+            return
+        self.send_players_gamestate([color for color in colors if self.clients[color] is not None])
+        self.send_spectators("update")
+
+    def record(self, record: str, **fields: object) -> None:
+        """Add a record of a change to the room's game to the server's journal, if it keeps one"""
+        journal = self.server_rooms.journal
+        if journal is not None:
+            journal.append({"record": record, "room": self.room_name, **fields})
+
+    def check_finished(self) -> None:
+        """List the room as finished once its game is over, or in progress again if the end was undone"""
+        finished = self.game.get_gamestate()["gamestate"] != "Running"
+        if finished != self.finished:
+            self.finished = finished
+            self.server_rooms.finish_room(self.room_name, finished)
+
+    def close(self) -> None:
+        """Tell the players and spectators the room has closed, and free its game"""
+        self.closed = True
+        if self.game is not None:
+            self.record("close")
+        message = encode_message({"action": "message", "payload": "The room has closed"})
+        for client_address in self.clients.values():
+            if client_address is not None:
+                client_address.sendall(message)
+        self.spectators.broadcast({protocol: message for protocol in PROTOCOLS})
+        for connection in list(self.spectators.joined):
+            self.spectators.remove(connection)
+
+        self.game = None  # type: ignore
+        self.shared_messages.clear()
+        self.encoded_messages.clear()
+
+    def get_memory_usage(self) -> dict:
+        """Return an estimate of the bytes the room's game and its cached messages take"""
+        engine_bytes = deep_sizeof(self.game) if self.game is not None else 0
+        cache_bytes = deep_sizeof(self.shared_messages) + deep_sizeof(self.encoded_messages)
+        return {
+            "room": self.room_name,
+            "players": sum(client_address is not None for client_address in self.clients.values()),
+            "spectators": len(self.spectators),
+            "moves": len(self.game.get_move_log()) if self.game is not None else 0,
+            "engine_bytes": engine_bytes,
+            "cache_bytes": cache_bytes,
+            "total_bytes": engine_bytes + cache_bytes,
+        }
 
     def is_game_running(self) -> bool:
         """Check if the game enigne object has been created"""
@@ -113,63 +655,236 @@ class Rooms:
             return False
         return True
 
-    def send_players_gamestate(self) -> None:
-        """Send the players the new gamestate when a move is made"""
-
-        # JSON payload sent to play to update their board
-
-        new_board = self.game.get_board().tolist()  # type: ignore
-        message: dict = {
-            "action": "update",
-            "payload": {
-                "board": new_board,
-                "moves": "",
-                "move_log": self.game.get_fen_move_log(),
-                "gamestate": self.game.get_gamestate(),
-                "captured": self.game.get_captured_pieces(),
-                "check_status": self.game.get_check_status(),
-            },
+    def get_moves(self) -> None:
+        """Generate the moves of the game's position, on the server's engine pool when it has one"""
+        engine_pool = self.server_rooms.engine_pool
+        if engine_pool is None:
+            self.game.get_moves()
+            return
+
+        try:
+            self.game.get_moves(partial(engine_pool.generate, self.room_name))
+        except BrokenProcessPool:
+            # A worker process died, the room still has to answer its players
+            self.game.get_moves()
+
+    def get_moves_keeping_notation(self) -> None:
+        """
+        Generate the moves of a position the game's notation is already up to date for,
+        after a move is undone or a game is resumed, get_moves would add the latest move to it again
+        """
+        fen_move_log = self.game.get_fen_move_log()[:]
+        self.get_moves()
+        self.game.move_log_fen = fen_move_log
+
+    def get_packed_moves(self, color: str) -> List[int]:
+        """Return the packed moves sent to a player"""
+        if self.game.side_to_move_only and color != self.game.player_turn:
+            # Nothing was generated for the idle player, they can't move until it is their turn
+            return []
+        if color == "black":
+            return self.game.get_black_moves()
+        return self.game.get_white_moves()
+
+    def get_player_moves(self, color: str) -> list:
+        """Return the move strings sent to a player"""
+        return [move_to_str(move) for move in self.get_packed_moves(color)]
+
+    def get_shared_message(self, action: str, protocol: str) -> Union[SharedMessage, BinaryMessage]:
+        """Return the part of an update or delta that is the same for every player on a protocol"""
+        shared = self.shared_messages.get((action, protocol))
+        if shared is None:
+            payload = self.get_snapshot_payload() if action == "update" else self.get_delta_payload()
+            message_class = BinaryMessage if protocol == BINARY else SharedMessage
+            shared = self.shared_messages[(action, protocol)] = message_class(action, payload)
+        return shared
+
+    def check_encoded_messages(self) -> None:
+        """Drop the cached messages if the game changed since they were encoded"""
+        if self.encoded_sequence != self.sequence:
+            self.shared_messages.clear()
+            self.encoded_messages.clear()
+            self.encoded_sequence = self.sequence
+
+    def get_encoded_message(self, action: str, color: str) -> bytes:
+        """Return the framed update or delta for a player, cached until the game changes"""
+        self.check_encoded_messages()
+        key = (action, color)
+        data = self.encoded_messages.get(key)
+        if data is None:
+            shared = self.get_shared_message(action, self.protocols[color])
+            if isinstance(shared, BinaryMessage):
+                data = shared.encode(self.get_packed_moves(color))
+            else:
+                data = shared.encode({"moves": self.get_player_moves(color)})
+            self.encoded_messages[key] = data
+        return data
+
+    def get_spectator_message(self, action: str, protocol: str) -> bytes:
+        """Return the framed update or delta for spectators on a protocol, they have no moves to be sent"""
+        self.check_encoded_messages()
+        key = (action, f"spectator-{protocol}")
+        data = self.encoded_messages.get(key)
+        if data is None:
+            shared = self.get_shared_message(action, protocol)
+            data = shared.encode([]) if isinstance(shared, BinaryMessage) else shared.encode({"moves": []})
+            self.encoded_messages[key] = data
+        return data
+
+    def get_snapshot_payload(self) -> dict:
+        """Return the full gamestate shared by both players"""
+        return {
+            "sequence": self.sequence,
+            "board": self.game.get_board().tolist(),  # type: ignore
+            "move_log": self.game.get_fen_move_log(),
+            "gamestate": self.game.get_gamestate(),
+            "captured": self.game.get_captured_pieces(),
+            "check_status": self.game.get_check_status(),
         }
 
-        # Get the correct moves for the correct player
-        for color, player in self.clients.items():
-            if color == "black":
-                message["payload"]["moves"] = self.game.get_black_moves()
-            if color == "white":
-                message["payload"]["moves"] = self.game.get_white_moves()
-
-            dumped = json.dumps(message)
-            player.send((dumped).encode())
+    def get_delta_payload(self) -> dict:
+        """Return what the latest move changed, shared by both players"""
+        latest_move = self.game.get_move_log()[-1]
+        fen_move_log = self.game.get_fen_move_log()
+        return {
+            "sequence": self.sequence,
+            "move": move_to_str(encode_move(latest_move.start, latest_move.end, latest_move.movetype)),
+            "changed": self.game.get_changed_squares(),
+            "log": fen_move_log[-1] if fen_move_log else None,
+            "captured": latest_move.piece_captured if latest_move.piece_captured != "--" else None,
+            "gamestate": self.game.get_gamestate(),
+            "check_status": self.game.get_check_status(),
+        }
 
-    def service_data(self, data: dict) -> None:
+    def send_players_gamestate(self, colors: Iterable[str] = ("white", "black")) -> None:
+        """Send players a full snapshot of the gamestate, when the game starts or they ask to resync"""
+        for color in colors:
+            self.send_game_message("update", color)
+
+    def send_players_delta(self) -> None:
+        """Send the players only what the latest move changed, then the spectators"""
+        for color in self.clients:
+            self.send_game_message("delta", color)
+        self.send_spectators("delta")
+
+    def send_spectators(self, action: str) -> None:
+        """Hand an update or delta, encoded once per protocol, to the spectators' mailbox to be sent"""
+        if not self.spectators:
+            return
+        protocols = self.spectators.get_protocols()
+        self.spectators.broadcast({protocol: self.get_spectator_message(action, protocol) for protocol in protocols})
+
+    def send_game_message(self, action: str, color: str) -> None:
+        """
+        Send a player an update or delta, unless they have fallen behind reading what they were sent.
+        The updates held back for them are superseded by a single snapshot once they have caught up
+        """
+        player = self.clients[color]
+        if color in self.behind:
+            return
+        if player.is_congested():
+            self.behind.add(color)
+            player.when_drained(partial(self.mailbox.tell, self.catch_up, color))
+            return
+        player.sendall(self.get_encoded_message(action, color))
+
+    def catch_up(self, color: str) -> None:
+        """Send a player who fell behind a snapshot of the game as it is now"""
+        self.behind.discard(color)
+        if self.clients[color] is not None and self.is_game_running():
+            self.send_players_gamestate([color])
+
+    def catch_up_spectator(self, connection: Connection, protocol: str) -> None:
+        """Send a spectator who fell behind a snapshot of the game as it is now"""
+        snapshot = self.get_spectator_message("update", protocol) if self.is_game_running() else None
+        self.spectators.catch_up(connection, snapshot)
+
+    def service_data(self, data: dict, sender: Connection) -> None:
         """Service the data sent by the players"""
+        if self.closed:
+            return
+
         if data["sub_action"] == "make_move":
 
-            color = data["payload"]["color"]
-            move = data["payload"]["move"]
+            # The color is the sender's seat, whatever color the payload claims
+            color = self.get_sender_color(sender)
+            if color is None or not self.is_game_running():
+                return
 
-            if color == self.player_turn:
-                self.game.make_move(move, player_invoked=True)
-                self.game.get_moves()
-                self.switch_turns()
-            else:
+            if color != self.player_turn:
                 player_address = self.clients[color]
-                message = json.dumps({"action": "message", "payload": "'It's not your turn"})
-                player_address.send((message).encode())
+                message = {"action": "message", "payload": "'It's not your turn"}
+                player_address.sendall(encode_message(message))
+                return
+
+            packed_move = self.get_legal_move(color, data["payload"].get("move"))
+            if packed_move is None:
+                message = {"action": "message", "payload": "That move isn't legal"}
+                self.clients[color].sendall(encode_message(message))
                 return
 
-        elif data["sub_action"] == "undo_move":
-            self.game.undo_move()
+            self.game.make_move(packed_move, player_invoked=True)
+            self.get_moves()
+            self.record("move", move=packed_move, log=self.game.get_fen_move_log()[-1])
+            self.switch_turns()
+            self.sequence += 1
+            self.send_players_delta()
+            self.check_finished()
+            return
+
+        if data["sub_action"] == "undo_move":
+            color = self.get_sender_color(sender)
+            if color is None or not self.is_game_running():
+                return
+
+            if not self.game.get_move_log():
+                message = {"action": "message", "payload": "There is no move to undo"}
+                self.clients[color].sendall(encode_message(message))
+                return
+
+            self.game.undo_move(player_invoked=True)
+            self.get_moves_keeping_notation()
+            self.record("undo")
+            self.switch_turns()
+            self.sequence += 1
+            self.check_finished()
+
+        elif data["sub_action"] == "resync":
+            self.send_players_gamestate([data["payload"]["color"]])
+            return
 
         elif data["sub_action"] == "waiting":
-            self.player_ready += 1
-            if self.player_ready == 2:
+            for color, client_address in self.clients.items():
+                if client_address == sender:
+                    self.ready.add(color)
+                    if self.is_game_running():
+                        self.resume_player(color)
+                        return
+            if len(self.ready) == 2:
                 self.start_game()
-                time.sleep(1)
-            else:
-                return
+                self.send_after_start(["white", "black"])
+            return
 
         self.send_players_gamestate()
+        self.send_spectators("update")
+
+    def get_sender_color(self, sender: Connection) -> Optional[str]:
+        """Return the color of the seat a player is sat in, None if they aren't sat in the room"""
+        for color, client_address in self.clients.items():
+            if client_address == sender:
+                return color
+        return None
+
+    def get_legal_move(self, color: str, move: Any) -> Optional[int]:
+        """Return the packed move a player sent if it is one of their legal moves, None if it isn't"""
+        try:
+            key = move_key(str_to_move(move))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        for packed_move in self.get_packed_moves(color):
+            if move_key(packed_move) == key:
+                return packed_move
+        return None
 
     def is_full(self) -> bool:
         """Check if room is full"""
@@ -194,6 +909,7 @@ class Rooms:
 
     def delete_room(self) -> None:
         """Delete the room"""
+        self.record("close")
         self.server_rooms.del_room(self.room_name)
 
 
@@ -207,3 +923,15 @@ class RoomNotFound(Exception):
 
 class RoomNameAlreadyTaken(Exception):
     """If room is already name is already taken when creating"""
+
+
+class InvalidRoomQuery(Exception):
+    """If the filters or cursor of a room listing aren't valid"""
+
+
+class TooManyRooms(Exception):
+    """If the server already has as many rooms as it is capped at when creating"""
+
+
+class TooManyRoomsForCreator(Exception):
+    """If the creator already has as many rooms as they are capped at when creating"""
@@ -1,13 +1,22 @@
 """ Socket module"""  # pylint: disable =redefined-builtin
+import argparse
 import select
 import signal
 import socket
 import sys
+from typing import Union
 
-
+from src.async_server import AsyncServer
+from src.bitboard import ENGINE_BACKENDS
+from src.cache import MOVE_CACHE
 from src.utils import ctrlc_handler, flush_print_default
 from src.client import ThreadedClient
-from src.rooms import Room
+from src.engine_pool import EnginePool
+from src.heartbeat import Heartbeat
+from src.journal import Journal
+from src.outbound import OutboundLoop
+from src.rooms import Room, RoomDirectory
+from src.shard import ShardedServer
 
 print = flush_print_default(print)
 
@@ -22,9 +31,14 @@ class Socket:
         self.sock.listen(2)
         self.running_threads: list = []
         self.server_rooms: Room = Room.instance()  # type: ignore
+        self.outbound: OutboundLoop = OutboundLoop()
+        self.outbound.start()
+        self.heartbeat: Heartbeat = Heartbeat()
+        self.heartbeat.start()
 
     def run(self) -> None:
         """Entry to point to start server"""
+        self.server_rooms.start()
         while True:
             try:  # So we can KeyBoard Interrupt
                 readable, _, _ = select.select([self.sock], [], [], 2)
@@ -33,23 +47,67 @@ class Socket:
                         client, _ = self.sock.accept()
 
                         # Start a new client thread
-                        new_client = ThreadedClient(client, self.server_rooms)
+                        new_client = ThreadedClient(client, self.server_rooms, self.outbound)
                         new_client.start()
+                        self.heartbeat.watch(new_client)
+                        self.running_threads = [thr for thr in self.running_threads if thr.is_alive()]
                         self.running_threads.append(new_client)
 
             except KeyboardInterrupt:
                 self.shutdown()
                 break
         print("Shutting down server")
+        print(f"Move cache: {MOVE_CACHE.get_stats()}")
 
     def shutdown(self) -> None:
         """Shutdown the server"""
+        self.heartbeat.stop()
         for thr in self.running_threads:
             thr.set_event()
+        self.server_rooms.shutdown()
         self.sock.close()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chess server")
+    parser.add_argument("--asyncio", action="store_true", help="serve every connection on one event loop")
+    parser.add_argument("--shards", type=int, default=1, help="play the rooms on this many worker processes")
+    parser.add_argument(
+        "--engine-processes",
+        type=int,
+        default=None,
+        help="generate moves on a pool of worker processes, 0 for one per core (single process servers only)",
+    )
+    parser.add_argument(
+        "--ping-interval",
+        type=float,
+        default=Heartbeat.PING_INTERVAL,
+        help="seconds a client can be quiet before it is pinged",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=Heartbeat.IDLE_TIMEOUT,
+        help="seconds a client can be quiet, pings unanswered, before it is disconnected",
+    )
+    parser.add_argument("--max-rooms", type=int, default=RoomDirectory.MAX_ROOMS, help="rooms the server can have")
+    parser.add_argument(
+        "--max-rooms-per-creator",
+        type=int,
+        default=RoomDirectory.MAX_ROOMS_PER_CREATOR,
+        help="rooms each player can create",
+    )
+    parser.add_argument(
+        "--journal",
+        default=None,
+        help="journal the games to this directory, and resume the games it has when the server starts",
+    )
+    args = parser.parse_args()
+    Heartbeat.PING_INTERVAL = args.ping_interval
+    Heartbeat.IDLE_TIMEOUT = args.idle_timeout
+    RoomDirectory.MAX_ROOMS = args.max_rooms
+    RoomDirectory.MAX_ROOMS_PER_CREATOR = args.max_rooms_per_creator
+
     HOST = socket.gethostbyname(socket.gethostname())
     PORT = 5555
 
@@ -57,7 +115,21 @@ if __name__ == "__main__":
         signal.signal(signal.SIGTSTP, ctrlc_handler)  # type: ignore
     print("-----------------------------")
     print("Starting server...")
-    new_server = Socket(HOST, PORT)
+    new_server: Union[Socket, AsyncServer, ShardedServer]
+    if args.shards > 1:
+        new_server = ShardedServer(HOST, PORT, args.shards, args.journal)
+    elif args.asyncio:
+        new_server = AsyncServer(HOST, PORT)
+    else:
+        new_server = Socket(HOST, PORT)
+
+    if args.engine_processes is not None and args.shards <= 1:
+        engine_pool = EnginePool(args.engine_processes)
+        print(f"Warming up {engine_pool.processes} engine processes...")
+        engine_pool.warm_up(list(ENGINE_BACKENDS.values()))
+        new_server.server_rooms.use_engine_pool(engine_pool)
+    if args.journal is not None and args.shards <= 1:
+        new_server.server_rooms.use_journal(Journal(args.journal))
     print(
         f"""-----------------------------
 The server is now running on;
@@ -0,0 +1,231 @@
+"""
+Multi-process server, rooms are sharded over worker processes so games are played on every core.
+
+The front process accepts every connection and serves the lobby, creating and listing rooms in a directory
+every process shares. When a player joins a room their socket is handed to the worker the room is sharded to,
+which plays the game from then on. Handing sockets between processes needs a Unix platform
+"""  # pylint: disable =redefined-builtin
+import json
+import multiprocessing
+import os
+import select
+import socket
+from multiprocessing.managers import SyncManager
+from typing import List, Optional, Tuple
+
+from src.cache import MOVE_CACHE
+from src.client import ThreadedClient
+from src.heartbeat import Heartbeat
+from src.journal import Journal
+from src.outbound import OutboundLoop
+from src.protocol import MessageTooLarge, UnknownMessageType, encode_message
+from src.rooms import Room, RoomDirectory
+from src.utils import flush_print_default
+
+print = flush_print_default(print)
+
+HANDOFF_SIZE: int = 1 << 16
+
+
+class DirectoryManager(SyncManager):
+    """Manager process holding the room directory, so every shard lists and joins the same rooms"""
+
+
+# Every process calls the directory, and its index, through a proxy to the one in the manager process
+DirectoryManager.register("RoomDirectory", RoomDirectory)
+
+
+def send_connection(channel: socket.socket, client: socket.socket, state: dict) -> None:
+    """Hand a client's socket, and the state of its connection so far, to another process"""
+    socket.send_fds(channel, [json.dumps(state).encode()], [client.fileno()])
+
+
+def receive_connection(channel: socket.socket) -> Tuple[socket.socket, dict]:
+    """Wait for a client's socket handed over by another process"""
+    data, fds, _, _ = socket.recv_fds(channel, HANDOFF_SIZE, 1)
+    return socket.socket(fileno=fds[0]), json.loads(data)
+
+
+class ShardClient(ThreadedClient):
+    """
+    Threaded client that hands itself to the shard a room is played on when the player joins it.
+    The front process plays no rooms, so every join it receives is handed to a worker
+    """
+
+    # Seconds to wait for the replies already sent to reach the client before handing it over
+    HANDOFF_TIMEOUT: float = 5.0
+
+    def __init__(self, client: socket.socket, room: Room, outbound: OutboundLoop, senders: List[socket.socket]) -> None:
+        super().__init__(client, room, outbound)
+        self.senders: List[socket.socket] = senders
+        self.handoff: Optional[Tuple[int, dict]] = None
+        self.pending: List[dict] = []  # Messages received after the join, they are handed over with the socket
+
+    def service_data(self, data: dict) -> None:
+        """Parse the user data and service it, unless it joins or spectates a room on another shard"""
+        if self.handoff is not None:
+            self.pending.append(data)
+            return
+
+        # Players and spectators are both served by the shard the room is played on
+        if data["action"] in ("join", "spectate") and self.server_room.directory.get(data["payload"]) is not None:
+            shard = self.server_room.get_shard(data["payload"])
+            if shard != self.server_room.shard:
+                self.handoff = (shard, data)
+                self.set_event()
+                return
+
+        super().service_data(data)
+
+    def run(self) -> None:
+        """Serve the client until it disconnects or joins a room on another shard"""
+        try:
+            self.serve()
+        finally:
+            if self.handoff is None:
+                self.disconnect()
+                print(f"{self.socket.getsockname()[0]} has disconnected")
+                self.socket.close()
+        if self.handoff is None:
+            return
+
+        shard, join = self.handoff
+        self.connection.wait_drained(self.HANDOFF_TIMEOUT)
+        with self.close_lock:
+            # The shard serves the client from now on, the matchmaker can no longer seat it in this process
+            self.closed = True
+            self.server_room.matchmaker.cancel(self)
+            pending = b"".join(encode_message(message) for message in self.pending) + bytes(self.decoder.buffer)
+        state = {"username": self.username, "protocol": self.protocol, "join": join, "pending": pending.hex()}
+        self.connection.detach()
+        send_connection(self.senders[shard], self.socket, state)
+        self.socket.close()
+
+
+def run_shard(
+    shard: int,
+    shards: int,
+    directory: RoomDirectory,
+    senders: list,
+    receiver: socket.socket,
+    journal_directory: Optional[str] = None,
+) -> None:
+    """Play the rooms of one shard, serving the clients the other processes hand to it"""
+    server_rooms: Room = Room.instance()  # type: ignore
+    server_rooms.use_directory(directory, shard, shards)
+    if journal_directory is not None:
+        # Each shard journals the games it plays in a directory of its own
+        server_rooms.use_journal(Journal(os.path.join(journal_directory, f"shard-{shard}")))
+    server_rooms.start()
+    outbound = OutboundLoop()
+    outbound.start()
+    heartbeat = Heartbeat()
+    heartbeat.start()
+    running_threads: List[ShardClient] = []
+    try:
+        while True:
+            client_socket, state = receive_connection(receiver)
+            client = ShardClient(client_socket, server_rooms, outbound, senders)
+            client.username = state["username"]
+            client.protocol = state["protocol"]
+
+            # Join or spectate first, then whatever the client sent after it before it was handed over
+            client.service_data(state["join"])
+            try:
+                messages = client.decoder.feed(bytes.fromhex(state["pending"]))
+            except (MessageTooLarge, UnknownMessageType, ValueError):
+                # What the client sent can't be decoded, it is disconnected as soon as it starts
+                messages = []
+                client.set_event()
+            for message in messages:
+                client.service_message(message)
+
+            client.start()
+            heartbeat.watch(client)
+            running_threads = [thr for thr in running_threads if thr.is_alive()]
+            running_threads.append(client)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        heartbeat.stop()
+        for thr in running_threads:
+            thr.set_event()
+        server_rooms.shutdown()
+        print(f"Shard {shard} move cache: {MOVE_CACHE.get_stats()}")
+
+
+class ShardedServer:
+    """
+    Front of the sharded server, it accepts the connections and serves the lobby.
+    The games are played by one worker process per shard
+    """
+
+    BACKLOG: int = 1024
+
+    def __init__(self, host: str, port: int, shards: int, journal_directory: Optional[str] = None) -> None:
+        context = multiprocessing.get_context("fork")
+        self.manager: DirectoryManager = DirectoryManager(ctx=context)
+        self.manager.start()  # pylint: disable=consider-using-with
+        directory: RoomDirectory = self.manager.RoomDirectory()  # type: ignore
+
+        # Datagram socket pairs, so every process can hand sockets to a shard without their messages mixing
+        channels = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(shards)]
+        self.senders: List[socket.socket] = [sender for sender, _ in channels]
+        self.workers: list = [
+            context.Process(
+                target=run_shard,
+                args=(shard, shards, directory, self.senders, receiver, journal_directory),
+                name=f"shard-{shard}",
+            )
+            for shard, (_, receiver) in enumerate(channels)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        # Made after the workers are forked, so they don't inherit the front's room workers. The front plays no rooms
+        self.server_rooms: Room = Room.instance()  # type: ignore
+        self.server_rooms.use_directory(directory, -1, shards)
+
+        self.sock: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind((host, port))
+        self.sock.listen(self.BACKLOG)
+        self.running_threads: List[ShardClient] = []
+        self.outbound: OutboundLoop = OutboundLoop()
+        self.outbound.start()
+        self.heartbeat: Heartbeat = Heartbeat()
+        self.heartbeat.start()
+
+    def run(self) -> None:
+        """Entry to point to start server"""
+        self.server_rooms.start()
+        while True:
+            try:  # So we can KeyBoard Interrupt
+                readable, _, _ = select.select([self.sock], [], [], 2)
+                for obj in readable:
+                    if obj is self.sock:
+                        client, _ = self.sock.accept()
+
+                        new_client = ShardClient(client, self.server_rooms, self.outbound, self.senders)
+                        print(f"{client.getsockname()[0]} has connected")
+                        new_client.start()
+                        self.heartbeat.watch(new_client)
+                        self.running_threads = [thr for thr in self.running_threads if thr.is_alive()]
+                        self.running_threads.append(new_client)
+
+            except KeyboardInterrupt:
+                self.shutdown()
+                break
+        print("Shutting down server")
+
+    def shutdown(self) -> None:
+        """Shutdown the server and its shards"""
+        self.heartbeat.stop()
+        for thr in self.running_threads:
+            thr.set_event()
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.server_rooms.shutdown()
+        self.manager.shutdown()
+        self.sock.close()
@@ -0,0 +1,78 @@
+"""Spectators of a room, sent the game as it is played without holding up its players"""
+from concurrent.futures import Executor
+from functools import partial
+from typing import Callable, Dict, Optional, Set
+
+from src.actor import Mailbox
+from src.utils import Connection
+
+
+class Spectators:
+    """
+    The connections watching a room's game.
+    The room encodes each update once per protocol and hands over the bytes, they are written to every spectator
+    by the spectators' own mailbox, so the room goes on with its game however many spectators it has.
+    Spectators that fall behind are skipped until they drain, then sent a snapshot the room encodes for them
+    """
+
+    def __init__(self, executor: Executor, request_snapshot: Callable[[Connection, str], None]) -> None:
+        self.mailbox: Mailbox = Mailbox(executor)
+        self.request_snapshot: Callable[[Connection, str], None] = request_snapshot
+        # The spectators and the protocol they asked for, as the room's thread sees them
+        self.joined: Dict[Connection, str] = {}
+        # The spectators being sent to, only touched by the spectators' mailbox
+        self.connections: Dict[Connection, str] = {}
+        self.behind: Set[Connection] = set()
+
+    def __len__(self) -> int:
+        return len(self.joined)
+
+    def get_protocols(self) -> Set[str]:
+        """Return the protocols the spectators asked for, what each update has to be encoded in"""
+        return set(self.joined.values())
+
+    def add(self, connection: Connection, protocol: str, snapshot: Optional[bytes]) -> None:
+        """Start sending a spectator the game, from a snapshot of it if it has started"""
+        self.joined[connection] = protocol
+        self.mailbox.tell(self.watch, connection, protocol, snapshot)
+
+    def remove(self, connection: Connection) -> None:
+        """Stop sending a spectator the game"""
+        if self.joined.pop(connection, None) is not None:
+            self.mailbox.tell(self.unwatch, connection)
+
+    def broadcast(self, messages: Dict[str, bytes]) -> None:
+        """Send every spectator an encoded message, in the protocol they asked for"""
+        self.mailbox.tell(self.send, messages)
+
+    def catch_up(self, connection: Connection, snapshot: Optional[bytes]) -> None:
+        """Resume sending a spectator that has drained, from a snapshot of the game as it is now"""
+        self.mailbox.tell(self.resume, connection, snapshot)
+
+    def watch(self, connection: Connection, protocol: str, snapshot: Optional[bytes]) -> None:
+        """Add a spectator to the ones being sent to, run by the mailbox"""
+        self.connections[connection] = protocol
+        if snapshot is not None:
+            connection.sendall(snapshot)
+
+    def unwatch(self, connection: Connection) -> None:
+        """Remove a spectator from the ones being sent to, run by the mailbox"""
+        self.connections.pop(connection, None)
+        self.behind.discard(connection)
+
+    def send(self, messages: Dict[str, bytes]) -> None:
+        """Write a message to every spectator that is keeping up, run by the mailbox"""
+        for connection, protocol in self.connections.items():
+            if connection in self.behind:
+                continue
+            if connection.is_congested():
+                self.behind.add(connection)
+                connection.when_drained(partial(self.request_snapshot, connection, protocol))
+                continue
+            connection.sendall(messages[protocol])
+
+    def resume(self, connection: Connection, snapshot: Optional[bytes]) -> None:
+        """Send a spectator that has drained the snapshot it missed the updates for, run by the mailbox"""
+        self.behind.discard(connection)
+        if snapshot is not None and connection in self.connections:
+            connection.sendall(snapshot)
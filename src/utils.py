@@ -1,7 +1,25 @@
 """Util class"""
-from types import FrameType
-from typing import Callable, Type
+from collections import deque
+from types import FrameType, FunctionType, MethodType, ModuleType
+from typing import Callable, List, Protocol, Set, Type
 import sys
+import threading
+
+
+class Connection(Protocol):  # pylint: disable=too-few-public-methods
+    """Anything rooms can send data to a player through, a socket or an asyncio connection"""
+
+    def sendall(self, __data: bytes) -> None:
+        """Send bytes to the player, without waiting for them to be written"""
+
+    def is_congested(self) -> bool:
+        """Return whether the player has fallen behind reading what they were sent"""
+
+    def when_drained(self, __callback: Callable[[], None]) -> None:
+        """Call back once the player has caught up"""
+
+    def abort(self, __reason: str) -> None:
+        """Disconnect the player"""
 
 
 def flush_print_default(func: Callable) -> Callable:
@@ -35,6 +53,35 @@ def ctrlc_handler(signum: int, frame: FrameType) -> None:
     print("Ctrl+Z pressed, but ignored, use Ctrl+C instead")
 
 
+def deep_sizeof(obj: object) -> int:
+    """
+    Return an estimate of the bytes an object and everything it refers to take, counting shared objects once.
+    Classes, modules and functions are counted as references only, they are shared by everything
+    """
+    seen: Set[int] = set()
+    stack: List[object] = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (type, ModuleType, FunctionType, MethodType)):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        else:
+            if hasattr(item, "__dict__"):
+                stack.append(vars(item))
+            for slot in getattr(type(item), "__slots__", ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return size
+
+
 def invert_move(move: str) -> str:
     """Invert a move string for player black"""
     new_string: str = ""
@@ -49,7 +96,7 @@ def invert_move(move: str) -> str:
 
 class Singleton:
     """
-    A non-thread-safe helper class to ease implementing singletons.
+    A thread-safe helper class to ease implementing singletons.
     This should be used as a decorator -- not a metaclass -- to the
     class that should be a singleton.
 
@@ -65,6 +112,7 @@ class Singleton:
 
     def __init__(self, decorated: Type) -> None:
         self._decorated = decorated
+        self._lock = threading.Lock()
 
     def instance(self) -> object:
         """
@@ -76,7 +124,10 @@ class Singleton:
         try:
             return self._instance
         except AttributeError:
-            self._instance: object = self._decorated()
+            with self._lock:
+                # Another thread may have created it while this one waited for the lock
+                if not hasattr(self, "_instance"):
+                    self._instance: object = self._decorated()
             return self._instance
 
     def __call__(self) -> None:
@@ -0,0 +1,12 @@
+"""Zobrist keys for the server side GameEngine positions"""
+import random
+from typing import List
+
+# The keys are made from a fixed seed so every server process gives a position the same key
+_random = random.Random(0x5EED)
+
+# PIECE_KEYS[piece index][square], piece index 0 ("--") is all zeros so empty squares can be xored in freely
+PIECE_KEYS: List[List[int]] = [[0] * 64] + [[_random.getrandbits(64) for _ in range(64)] for _ in range(12)]
+BLACK_TO_MOVE_KEY: int = _random.getrandbits(64)
+CASTLE_RIGHTS_KEYS: List[int] = [_random.getrandbits(64) for _ in range(16)]
+EN_PASSANT_KEYS: List[int] = [_random.getrandbits(64) for _ in range(64)]